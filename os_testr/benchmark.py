@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark subunit-trace and subunit2html on synthetic subunit streams.
+
+Every scenario generates a stream with ``os_testr.utils.synthetic`` and
+every target is run on it in a new python process, so the peak memory
+measured is the one of that target alone. The best of the repeated runs
+is reported and can be saved as JSON and compared against a baseline::
+
+    $ python -m os_testr.benchmark --output baseline.json
+    $ python -m os_testr.benchmark --compare baseline.json
+"""
+
+import argparse
+import collections
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import pbr.version
+
+from os_testr.utils import profiling
+from os_testr.utils import synthetic
+
+__version__ = pbr.version.VersionInfo('os_testr').version_string()
+
+RESULTS_VERSION = 1
+
+SCENARIOS = collections.OrderedDict([
+    ('many-tests', dict(num_tests=20000, workers=8, fail_rate=0.01,
+                        skip_rate=0.05)),
+    ('attachments', dict(num_tests=2000, workers=4, fail_rate=0.1,
+                         skip_rate=0.02, attachment_size=16 * 1024)),
+    ('noisy', dict(num_tests=5000, workers=4, fail_rate=0.02,
+                   skip_rate=0.02, attachment_size=512, stdout_rate=0.25)),
+])
+
+TARGETS = ('trace', 'trace-fast', 'html')
+
+
+def _run_target(target, path):
+    with open(path, 'rb') as stream:
+        if target == 'html':
+            from os_testr import subunit2html
+            with tempfile.NamedTemporaryFile(suffix='.html') as html_file:
+                subunit2html.write_html(stream, html_file.name)
+        else:
+            from os_testr import subunit_trace
+            with open(os.devnull, 'w') as devnull:
+                subunit_trace.trace(stream, devnull,
+                                    fast_decoder=target == 'trace-fast')
+
+
+def measure(target, path):
+    """Run a target on a stream in this process and measure it."""
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    _run_target(target, path)
+    return {
+        'wall_time': time.perf_counter() - start_wall,
+        'cpu_time': time.process_time() - start_cpu,
+        'peak_rss': profiling.peak_rss(),
+    }
+
+
+def _measure_in_subprocess(target, path):
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'os_testr.benchmark', '--measure', target,
+         path])
+    return json.loads(output.decode('utf8'))
+
+
+def run_benchmarks(scenarios, targets, repeat=3, tmp_dir=None,
+                   measure_func=_measure_in_subprocess):
+    """Benchmark the targets on the streams of the scenarios.
+
+    :param scenarios: A dict of scenario names to ``generate_stream()``
+        arguments.
+    :param targets: The names of the targets to run, see ``TARGETS``.
+    :param repeat: The number of runs of each target, the fastest is kept.
+    :return: A list of result dicts, one per scenario and target.
+    """
+    results = []
+    for name, options in scenarios.items():
+        with tempfile.NamedTemporaryFile(suffix='.subunit',
+                                         dir=tmp_dir) as stream:
+            synthetic.generate_stream(stream, **options)
+            stream.flush()
+            stream_bytes = stream.tell()
+            num_tests = options.get('num_tests', 1000)
+            for target in targets:
+                runs = [measure_func(target, stream.name)
+                        for _ in range(max(repeat, 1))]
+                best = min(runs, key=lambda run: run['wall_time'])
+                peaks = [run['peak_rss'] for run in runs
+                         if run['peak_rss'] is not None]
+                results.append({
+                    'scenario': name,
+                    'target': target,
+                    'options': options,
+                    'tests': num_tests,
+                    'stream_bytes': stream_bytes,
+                    'wall_time': best['wall_time'],
+                    'cpu_time': best['cpu_time'],
+                    'tests_per_second': num_tests / best['wall_time'],
+                    'peak_rss': min(peaks) if peaks else None,
+                })
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare results with the results of a baseline run.
+
+    :param tolerance: The fraction by which the throughput may drop or the
+        peak memory may grow before it counts as a regression.
+    :return: A list of (scenario, target, metric, baseline, current) tuples
+        for the regressions found.
+    """
+    previous = dict(((r['scenario'], r['target']), r)
+                    for r in baseline['results'])
+    regressions = []
+    for result in results:
+        old = previous.get((result['scenario'], result['target']))
+        if old is None:
+            continue
+        if result['tests_per_second'] < (
+                old['tests_per_second'] * (1 - tolerance)):
+            regressions.append((result['scenario'], result['target'],
+                                'tests_per_second', old['tests_per_second'],
+                                result['tests_per_second']))
+        if (result['peak_rss'] and old['peak_rss'] and
+                result['peak_rss'] > old['peak_rss'] * (1 + tolerance)):
+            regressions.append((result['scenario'], result['target'],
+                                'peak_rss', old['peak_rss'],
+                                result['peak_rss']))
+    return regressions
+
+
+def speedups(results, target='trace-fast', reference='trace'):
+    """Get how many times faster a target is than another, by scenario.
+
+    This is how the fast decoder is checked to pay off, the scenarios
+    where only one of the targets was run are left out.
+    """
+    wall_times = dict(((r['scenario'], r['target']), r['wall_time'])
+                      for r in results)
+    ratios = collections.OrderedDict()
+    for result in results:
+        scenario = result['scenario']
+        if result['target'] == target and (scenario, reference) in wall_times:
+            ratios[scenario] = (wall_times[scenario, reference] /
+                                result['wall_time'])
+    return ratios
+
+
+def _print_results(stream, results, baseline=None):
+    previous = {}
+    if baseline is not None:
+        previous = dict(((r['scenario'], r['target']), r)
+                        for r in baseline['results'])
+    stream.write('%-12s %-11s %8s %10s %9s %9s\n' % (
+        'scenario', 'target', 'tests', 'tests/sec', 'wall (s)', 'peak MiB'))
+    for result in results:
+        peak = result['peak_rss']
+        line = '%-12s %-11s %8d %10.1f %9.3f %9s' % (
+            result['scenario'], result['target'], result['tests'],
+            result['tests_per_second'], result['wall_time'],
+            '%.1f' % (peak / 1024.0 / 1024) if peak else 'N/A')
+        old = previous.get((result['scenario'], result['target']))
+        if old is not None:
+            line += ' (%+.1f%% tests/sec)' % (
+                (result['tests_per_second'] / old['tests_per_second'] - 1) *
+                100)
+        stream.write(line + '\n')
+    for scenario, ratio in speedups(results).items():
+        stream.write('%-12s trace-fast is %.1fx as fast as trace\n' % (
+            scenario, ratio))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark subunit-trace and subunit2html on synthetic '
+                    'subunit streams')
+    parser.add_argument('--version', action='version',
+                        version='%s' % __version__)
+    parser.add_argument('--scenario', action='append',
+                        choices=list(SCENARIOS),
+                        help='A scenario to run, can be given more than '
+                             'once. By default all of them are run, unless '
+                             'a custom stream is described with the options '
+                             'below.')
+    parser.add_argument('--target', action='append', choices=TARGETS,
+                        help='A target to benchmark, can be given more than '
+                             'once. By default all of them are run.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of runs of each target, the '
+                             'fastest one is reported')
+    custom = parser.add_argument_group('custom stream')
+    custom.add_argument('--tests', type=int, dest='num_tests',
+                        help='The number of tests in the stream')
+    custom.add_argument('--workers', type=int,
+                        help='The number of workers running the tests')
+    custom.add_argument('--fail-rate', type=float,
+                        help='The fraction of tests which fail')
+    custom.add_argument('--skip-rate', type=float,
+                        help='The fraction of tests which are skipped')
+    custom.add_argument('--attachment-size', type=int,
+                        help='The size in bytes of the stdout attachment '
+                             'of each test')
+    custom.add_argument('--stdout-rate', type=float,
+                        help='The fraction of tests preceded by non-subunit '
+                             'output')
+    custom.add_argument('--seed', type=int,
+                        help='The seed of the random stream')
+    parser.add_argument('--output', '-o',
+                        help='Save the results as JSON to this file')
+    parser.add_argument('--compare',
+                        help='Compare the results with the JSON results of '
+                             'a previous run and fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='The fraction by which throughput may drop or '
+                             'peak memory may grow before --compare reports '
+                             'a regression, 0.1 by default')
+    parser.add_argument('--measure', nargs=2, metavar=('TARGET', 'PATH'),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.measure:
+        json.dump(measure(*args.measure), sys.stdout)
+        return 0
+
+    custom = dict((key, getattr(args, key)) for key in (
+        'num_tests', 'workers', 'fail_rate', 'skip_rate', 'attachment_size',
+        'stdout_rate', 'seed') if getattr(args, key) is not None)
+    scenarios = collections.OrderedDict(
+        (name, SCENARIOS[name]) for name in args.scenario or ())
+    if custom:
+        scenarios['custom'] = custom
+    elif not scenarios:
+        scenarios = SCENARIOS
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = run_benchmarks(scenarios, args.target or TARGETS, args.repeat)
+    _print_results(sys.stdout, results, baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'version': RESULTS_VERSION,
+                'os_testr': __version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, output_file, indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for scenario, target, metric, old, new in regressions:
+            sys.stdout.write('REGRESSION %s %s: %s %.1f -> %.1f\n' % (
+                scenario, target, metric, old, new))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,6 +21,8 @@ import pbr.version
 import subunit
 from subunit import iso8601
 
+from os_testr.utils import profiling
+
 
 __version__ = pbr.version.VersionInfo('os_testr').version_string()
 
@@ -30,28 +32,36 @@ def main():
         print(__version__)
         exit(0)
 
-    start_time = datetime.datetime.fromtimestamp(float(sys.argv[1])).replace(
+    profile_args, argv = profiling.parse_known_args(sys.argv[1:])
+    start_time = datetime.datetime.fromtimestamp(float(argv[0])).replace(
         tzinfo=iso8601.UTC)
-    elapsed_time = datetime.timedelta(seconds=int(sys.argv[2]))
+    elapsed_time = datetime.timedelta(seconds=int(argv[1]))
     stop_time = start_time + elapsed_time
 
-    if len(sys.argv) > 3:
-        status = sys.argv[3]
+    if len(argv) > 2:
+        status = argv[2]
     else:
         status = 'success'
 
-    if len(sys.argv) > 4:
-        test_id = sys.argv[4]
+    if len(argv) > 3:
+        test_id = argv[3]
     else:
         test_id = 'devstack'
 
-    # Write the subunit test
-    output = subunit.v2.StreamResultToBytes(sys.stdout)
-    output.startTestRun()
-    output.status(timestamp=start_time, test_id=test_id)
-    # Write the end of the test
-    output.status(test_status=status, timestamp=stop_time, test_id=test_id)
-    output.stopTestRun()
+    profiler = profiling.from_args('generate-subunit', profile_args)
+    try:
+        with profiling.phase(profiler, 'write'):
+            # Write the subunit test
+            output = subunit.v2.StreamResultToBytes(sys.stdout)
+            output.startTestRun()
+            output.status(timestamp=start_time, test_id=test_id)
+            # Write the end of the test
+            output.status(test_status=status, timestamp=stop_time,
+                          test_id=test_id)
+            output.stopTestRun()
+    finally:
+        if profiler is not None:
+            profiler.close()
 
 
 if __name__ == '__main__':
@@ -20,7 +20,8 @@ http://tungwaiyip.info/software/HTMLTestRunner.html
 
 Takes two arguments. First argument is path to subunit log file, second
 argument is path of desired output file. Second argument is optional,
-defaults to 'results.html'.
+defaults to 'results.html'. See --help for the --cluster-failures and
+profiling options.
 
 Original HTMLTestRunner License:
 ------------------------------------------------------------------------
@@ -53,11 +54,11 @@ NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import argparse
 import codecs
 import collections
 import datetime
 import io
-import sys
 import traceback
 from xml.sax import saxutils
 
@@ -65,6 +66,12 @@ import pbr.version
 import subunit
 import testtools
 
+from os_testr.utils import clustering
+from os_testr.utils import compression
+from os_testr.utils import profiling
+from os_testr.utils import sinks
+from os_testr.utils import testids
+
 
 __version__ = pbr.version.VersionInfo('os_testr').version_string()
 
@@ -294,17 +301,17 @@ a.popup_link:hover {
     margin-top: 3ex;
     margin-bottom: 1ex;
 }
-#result_table {
+#result_table, #cluster_table {
     width: 100%;
     border-collapse: collapse;
     border: 1px solid #777;
 }
-#header_row {
+#header_row, #cluster_header_row {
     font-weight: bold;
     color: white;
     background-color: #777;
 }
-#result_table td {
+#result_table td, #cluster_table td {
     border: 1px solid #777;
     padding: 2px;
 }
@@ -439,6 +446,50 @@ onclick="document.getElementById('div_%(tid)s').style.display = 'none' " >
 %(id)s: %(output)s
 """  # variables: (id, output)
 
+    REPORT_CLUSTERS_TMPL = """
+<p id='cluster_line'><strong>Failure clusters</strong></p>
+<table id='cluster_table'>
+<colgroup>
+<col align='left' />
+<col align='right' />
+<col align='left' />
+</colgroup>
+<tr id='cluster_header_row'>
+    <td>Failure</td>
+    <td>Count</td>
+    <td>Tests</td>
+</tr>
+%(cluster_list)s
+</table>
+"""  # variables: (cluster_list)
+
+    REPORT_CLUSTER_TMPL = r"""
+<tr id='%(cid)s'>
+    <td class='failCase'>
+
+    <!--css div popup start-->
+    <a class="popup_link" onfocus='this.blur();'
+    href="javascript:showTestDetail('div_%(cid)s')" >
+        %(signature)s: %(headline)s</a>
+
+    <div id='div_%(cid)s' class="popup_window">
+        <div style='text-align: right; color:red;cursor:pointer'>
+        <a onfocus='this.blur();'
+onclick="document.getElementById('div_%(cid)s').style.display = 'none' " >
+           [x]</a>
+        </div>
+        <pre>
+        %(output)s
+        </pre>
+    </div>
+    <!--css div popup end-->
+
+    </td>
+    <td class="small">%(count)s</td>
+    <td>%(tests)s</td>
+</tr>
+"""  # variables: (cid, signature, headline, output, count, tests)
+
     # ------------------------------------------------------------------------
     # ENDING
     #
@@ -460,7 +511,7 @@ class ClassInfoWrapper(object):
 class HtmlOutput(testtools.TestResult):
     """Output test results in html."""
 
-    def __init__(self, html_file='result.html'):
+    def __init__(self, html_file='result.html', cluster_failures=False):
         super(HtmlOutput, self).__init__()
         self.success_count = 0
         self.failure_count = 0
@@ -468,20 +519,46 @@ class HtmlOutput(testtools.TestResult):
         self.skip_count = 0
         self.result = []
         self.html_file = html_file
+        self.test_ids = testids.TestIdRegistry()
+        self.clusters = None
+        if cluster_failures:
+            self.clusters = clustering.FailureClusters()
+
+    def _result_test(self, test, output):
+        # A test only described by its id is kept as the handle of its id,
+        # which is all the report needs of it: that lets go of the test and
+        # its attachments as soon as it is added.
+        if (output == test.id() and not hasattr(test, '_tests') and
+                not hasattr(test, 'test')):
+            return self.test_ids.handle(output)
+        return test
+
+    def _clustered(self, test, exc_str):
+        # Only the first failure of a cluster keeps its traceback, the
+        # others refer to it and the cluster is listed after the results.
+        if self.clusters is None:
+            return exc_str
+        cluster = self.clusters.add(test.id(), exc_str)
+        if cluster.count == 1:
+            cluster.sample = exc_str
+        elif cluster is not self.clusters.overflow:
+            return 'Same failure as %s, see failure cluster %s\n' % (
+                cluster.first, cluster.signature)
+        return exc_str
 
     def addSuccess(self, test):
         self.success_count += 1
         output = test.shortDescription()
         if output is None:
             output = test.id()
-        self.result.append((0, test, output, ''))
+        self.result.append((0, self._result_test(test, output), output, ''))
 
     def addSkip(self, test, err):
         output = test.shortDescription()
         if output is None:
             output = test.id()
         self.skip_count += 1
-        self.result.append((3, test, output, ''))
+        self.result.append((3, self._result_test(test, output), output, ''))
 
     def addError(self, test, err):
         output = test.shortDescription()
@@ -493,17 +570,18 @@ class HtmlOutput(testtools.TestResult):
         #     self.result.append((3, test, output, ''))
         else:
             self.error_count += 1
-            _exc_str = self.formatErr(err)
-            self.result.append((2, test, output, _exc_str))
+            _exc_str = self._clustered(test, self.formatErr(err))
+            self.result.append(
+                (2, self._result_test(test, output), output, _exc_str))
 
     def addFailure(self, test, err):
-        print(test)
         self.failure_count += 1
-        _exc_str = self.formatErr(err)
+        _exc_str = self._clustered(test, self.formatErr(err))
         output = test.shortDescription()
         if output is None:
             output = test.id()
-        self.result.append((1, test, output, _exc_str))
+        self.result.append(
+            (1, self._result_test(test, output), output, _exc_str))
 
     def formatErr(self, err):
         exctype, value, tb = err
@@ -612,8 +690,25 @@ class HtmlOutput(testtools.TestResult):
             error=str(self.error_count),
             skip=str(self.skip_count),
         )
+        if self.clusters:
+            report += self._generate_clusters()
         return report
 
+    def _generate_clusters(self):
+        rows = []
+        for cid, cluster in enumerate(self.clusters):
+            rows.append(TemplateData.REPORT_CLUSTER_TMPL % dict(
+                cid='cl%s' % (cid + 1),
+                signature=cluster.signature,
+                headline=saxutils.escape(cluster.headline),
+                output=saxutils.escape(cluster.sample or ''),
+                count=cluster.count,
+                tests='<br/>'.join(saxutils.escape(test_id)
+                                   for test_id in cluster.tests),
+            ))
+        return TemplateData.REPORT_CLUSTERS_TMPL % dict(
+            cluster_list=''.join(rows))
+
     def _sortResult(self, result_list):
         # unittest does not seems to run in any particular order.
         # Here at least we want to group them together by class.
@@ -651,19 +746,24 @@ class HtmlOutput(testtools.TestResult):
         return r
 
     def _add_cls(self, rmap, classes, test, data_tuple):
-        if hasattr(test, 'test'):
-            test = test.test
-        if test.__class__ == subunit.RemotedTestCase:
-            cl = test._RemotedTestCase__description.rsplit('.', 1)[0]
+        if isinstance(test, int):
+            handle = test
         else:
-            cl = test.id().rsplit('.', 1)[0]
-        mod = cl.rsplit('.', 1)[0]
-        cls = ClassInfoWrapper(cl, mod)
-        if not str(cls) in rmap:
-            rmap[str(cls)] = []
-            classes.append(cls)
-        rmap[str(cls)].append(data_tuple)
-        return str(cls)
+            if hasattr(test, 'test'):
+                test = test.test
+            if test.__class__ == subunit.RemotedTestCase:
+                test_id = test._RemotedTestCase__description
+            else:
+                test_id = test.id()
+            handle = self.test_ids.handle(test_id)
+        # the class names are interned, a class and its wrapper are only
+        # created once for all its tests
+        cl = self.test_ids.class_name(handle)
+        if cl not in rmap:
+            rmap[cl] = []
+            classes.append(ClassInfoWrapper(cl, cl.rsplit('.', 1)[0]))
+        rmap[cl].append(data_tuple)
+        return cl
 
     def _generate_report_test(self, rows, cid, tid, n, t, o, e):
         # e.g. 'pt1.1', 'ft1.1', etc
@@ -671,12 +771,17 @@ class HtmlOutput(testtools.TestResult):
         has_output = bool(o or e)
         tid = ((n == 0 or n == 3) and
                'p' or 'f') + 't%s.%s' % (cid + 1, tid + 1)
-        name = t.id().split('.')[-1]
-        # if shortDescription is not the function name, use it
-        if t.shortDescription().find(name) == -1:
-            doc = t.shortDescription()
-        else:
+        if isinstance(t, int):
+            # a test only described by its id, see _result_test()
+            name = self.test_ids.test_id(t).split('.')[-1]
             doc = None
+        else:
+            name = t.id().split('.')[-1]
+            # if shortDescription is not the function name, use it
+            if t.shortDescription().find(name) == -1:
+                doc = t.shortDescription()
+            else:
+                doc = None
         desc = doc and ('%s: %s' % (name, doc)) or name
         tmpl = (has_output and TemplateData.REPORT_TEST_WITH_OUTPUT_TMPL or
                 TemplateData.REPORT_TEST_NO_OUTPUT_TMPL)
@@ -730,43 +835,127 @@ class FileAccumulator(testtools.StreamResult):
         stream.write(file_bytes)
 
 
-def main():
-    if '--version' in sys.argv:
-        print(__version__)
-        exit(0)
+def _process_v1(html_result, streams):
+    """Run the v1 subunit content found in the streams into the result."""
+    for bytes_io in streams:
+        bytes_io.seek(0)
+        suite = subunit.ProtocolTestCase(bytes_io)
+        suite.run(html_result)
 
-    if len(sys.argv) < 2:
-        print("Need at least one argument: path to subunit log.")
-        exit(1)
-    subunit_file = sys.argv[1]
-    if len(sys.argv) > 2:
-        html_file = sys.argv[2]
-    else:
-        html_file = 'results.html'
 
-    html_result = HtmlOutput(html_file)
-    stream = open(subunit_file, 'rb')
+class HtmlSink(sinks.Sink):
+    """Write the HTML report of a run traced by subunit-trace.
+
+    This is the ``sinks.Sink`` counterpart of ``write_html()``, for a report
+    written from the same decode of the stream as the trace output.
+    """
+
+    def __init__(self, html_file='results.html', cluster_failures=False):
+        self.html_result = HtmlOutput(html_file, cluster_failures)
+        # The HTML output code is in legacy mode.
+        self._result = testtools.ExtendedToOriginalDecorator(self.html_result)
+        # the output of each worker is kept apart, like write_html() does
+        self._files = FileAccumulator()
+        self._result.startTestRun()
+
+    def test(self, record, test):
+        testtools.testresult.real.test_dict_to_case(test).run(self._result)
+
+    def file(self, file_name, file_bytes, route_code=None):
+        self._files.status(file_name=file_name, file_bytes=file_bytes,
+                           route_code=route_code)
+
+    def close(self, summary):
+        _process_v1(self.html_result, self._files.route_codes.values())
+        self._result.stopTestRun()
+
+
+def _instrument(html_result, profiler):
+    for name in ('addSuccess', 'addSkip', 'addError', 'addFailure'):
+        setattr(html_result, name,
+                profiler.wrap('results', getattr(html_result, name)))
+    html_result._generate_report = profiler.wrap(
+        'render', html_result._generate_report)
+
+
+def write_html(stream, html_file='results.html', profiler=None,
+               cluster_failures=False):
+    """Write the HTML report of a subunit byte stream to ``html_file``.
+
+    A gzip or zstd compressed stream is decompressed while it is read.
+
+    With ``cluster_failures`` the failures are grouped by the signature of
+    their traceback, see ``clustering.FailureClusters``, only the first
+    failure of each cluster keeps its traceback and the clusters are listed
+    after the results with their tests.
+
+    A ``profiling.PhaseProfiler`` passed as ``profiler`` gets the time spent
+    decoding the stream, collecting the results, reprocessing the v1 content
+    and writing out the report.
+    """
+    html_result = HtmlOutput(html_file, cluster_failures)
+    if profiler is not None:
+        _instrument(html_result, profiler)
 
-    # Feed the subunit stream through both a V1 and V2 parser.
-    # Depends on having the v2 capable libraries installed.
-    # First V2.
-    # Non-v2 content and captured non-test output will be presented as file
-    # segments called stdout.
-    suite = subunit.ByteStreamToStreamResult(stream, non_subunit_name='stdout')
     # The HTML output code is in legacy mode.
     result = testtools.StreamToExtendedDecorator(html_result)
     # Divert non-test output
     accumulator = FileAccumulator()
     result = testtools.StreamResultRouter(result)
     result.add_rule(accumulator, 'test_id', test_id=None)
+    if profiler is not None:
+        result.status = profiler.counting('events', result.status)
     result.startTestRun()
-    suite.run(result)
+    # Feed the subunit stream through both a V1 and V2 parser.
+    # Depends on having the v2 capable libraries installed.
+    # First V2.
+    # Non-v2 content and captured non-test output will be presented as file
+    # segments called stdout.
+    with profiling.phase(profiler, 'decode'):
+        with compression.decompressed(stream) as decompressed:
+            suite = subunit.ByteStreamToStreamResult(
+                decompressed, non_subunit_name='stdout')
+            suite.run(result)
     # Now reprocess any found stdout content as V1 subunit
-    for bytes_io in accumulator.route_codes.values():
-        bytes_io.seek(0)
-        suite = subunit.ProtocolTestCase(bytes_io)
-        suite.run(html_result)
-    result.stopTestRun()
+    with profiling.phase(profiler, 'v1'):
+        _process_v1(html_result, accumulator.route_codes.values())
+    with profiling.phase(profiler, 'report'):
+        result.stopTestRun()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a subunit stream to an html results file")
+    parser.add_argument('--version', action='version',
+                        version='%s' % __version__)
+    parser.add_argument('--cluster-failures', action='store_true',
+                        help="Group the failures by the signature of their "
+                             "traceback, only the first failure of each "
+                             "group keeps its traceback")
+    profiling.add_arguments(parser)
+    parser.add_argument('subunit_file', metavar='subunit_stream',
+                        help="Path to the subunit stream, which may be gzip "
+                             "or zstd compressed")
+    parser.add_argument('html_file', metavar='output', nargs='?',
+                        default='results.html',
+                        help="Path of the html results file, defaults to "
+                             "results.html")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    profiler = profiling.from_args('subunit2html', args)
+    try:
+        with open(args.subunit_file, 'rb') as stream:
+            write_html(stream, args.html_file, profiler=profiler,
+                       cluster_failures=args.cluster_failures)
+    except compression.DecompressionError as e:
+        print(e)
+        exit(1)
+    finally:
+        if profiler is not None:
+            profiler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Merge the subunit v2 streams of several nodes into one stream."""
+
+import argparse
+import contextlib
+import sys
+
+import pbr.version
+
+from os_testr.utils import compression
+from os_testr.utils import merge
+from os_testr.utils import profiling
+
+__version__ = pbr.version.VersionInfo('os_testr').version_string()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merge subunit v2 streams into one, in the order of "
+                    "their timestamps, with their workers renumbered")
+    parser.add_argument('--version', action='version',
+                        version='%s' % __version__)
+    parser.add_argument('--output', '-o', metavar='FILE',
+                        help="Write the merged stream to FILE instead of "
+                             "stdout")
+    parser.add_argument('inputs', nargs='+', metavar='FILE',
+                        help="The subunit files to merge, they can be gzip "
+                             "or zstd compressed")
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def merge_files(paths, output):
+    """Merge subunit files, see ``merge.merge_streams()``."""
+    with contextlib.ExitStack() as stack:
+        sources = [
+            stack.enter_context(compression.decompressed(
+                stack.enter_context(open(path, 'rb'))))
+            for path in paths]
+        return merge.merge_streams(sources, output)
+
+
+def main():
+    args = parse_args()
+    profiler = profiling.from_args('subunit-merge', args)
+    try:
+        with profiling.phase(profiler, 'merge'):
+            if args.output:
+                with open(args.output, 'wb') as output:
+                    merge_files(args.inputs, output)
+            else:
+                merge_files(args.inputs, sys.stdout.buffer)
+                sys.stdout.buffer.flush()
+    except (OSError, compression.DecompressionError) as e:
+        sys.exit(str(e))
+    finally:
+        if profiler is not None:
+            profiler.close()
+
+
+if __name__ == '__main__':
+    main()
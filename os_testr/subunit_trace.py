@@ -19,29 +19,46 @@
 """Trace a subunit stream in reasonable detail and high accuracy."""
 
 import argparse
+import codecs
+import collections
+from concurrent import futures
 import datetime
 import functools
+import glob
+import io
+import itertools
+import json
 import os
 import re
+import signal
 import sys
+import time
 
 import pbr.version
 import subunit
-from subunit import test_results
 import testtools
 
+from os_testr import subunit2html
+from os_testr.utils import aggregate
+from os_testr.utils import balance
+from os_testr.utils import clustering
 from os_testr.utils import colorizer
-
-# NOTE(mtreinish) on python3 anydbm was renamed dbm and the python2 dbm module
-# was renamed to dbm.ndbm, this block takes that into account
-try:
-    import anydbm as dbm
-except ImportError:
-    import dbm
+from os_testr.utils import compression
+from os_testr.utils import jsonl
+from os_testr.utils import output
+from os_testr.utils import profiling
+from os_testr.utils import progress
+from os_testr.utils import regression
+from os_testr.utils import sinks
+from os_testr.utils import stats
+from os_testr.utils import subunit_v2
+from os_testr.utils import tail
+from os_testr.utils import testids
+from os_testr.utils import timing
 
 DAY_SECONDS = 60 * 60 * 24
-FAILS = []
-RESULTS = {}
+# The lines of the attachments printed are indented by this much
+ATTACHMENT_INDENT = '    '
 
 
 def total_seconds(timedelta):
@@ -51,6 +68,119 @@ def total_seconds(timedelta):
             timedelta.microseconds) / 10 ** 6
 
 
+class ResultCounters(object):
+    """Running aggregates of the test results seen so far.
+
+    The counters are updated once per test as results arrive so the summary
+    can be generated without walking every recorded test again.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.statuses = collections.Counter()
+        self.run_time = 0.0
+        # worker -> [number of tests, start of first test, stop of last test]
+        self.workers = {}
+
+    def add(self, worker, status, timestamps):
+        start, stop = timestamps
+        self.total += 1
+        self.statuses[status] += 1
+        if start and stop:
+            self.run_time += total_seconds(stop - start)
+        stats = self.workers.get(worker)
+        if stats is None:
+            self.workers[worker] = [1, start, stop]
+        else:
+            stats[0] += 1
+            stats[2] = stop
+
+    def merge(self, other):
+        """Add the counters of another run to these ones."""
+        self.total += other.total
+        self.statuses.update(other.statuses)
+        self.run_time += other.run_time
+        for worker, (num, start, stop) in other.workers.items():
+            stats = self.workers.get(worker)
+            if stats is None:
+                self.workers[worker] = [num, start, stop]
+                continue
+            stats[0] += num
+            if start and (not stats[1] or start < stats[1]):
+                stats[1] = start
+            if stop and (not stats[2] or stop > stats[2]):
+                stats[2] = stop
+
+    def was_successful(self):
+        """Whether the run was successful by testtools.StreamSummary rules.
+
+        Failed tests and tests which never completed make a run
+        unsuccessful, unexpected successes don't.
+        """
+        statuses = self.statuses
+        return not (statuses['fail'] or statuses['unknown'] or
+                    statuses['inprogress'])
+
+
+class ResultRecord(object):
+    """The parts of a test result kept for the rest of the run.
+
+    Only what the summary and the post run reports need is kept: the test
+    id, status, worker and the start and stop times as seconds since the
+    epoch. Attachments are only kept when asked for, e.g. for the failures
+    printed by ``--fails``. A record takes up roughly 200 bytes plus the
+    size of the test id, so 100k tests stay under
+    ``RECORD_MEMORY_CEILING`` with test ids of up to 150 characters.
+    """
+
+    __slots__ = ('test_id', 'status', 'worker', 'start', 'stop', 'details')
+
+    def __init__(self, test_id, status, worker, start=None, stop=None,
+                 details=None):
+        self.test_id = test_id
+        self.status = status
+        self.worker = worker
+        self.start = start
+        self.stop = stop
+        self.details = details
+
+    @classmethod
+    def from_test(cls, test, worker, keep_details=False):
+        """Create a record from a StreamToDict test dict."""
+        start, stop = test['timestamps']
+        return cls(test['id'], test['status'], worker,
+                   start.timestamp() if start else None,
+                   stop.timestamp() if stop else None,
+                   test['details'] if keep_details else None)
+
+    @property
+    def duration(self):
+        if self.start is None or self.stop is None:
+            return None
+        return self.stop - self.start
+
+    def render_details(self, printer=None):
+        """Replace the kept attachments with their rendered text.
+
+        Attachments are read lazily and can't be pickled, the rendered text
+        can be sent to another process and printed there.
+
+        :param printer: The ``AttachmentPrinter`` to render them with, by
+            default they are rendered whole.
+        """
+        if self.details and not isinstance(self.details, str):
+            rendered = io.StringIO()
+            (printer or AttachmentPrinter()).print_details(
+                rendered, self.details, all_channels=True)
+            self.details = rendered.getvalue()
+
+
+# Documented upper bound for the memory used by the records of 100k tests
+RECORD_MEMORY_CEILING = 40 * 1024 * 1024
+# The number of runtime regressions listed in the summary
+REGRESSIONS_SHOWN = 10
+
+
 def cleanup_test_name(name, strip_tags=True, strip_scenarios=False):
     """Clean up the test name for display.
 
@@ -61,23 +191,13 @@ def cleanup_test_name(name, strip_tags=True, strip_scenarios=False):
     be confused with tempest scenarios) however that's often needed to
     indentify generated negative tests.
     """
-    if strip_tags:
-        tags_start = name.find('[')
-        tags_end = name.find(']')
-        if tags_start > 0 and tags_end > tags_start:
-            newname = name[:tags_start]
-            newname += name[tags_end + 1:]
-            name = newname
+    return testids.clean_name(name, strip_tags, strip_scenarios)
 
-    if strip_scenarios:
-        tags_start = name.find('(')
-        tags_end = name.find(')')
-        if tags_start > 0 and tags_end > tags_start:
-            newname = name[:tags_start]
-            newname += name[tags_end + 1:]
-            name = newname
 
-    return name
+def get_class_name(test_id):
+    """Get the name of the class of a test from its id."""
+    name = cleanup_test_name(test_id, strip_tags=True, strip_scenarios=True)
+    return name.rsplit('.', 1)[0]
 
 
 def get_duration(timestamps):
@@ -103,6 +223,12 @@ def find_worker(test):
     return 0
 
 
+def _worker_sort_key(worker):
+    # namespaced workers are 'source:N', order them by source and number
+    source, _, number = str(worker).rpartition(':')
+    return source, int(number)
+
+
 # Print out stdout/stderr if it exists, always
 def print_attachments(stream, test, all_channels=False):
     """Print out subunit attachments.
@@ -111,212 +237,1119 @@ def print_attachments(stream, test, all_channels=False):
     runs in 2 modes, one for successes where we print out just stdout
     and stderr, and an override that dumps all the attachments.
     """
-    channels = ('stdout', 'stderr')
-    for name, detail in test['details'].items():
-        # NOTE(sdague): the subunit names are a little crazy, and actually
-        # are in the form pythonlogging:'' (with the colon and quotes)
-        name = name.split(':')[0]
-        if detail.content_type.type == 'test':
-            detail.content_type.type = 'text'
-        if (all_channels or name in channels) and detail.as_text():
+    AttachmentPrinter().print_attachments(stream, test, all_channels)
+
+
+def print_details(stream, details, all_channels=False):
+    """Print out a dict of attachments, see ``print_attachments()``."""
+    AttachmentPrinter().print_details(stream, details, all_channels)
+
+
+class _IndentedText(object):
+    """Decode attachment bytes and write them out indented 4 spaces."""
+
+    def __init__(self, stream, charset):
+        self.stream = stream
+        self.charset = charset
+        self._decoder = codecs.getincrementaldecoder(charset)('replace')
+        self._line_start = True
+        stream.write(ATTACHMENT_INDENT)
+
+    def write(self, data):
+        self._write(self._decoder.decode(data))
+
+    def _write(self, text):
+        if text:
+            self.stream.write(text.replace('\n', '\n' + ATTACHMENT_INDENT))
+            self._line_start = text.endswith('\n')
+
+    def marker(self, text):
+        """Write a line of its own, the bytes written next are decoded anew.
+        """
+        self._write(self._decoder.decode(b'', True))
+        self._decoder = codecs.getincrementaldecoder(self.charset)('replace')
+        if not self._line_start:
+            self.stream.write('\n' + ATTACHMENT_INDENT)
+        self.stream.write('%s\n%s' % (text, ATTACHMENT_INDENT))
+        self._line_start = True
+
+    def close(self):
+        self._write(self._decoder.decode(b'', True))
+        self.stream.write('\n')
+
+
+class AttachmentPrinter(object):
+    """Print out attachments a chunk at a time, within size limits.
+
+    The bytes of an attachment are decoded and indented as they are read,
+    so printing one takes the same memory whatever its size. An attachment
+    of more than ``limit`` bytes is cut down to its first and last
+    ``limit / 2`` bytes, with a line saying how many bytes were elided in
+    between, and once ``run_limit`` bytes of attachments were printed the
+    attachments printed after that are elided whole. Attachments which
+    aren't text are only described by their size and content type.
+
+    :param limit: The maximum number of bytes printed of each attachment,
+        None for no limit.
+    :param run_limit: The maximum number of bytes printed of all the
+        attachments, None for no limit.
+    """
+
+    def __init__(self, limit=None, run_limit=None):
+        self.limit = limit
+        self.run_limit = run_limit
+        self.printed = 0
+        self.elided = 0
+
+    def print_attachments(self, stream, test, all_channels=False):
+        """Print out the attachments of a test, see ``print_attachments()``.
+        """
+        self.print_details(stream, test['details'], all_channels)
+
+    def print_details(self, stream, details, all_channels=False):
+        """Print out a dict of attachments, see ``print_attachments()``."""
+        channels = ('stdout', 'stderr')
+        for name, detail in details.items():
+            # NOTE(sdague): the subunit names are a little crazy, and actually
+            # are in the form pythonlogging:'' (with the colon and quotes)
+            name = name.split(':')[0]
+            if not (all_channels or name in channels):
+                continue
+            content_type = detail.content_type
+            if content_type.type == 'test':
+                content_type.type = 'text'
+            chunks = detail.iter_bytes()
+            first = next((chunk for chunk in chunks if chunk), None)
+            if first is None:
+                continue
             title = "Captured %s:" % name
             stream.write("\n%s\n%s\n" % (title, ('~' * len(title))))
-            # indent attachment lines 4 spaces to make them visually
-            # offset
-            for line in detail.as_text().split('\n'):
-                line = line.encode('utf8')
-                stream.write("    %s\n" % line)
+            chunks = itertools.chain((first,), chunks)
+            if content_type.type == 'text':
+                self._print_text(stream, content_type, chunks)
+            else:
+                stream.write('%s[%d bytes of %s/%s not shown]\n' % (
+                    ATTACHMENT_INDENT, sum(map(len, chunks)),
+                    content_type.type, content_type.subtype))
 
+    def _print_text(self, stream, content_type, chunks):
+        # indent attachment lines 4 spaces to make them visually offset
+        text = _IndentedText(
+            stream, content_type.parameters.get('charset', 'ISO-8859-1'))
+        limit = self.limit
+        if self.run_limit is not None:
+            left = max(self.run_limit - self.printed, 0)
+            limit = left if limit is None else min(limit, left)
+        if limit is None:
+            for chunk in chunks:
+                self.printed += len(chunk)
+                text.write(chunk)
+            text.close()
+            return
+        head = limit - limit // 2
+        tail_limit = limit // 2
+        # the bytes after the head, only whole chunks beyond the last
+        # tail_limit bytes are dropped as they come
+        tail = collections.deque()
+        tail_size = 0
+        elided = 0
+        for chunk in chunks:
+            if head:
+                printed = chunk[:head]
+                text.write(printed)
+                head -= len(printed)
+                chunk = chunk[len(printed):]
+            if not chunk:
+                continue
+            tail.append(chunk)
+            tail_size += len(chunk)
+            while tail and tail_size - len(tail[0]) >= tail_limit:
+                dropped = len(tail.popleft())
+                tail_size -= dropped
+                elided += dropped
+        if tail_size > tail_limit:
+            excess = tail_size - tail_limit
+            tail[0] = tail[0][excess:]
+            elided += excess
+            tail_size = tail_limit
+        if elided:
+            text.marker('[... %d bytes elided ...]' % elided)
+        for chunk in tail:
+            text.write(chunk)
+        text.close()
+        self.printed += limit - limit // 2 - head + tail_size
+        self.elided += elided
 
-def find_test_run_time_diff(test_id, run_time):
-    times_db_path = os.path.join(os.path.join(os.getcwd(), '.testrepository'),
-                                 'times.dbm')
-    if os.path.isfile(times_db_path):
-        try:
-            test_times = dbm.open(times_db_path)
-        except Exception:
-            return False
-        try:
-            avg_runtime = float(test_times.get(str(test_id), False))
-        except Exception:
-            try:
-                avg_runtime = float(test_times[str(test_id)])
-            except Exception:
-                avg_runtime = False
-
-        if avg_runtime and avg_runtime > 0:
-            run_time = float(run_time.rstrip('s'))
-            perc_diff = ((run_time - avg_runtime) / avg_runtime) * 100
-            return perc_diff
+
+def find_test_run_time_diff(test_id, run_time, timing_index=None):
+    """Get the percent change of a run time from the historical average.
+
+    :param timing_index: A ``timing.TimingIndex`` to look the average up in,
+        if one isn't given the timing data of the repository in the current
+        directory is opened just for this lookup.
+    """
+    if timing_index is None:
+        timing_index = timing.TimingIndex()
+    avg_runtime = timing_index.get(test_id)
+    if avg_runtime:
+        run_time = float(run_time.rstrip('s'))
+        perc_diff = ((run_time - avg_runtime) / avg_runtime) * 100
+        return perc_diff
     return False
 
 
-def show_outcome(stream, test, print_failures=False, failonly=False,
-                 enable_diff=False, threshold='0', abbreviate=False,
-                 enable_color=False):
-    global RESULTS
-    status = test['status']
-    # TODO(sdague): ask lifeless why on this?
-    if status == 'exists':
-        return
-
-    worker = find_worker(test)
-    name = cleanup_test_name(test['id'])
-    duration = get_duration(test['timestamps'])
-
-    if worker not in RESULTS:
-        RESULTS[worker] = []
-    RESULTS[worker].append(test)
-
-    # don't count the end of the return code as a fail
-    if name == 'process-returncode':
-        return
-
-    for color in [colorizer.AnsiColorizer, colorizer.NullColorizer]:
-        if not enable_color:
-            color = colorizer.NullColorizer(stream)
-            break
-        if color.supported():
-            color = color(stream)
-            break
-
-    if status == 'fail' or status == 'uxsuccess':
-        FAILS.append(test)
-        if abbreviate:
-            color.write('F', 'red')
-        else:
-            stream.write('{%s} %s [%s] ... ' % (
-                worker, name, duration))
-            color.write('FAILED', 'red')
-            stream.write('\n')
-            if not print_failures:
-                print_attachments(stream, test, all_channels=True)
-    elif not failonly:
-        if status == 'success' or status == 'xfail':
-            if abbreviate:
-                color.write('.', 'green')
+class CatFiles(testtools.StreamResult):
+    """Write file attachments that aren't part of a test to the output.
+
+    :param stream: The stream to write them to.
+    :param on_file: Called with the file name, bytes and route code of each
+        one instead, if given.
+    """
+
+    def __init__(self, stream, on_file=None):
+        super(CatFiles, self).__init__()
+        self.stream = stream
+        self.on_file = on_file
+
+    def status(self, file_name=None, file_bytes=None, route_code=None,
+               **kwargs):
+        if file_name is not None:
+            if self.on_file is not None:
+                self.on_file(file_name, file_bytes, route_code)
             else:
-                out_string = '{%s} %s [%s' % (worker, name, duration)
-                perc_diff = find_test_run_time_diff(test['id'], duration)
-                if enable_diff:
-                    if perc_diff and abs(perc_diff) >= abs(float(threshold)):
-                        if perc_diff > 0:
-                            out_string = out_string + ' +%.2f%%' % perc_diff
-                        else:
-                            out_string = out_string + ' %.2f%%' % perc_diff
-                stream.write(out_string + '] ... ')
-                color.write('ok', 'green')
-                stream.write('\n')
-                print_attachments(stream, test)
-        elif status == 'skip':
-            if abbreviate:
-                color.write('S', 'blue')
+                self.stream.write(file_bytes)
+
+
+class Renderer(object):
+    """Render per test results to an output stream.
+
+    The color support of the stream is probed once and the status tokens
+    are formatted up front, so rendering a test result is just a write.
+    """
+
+    def __init__(self, stream, enable_color=False, color=None):
+        self.stream = stream
+        if color is None:
+            color = colorizer.get_colorizer(stream, enable_color)
+        self.colorizer = color
+        self.failed = color.render('FAILED', 'red')
+        self.ok = color.render('ok', 'green')
+        self.skipped = color.render('SKIPPED', 'blue')
+        self.abbreviations = {
+            'fail': color.render('F', 'red'),
+            'uxsuccess': color.render('F', 'red'),
+            'success': color.render('.', 'green'),
+            'xfail': color.render('.', 'green'),
+            'skip': color.render('S', 'blue'),
+        }
+
+    def abbreviation(self, status):
+        token = self.abbreviations.get(status)
+        if token is None:
+            token = status[0]
+        return token
+
+
+class TraceSession(object):
+    """Trace a subunit stream.
+
+    A session owns everything collected while tracing a stream: the results
+    of each worker, the running counters, the failures and the output they
+    are written to. Sessions share no state, so any number of streams can be
+    traced in one process, one after the other or concurrently from
+    different threads.
+
+    ``run()`` traces a whole byte stream. Alternatively events can be fed
+    in as they arrive by calling ``start()``, passing them to the
+    ``result`` StreamResult and then calling ``stop()`` and ``report()``.
+
+    The results of sessions run elsewhere, e.g. in another process, can be
+    combined with ``export_results()`` and ``merge_results()``. To keep the
+    workers of several streams apart, the worker numbers of a session can be
+    namespaced by a ``source``, they are then reported as ``source:N``.
+    ``listen()`` traces the streams sent to a socket by any number of
+    clients at once as a single run, the workers of each client namespaced
+    by its address.
+
+    With ``fast_decoder`` the byte streams traced by ``run()`` and
+    ``consume()`` are decoded by ``subunit_v2.PacketDecoder`` instead of
+    subunit and testtools, which produces the same output for a fraction of
+    the CPU time.
+
+    With ``balance`` the summary shows the busy and idle time of every
+    worker and how the makespan of the run compares with an ideal schedule,
+    ``balance_plan`` names a file to write a rebalanced assignment of the
+    tests to, see ``balance.BalanceReport``.
+
+    With ``progress`` only failures are printed, followed by a line with
+    the number of tests done, the throughput and the time left, estimated
+    from the historical run times of the tests, or of the
+    ``expected_tests``, see ``progress.ProgressEstimator``. The line is
+    redrawn at most every ``progress_interval`` seconds.
+
+    With ``regression_baseline`` the summary lists the tests significantly
+    slower than in the baseline statistics stored in that file, ranked by
+    the run time they added, ``regression_report`` names a file to write
+    them to as JSON, see ``regression.RegressionReport``.
+
+    With ``timing_history`` the run times of the tests which passed are
+    added to the ``timing.TimingHistory`` in that file at the end of the
+    run, which is then also used as the ``timing_db`` if none is given.
+
+    With ``cluster_failures`` the failures are grouped by the signature of
+    their traceback, see ``clustering.FailureClusters``: only the first
+    failure of a cluster has its attachments printed, the others refer to
+    it, ``--fails`` prints each cluster once with its tests and the summary
+    lists the clusters.
+
+    With ``json_lines`` the output is JSON Lines instead of text: a
+    compact JSON object for every test, whatever its status, and a summary
+    object with everything the text summary holds, see
+    ``jsonl.JsonLinesWriter``.
+
+    The run can be teed to any number of ``sinks.Sink`` outputs, like
+    an HTML or JUnit XML report, given as ``sinks``. They get every test
+    and the output which isn't part of a test from the same decode of the
+    stream, and are closed once the run is reported on.
+
+    The attachments printed are cut down to ``attachment_limit`` bytes
+    each and ``run_attachment_limit`` bytes in all, see
+    ``AttachmentPrinter``.
+
+    A ``profiling.PhaseProfiler`` passed as ``profiler`` gets the time spent
+    decoding the stream, handling the tests, printing their attachments,
+    writing the output and printing the summary.
+    """
+
+    def __init__(self, stdout, print_failures=False, failonly=False,
+                 enable_diff=False, abbreviate=False, color=False,
+                 post_fails=False, no_summary=False, timing_db=None,
+                 flush_policy=None, threshold=None, percentiles=False,
+                 slowest=0, slowest_by_class=False, source=None,
+                 fast_decoder=False, profiler=None, balance=False,
+                 balance_plan=None, progress=False, expected_tests=None,
+                 progress_interval=None, attachment_limit=None,
+                 run_attachment_limit=None, regression_baseline=None,
+                 regression_report=None,
+                 regression_alpha=regression.DEFAULT_ALPHA,
+                 timing_history=None, json_lines=False, sinks=None,
+                 cluster_failures=False):
+        self.output = output.OutputWriter(stdout, flush_policy)
+        self.renderer = Renderer(self.output, color)
+        self.sinks = list(sinks or ())
+        self.json_writer = None
+        if json_lines:
+            self.json_writer = jsonl.JsonLinesWriter(self.output)
+        self.print_failures = print_failures
+        self.failonly = failonly or progress
+        self.enable_diff = enable_diff
+        self.threshold = abs(float(threshold or 0))
+        self.abbreviate = abbreviate
+        self.post_fails = post_fails
+        self.no_summary = no_summary
+        self.timing_db = timing_db or timing_history
+        self.timing_history = timing_history
+        self.source = source
+        self.fast_decoder = fast_decoder
+        self.profiler = profiler
+        self.balance = balance
+        self.balance_plan = balance_plan
+        self.progress = progress
+        self.expected_tests = expected_tests
+        self.progress_interval = progress_interval
+        self.progress_line = None
+        self.regression_baseline = regression_baseline
+        self.regression_report = regression_report
+        self.regression_alpha = regression_alpha
+        self.attachments = AttachmentPrinter(attachment_limit,
+                                             run_attachment_limit)
+        self._print_attachments = self.attachments.print_attachments
+        self.timing_index = None
+        self.results = {}
+        self.fails = []
+        self.counters = ResultCounters()
+        self.histogram = stats.DurationHistogram() if percentiles else None
+        self.slowest = None
+        if slowest and slowest_by_class:
+            self.slowest = stats.SlowestClasses(slowest)
+        elif slowest:
+            self.slowest = stats.SlowestTests(slowest)
+        self.clusters = None
+        if cluster_failures:
+            self.clusters = clustering.FailureClusters()
+        # the ids of the process-returncode pseudo tests of the run
+        self.returncode_ids = set()
+        self.result = None
+        self.start_time = None
+        self.stop_time = None
+
+    def show_outcome(self, test, source=None):
+        status = test['status']
+        # TODO(sdague): ask lifeless why on this?
+        if status == 'exists':
+            return
+
+        worker = find_worker(test)
+        if source is None:
+            source = self.source
+        if source is not None:
+            worker = '%s:%s' % (source, worker)
+        name = cleanup_test_name(test['id'])
+        failed = status == 'fail' or status == 'uxsuccess'
+
+        # a failure the same as the first of its cluster isn't printed
+        cluster = repeat = None
+        if failed and self.clusters is not None and (
+                name != 'process-returncode'):
+            cluster = self.clusters.add_test(test)
+            repeat = (cluster.count > 1 and
+                      cluster is not self.clusters.overflow)
+        record = ResultRecord.from_test(
+            test, worker, keep_details=self.post_fails and failed and
+            not repeat)
+        if cluster is not None and cluster.count == 1:
+            cluster.sample = record
+        if worker not in self.results:
+            self.results[worker] = []
+        self.results[worker].append(record)
+        self.counters.add(worker, status, test['timestamps'])
+        for sink in self.sinks:
+            sink.test(record, test)
+
+        # don't count the end of the return code as a fail
+        if name == 'process-returncode':
+            self.returncode_ids.add(record.test_id)
+            return
+
+        test_duration = record.duration
+        if test_duration is not None:
+            if self.histogram is not None:
+                self.histogram.add(test_duration)
+            if isinstance(self.slowest, stats.SlowestClasses):
+                self.slowest.add(test_duration, get_class_name(record.test_id))
+            elif self.slowest is not None:
+                self.slowest.add(test_duration, record.test_id)
+
+        stream = self.output
+        if self.json_writer is not None:
+            if failed:
+                self.fails.append(record)
+            reason = None
+            if status == 'skip' and 'reason' in test['details']:
+                reason = test['details']['reason'].as_text()
+            self.json_writer.write_test(record, test['tags'], reason)
+            stream.test_done()
+            return
+
+        duration = get_duration(test['timestamps'])
+        renderer = self.renderer
+        write = stream.write
+
+        if failed:
+            self.fails.append(record)
+            if self.progress_line is not None:
+                self.progress_line.clear()
+            if self.abbreviate:
+                write(renderer.abbreviation(status))
             else:
-                reason = test['details'].get('reason', '')
-                if reason:
-                    reason = ': ' + reason.as_text()
-                stream.write('{%s} %s ... ' % (
-                    worker, name))
-                color.write('SKIPPED', 'blue')
-                stream.write('%s' % (reason))
-                stream.write('\n')
-        else:
-            if abbreviate:
-                stream.write('%s' % test['status'][0])
+                write('{%s} %s [%s] ... %s\n' % (
+                    worker, name, duration, renderer.failed))
+                if not self.print_failures:
+                    if repeat:
+                        write('%s[same failure as %s, cluster %s]\n' % (
+                            ATTACHMENT_INDENT, cluster.first,
+                            cluster.signature))
+                    else:
+                        self._print_attachments(stream, test,
+                                                all_channels=True)
+        elif not self.failonly:
+            if status == 'success' or status == 'xfail':
+                if self.abbreviate:
+                    write(renderer.abbreviation(status))
+                else:
+                    out_string = '{%s} %s [%s' % (worker, name, duration)
+                    if self.enable_diff and duration:
+                        perc_diff = find_test_run_time_diff(
+                            test['id'], duration,
+                            timing_index=self.timing_index)
+                        if perc_diff and abs(perc_diff) >= self.threshold:
+                            if perc_diff > 0:
+                                out_string = (out_string +
+                                              ' +%.2f%%' % perc_diff)
+                            else:
+                                out_string = (out_string +
+                                              ' %.2f%%' % perc_diff)
+                    write('%s] ... %s\n' % (out_string, renderer.ok))
+                    self._print_attachments(stream, test)
+            elif status == 'skip':
+                if self.abbreviate:
+                    write(renderer.abbreviation(status))
+                else:
+                    reason = test['details'].get('reason', '')
+                    if reason:
+                        reason = ': ' + reason.as_text()
+                    write('{%s} %s ... %s%s\n' % (
+                        worker, name, renderer.skipped, reason))
             else:
-                stream.write('{%s} %s [%s] ... %s\n' % (
-                    worker, name, duration, test['status']))
-                if not print_failures:
-                    print_attachments(stream, test, all_channels=True)
+                if self.abbreviate:
+                    write(renderer.abbreviation(status))
+                else:
+                    write('{%s} %s [%s] ... %s\n' % (
+                        worker, name, duration, status))
+                    if not self.print_failures:
+                        self._print_attachments(stream, test,
+                                                all_channels=True)
 
-    stream.flush()
+        if self.progress_line is not None:
+            self.progress_line.update(record.test_id)
+        stream.test_done()
 
+    def print_fails(self):
+        """Print summary failure report.
 
-def print_fails(stream):
-    """Print summary failure report.
+        Currently unused, however there remains debate on inline vs. at end
+        reporting, so leave the utility function for later use.
+        """
+        if not self.fails:
+            return
+        stream = self.output
+        stream.write("\n==============================\n")
+        if self.clusters is not None:
+            stream.write("Failed %s tests in %s clusters - output below:" % (
+                len(self.fails), len(self.clusters)))
+        else:
+            stream.write("Failed %s tests - output below:" % len(self.fails))
+        stream.write("\n==============================\n")
+        if self.clusters is not None:
+            self._print_clusters()
+        else:
+            for f in self.fails:
+                self._print_fail(f)
+        stream.write('\n')
 
-    Currently unused, however there remains debate on inline vs. at end
-    reporting, so leave the utility function for later use.
-    """
-    if not FAILS:
-        return
-    stream.write("\n==============================\n")
-    stream.write("Failed %s tests - output below:" % len(FAILS))
-    stream.write("\n==============================\n")
-    for f in FAILS:
-        stream.write("\n%s\n" % f['id'])
-        stream.write("%s\n" % ('-' * len(f['id'])))
-        print_attachments(stream, f, all_channels=True)
-    stream.write('\n')
-
-
-def count_tests(key, value):
-    count = 0
-    for k, v in RESULTS.items():
-        for item in v:
-            if key in item:
-                if re.search(value, item[key]):
-                    count += 1
-    return count
-
-
-def run_time():
-    runtime = 0.0
-    for k, v in RESULTS.items():
-        for test in v:
-            test_dur = get_duration(test['timestamps']).strip('s')
-            # NOTE(toabctl): get_duration() can return an empty string
-            # which leads to a ValueError when casting to float
-            if test_dur:
-                runtime += float(test_dur)
-    return runtime
-
-
-def worker_stats(worker):
-    tests = RESULTS[worker]
-    num_tests = len(tests)
-    stop_time = tests[-1]['timestamps'][1]
-    start_time = tests[0]['timestamps'][0]
-    if not start_time or not stop_time:
-        delta = 'N/A'
-    else:
-        delta = stop_time - start_time
-    return num_tests, str(delta)
-
-
-def print_summary(stream, elapsed_time):
-    stream.write("\n======\nTotals\n======\n")
-    stream.write("Ran: %s tests in %.4f sec.\n" % (
-        count_tests('status', '.*'), total_seconds(elapsed_time)))
-    stream.write(" - Passed: %s\n" % count_tests('status', '^success$'))
-    stream.write(" - Skipped: %s\n" % count_tests('status', '^skip$'))
-    stream.write(" - Expected Fail: %s\n" % count_tests('status', '^xfail$'))
-    stream.write(" - Unexpected Success: %s\n" % count_tests('status',
-                                                             '^uxsuccess$'))
-    stream.write(" - Failed: %s\n" % count_tests('status', '^fail$'))
-    stream.write("Sum of execute time for each test: %.4f sec.\n" % run_time())
-
-    # we could have no results, especially as we filter out the process-codes
-    if RESULTS:
-        stream.write("\n==============\nWorker Balance\n==============\n")
-
-        for w in range(max(RESULTS.keys()) + 1):
-            if w not in RESULTS:
-                stream.write(
-                    " - WARNING: missing Worker %s! "
-                    "Race in testr accounting.\n" % w)
+    def _print_fail(self, record):
+        stream = self.output
+        stream.write("\n%s\n" % record.test_id)
+        stream.write("%s\n" % ('-' * len(record.test_id)))
+        if isinstance(record.details, str):
+            stream.write(record.details)
+        elif record.details:
+            self.attachments.print_details(stream, record.details,
+                                           all_channels=True)
+
+    def _print_clusters(self):
+        stream = self.output
+        for cluster in self.clusters:
+            title = '[%s] %s (%s tests)' % (
+                cluster.signature, cluster.headline, cluster.count)
+            stream.write("\n%s\n%s\n" % (title, '-' * len(title)))
+            for test_id in cluster.tests:
+                stream.write(" - %s\n" % test_id)
+            if cluster is self.clusters.overflow:
+                # the failures of the overflow cluster differ, all of them
+                # were kept
+                members = set(cluster.tests)
+                for f in self.fails:
+                    if f.test_id in members:
+                        self._print_fail(f)
+            elif cluster.sample is not None:
+                self._print_fail(cluster.sample)
+
+    def count_tests(self, key, value):
+        """Count the recorded tests whose ``key`` matches the ``value`` regex.
+
+        This walks every recorded test, the summary uses the running
+        ``counters`` instead.
+        """
+        attr = 'test_id' if key == 'id' else key
+        count = 0
+        for k, v in self.results.items():
+            for item in v:
+                item_value = getattr(item, attr, None)
+                if item_value is not None:
+                    if re.search(value, item_value):
+                        count += 1
+        return count
+
+    def run_time(self):
+        # NOTE(toabctl): tests without both timestamps have no duration and
+        # don't contribute to the sum
+        return self.counters.run_time
+
+    def _expected_workers(self):
+        workers = self.counters.workers
+        if all(isinstance(w, int) for w in workers):
+            return range(max(workers) + 1)
+        # the namespaced workers of several streams, gaps can't be told
+        # apart from sources with fewer workers
+        return sorted(workers, key=_worker_sort_key)
+
+    def worker_stats(self, worker):
+        num_tests, start_time, stop_time = self.counters.workers[worker]
+        if not start_time or not stop_time:
+            delta = 'N/A'
+        else:
+            delta = stop_time - start_time
+        return num_tests, str(delta)
+
+    def print_summary(self, elapsed_time):
+        stream = self.output
+        counters = self.counters
+        statuses = counters.statuses
+        stream.write("\n======\nTotals\n======\n")
+        stream.write("Ran: %s tests in %.4f sec.\n" % (
+            counters.total, total_seconds(elapsed_time)))
+        stream.write(" - Passed: %s\n" % statuses['success'])
+        stream.write(" - Skipped: %s\n" % statuses['skip'])
+        stream.write(" - Expected Fail: %s\n" % statuses['xfail'])
+        stream.write(" - Unexpected Success: %s\n" % statuses['uxsuccess'])
+        stream.write(" - Failed: %s\n" % statuses['fail'])
+        stream.write("Sum of execute time for each test: %.4f sec.\n" %
+                     self.run_time())
+
+        if self.clusters:
+            stream.write("\n================\nFailure Clusters\n"
+                         "================\n")
+            for cluster in self.clusters:
+                stream.write(" - [%s] %s (%s tests, first: %s)\n" % (
+                    cluster.signature, cluster.headline, cluster.count,
+                    cluster.first))
+
+        # we could have no results, especially as we filter out the
+        # process-codes
+        if counters.workers:
+            stream.write("\n==============\nWorker Balance\n"
+                         "==============\n")
+
+            workers = counters.workers
+            for w in self._expected_workers():
+                if w not in workers:
+                    stream.write(
+                        " - WARNING: missing Worker %s! "
+                        "Race in testr accounting.\n" % w)
+                else:
+                    num, time = self.worker_stats(w)
+                    out_str = " - Worker %s (%s tests) => %s" % (w, num, time)
+                    if time.isdigit():
+                        out_str += 's'
+                    out_str += '\n'
+                    stream.write(out_str)
+
+        if self.balance and counters.workers:
+            self.print_balance(self.balance_report())
+        if self.histogram is not None and self.histogram.count:
+            stream.write("\n====================\nDuration Percentiles\n"
+                         "====================\n")
+            for percent in (50, 90, 99):
+                stream.write(" - p%s: %.4f sec.\n" % (
+                    percent, self.histogram.percentile(percent)))
+        if isinstance(self.slowest, stats.SlowestClasses):
+            stream.write("\n===============\nSlowest Classes\n"
+                         "===============\n")
+            for total, num, name in self.slowest.slowest():
+                stream.write(" - %.4f sec. (%s tests) %s\n" % (
+                    total, num, name))
+        elif self.slowest is not None:
+            stream.write("\n=============\nSlowest Tests\n=============\n")
+            for test_duration, test_id in self.slowest.slowest():
+                stream.write(" - %.4f sec. %s\n" % (test_duration, test_id))
+
+    def summary_data(self, elapsed_time, regressions=None):
+        """Get everything the summary holds as a JSON serializable dict.
+
+        Times are given in seconds, the start and stop times of the workers
+        in seconds since the epoch.
+
+        :param regressions: The ``regression.RegressionReport`` of the run,
+            if any.
+        """
+        counters = self.counters
+        statuses = dict.fromkeys(
+            ('success', 'skip', 'xfail', 'uxsuccess', 'fail'), 0)
+        statuses.update(counters.statuses)
+        workers = []
+        missing = []
+        if counters.workers:
+            for w in self._expected_workers():
+                if w not in counters.workers:
+                    missing.append(w)
+                    continue
+                num, start, stop = counters.workers[w]
+                workers.append({
+                    'worker': w,
+                    'tests': num,
+                    'start': start.timestamp() if start else None,
+                    'stop': stop.timestamp() if stop else None,
+                    'duration': (total_seconds(stop - start)
+                                 if start and stop else None),
+                })
+        summary = {
+            'total': counters.total,
+            'elapsed': total_seconds(elapsed_time),
+            'statuses': statuses,
+            'run_time': self.run_time(),
+            'workers': workers,
+            'missing_workers': missing,
+            'successful': bool(counters.total and statuses['success'] and
+                               counters.was_successful()),
+        }
+        if self.balance and counters.workers:
+            report = self.balance_report()
+            summary['balance'] = {
+                'workers': [{
+                    'worker': load.worker,
+                    'tests': load.tests,
+                    'busy': load.busy,
+                    'idle': load.idle,
+                    'gaps': load.gaps,
+                    'longest_gap': load.longest_gap,
+                    'early': report.stop - load.stop,
+                    'utilisation': report.utilisation(load),
+                } for load in report.workers],
+                'makespan': report.makespan,
+                'utilisation': report.utilisation(),
+                'ideal_makespan': report.ideal_makespan,
+                'rebalanced_makespan': report.lpt_makespan,
+            }
+        if self.histogram is not None and self.histogram.count:
+            summary['percentiles'] = {
+                'p%s' % percent: self.histogram.percentile(percent)
+                for percent in (50, 90, 99)}
+        if isinstance(self.slowest, stats.SlowestClasses):
+            summary['slowest_classes'] = [
+                {'class': name, 'duration': total, 'tests': num}
+                for total, num, name in self.slowest.slowest()]
+        elif self.slowest is not None:
+            summary['slowest_tests'] = [
+                {'test_id': test_id, 'duration': test_duration}
+                for test_duration, test_id in self.slowest.slowest()]
+        if regressions is not None:
+            summary['regressions'] = regressions.to_dict()
+        if self.clusters is not None:
+            summary['failure_clusters'] = self.clusters.to_list()
+        return summary
+
+    def balance_report(self):
+        """Analyze the balance of the tests traced over the workers."""
+        return balance.BalanceReport(
+            (worker, [record for record in self.results[worker]
+                      if record.test_id not in self.returncode_ids])
+            for worker in sorted(self.results, key=_worker_sort_key))
+
+    def print_balance(self, report):
+        stream = self.output
+        if not report.workers:
+            return
+        stream.write("\n==================\nWorker Utilisation\n"
+                     "==================\n")
+        for load in report.workers:
+            stream.write(
+                " - Worker %s (%s tests): busy %.4f sec., idle %.4f sec. in "
+                "%s gaps (longest %.4f sec.), done %.4f sec. early, %.1f%% "
+                "utilised\n" % (
+                    load.worker, load.tests, load.busy, load.idle, load.gaps,
+                    load.longest_gap, report.stop - load.stop,
+                    report.utilisation(load) * 100))
+        stream.write("Makespan: %.4f sec., %.1f%% utilised\n" % (
+            report.makespan, report.utilisation() * 100))
+        stream.write("Ideal makespan: %.4f sec.\n" % report.ideal_makespan)
+        stream.write("Rebalanced makespan: %.4f sec.\n" %
+                     report.lpt_makespan)
+
+    def write_balance_plan(self, path, report=None):
+        """Write the rebalanced assignment of the tests as JSON."""
+        report = report or self.balance_report()
+        with open(path, 'w') as plan_file:
+            json.dump(report.plan_dict(), plan_file, indent=2)
+            plan_file.write('\n')
+
+    def test_durations(self, statuses=None):
+        """Get the durations of the tests traced, by test id.
+
+        :param statuses: Only get the durations of the tests which ended
+            with one of these statuses, by default all of them.
+        """
+        durations = collections.defaultdict(list)
+        for records in self.results.values():
+            for record in records:
+                duration = record.duration
+                if (duration is not None and
+                        (statuses is None or record.status in statuses) and
+                        record.test_id not in self.returncode_ids):
+                    durations[record.test_id].append(duration)
+        return durations
+
+    def update_timing_history(self):
+        """Add the run times of the tests which passed to the history."""
+        if self.timing_index is not None:
+            # the index may be reading the history
+            self.timing_index.close()
+        history = timing.TimingHistory(self.timing_history)
+        try:
+            history.add_run(
+                (test_id, duration)
+                for test_id, durations in self.test_durations(
+                    ('success',)).items()
+                for duration in durations)
+        finally:
+            history.close()
+
+    def regression_analysis(self):
+        """Compare the durations of the tests with the baseline."""
+        durations = self.test_durations()
+        baseline = regression.open_baseline(self.regression_baseline)
+        try:
+            return regression.RegressionReport(durations, baseline,
+                                               self.regression_alpha)
+        finally:
+            baseline.close()
+
+    def print_regressions(self, report, count=REGRESSIONS_SHOWN):
+        stream = self.output
+        stream.write("\n===================\nRuntime Regressions\n"
+                     "===================\n")
+        stream.write(
+            "%s of %s tests compared with the baseline are slower (p < %s), "
+            "adding %.4f sec.\n" % (len(report.regressions), report.compared,
+                                    report.alpha, report.added))
+        for found in report.regressions[:count]:
+            stream.write(
+                " - +%.4f sec. %s (%.4f sec. -> %.4f sec., p=%.2g)\n" % (
+                    found.added, found.test_id, found.baseline.mean,
+                    found.duration, found.p_value))
+        if len(report.regressions) > count:
+            stream.write(" - ... %s more\n" % (
+                len(report.regressions) - count))
+
+    def _instrument(self):
+        profiler = self.profiler
+        self.show_outcome = profiler.wrap('tests', self.show_outcome)
+        self._print_attachments = profiler.wrap(
+            'attachments', self.attachments.print_attachments)
+        self.output._drain = profiler.wrap('write', self.output._drain)
+        self.output.flush = profiler.wrap('write', self.output.flush)
+        for sink in self.sinks:
+            sink.test = profiler.wrap('sinks', sink.test)
+            sink.close = profiler.wrap('sinks', sink.close)
+
+    def start(self):
+        """Start the test run, events can then be fed to ``result``."""
+        if self.profiler is not None:
+            self._instrument()
+        if self.timing_history:
+            # Create the history up front, so it can be read during the run
+            timing.TimingHistory(self.timing_history).close()
+        if self.enable_diff or self.progress:
+            # Load the historical run times once up front so the per test
+            # lookups are served from memory.
+            self.timing_index = timing.TimingIndex(self.timing_db)
+            self.timing_index.prefetch()
+        if self.progress:
+            self.progress_line = progress.ProgressLine(
+                self.output,
+                progress.ProgressEstimator(self.expected_tests,
+                                           self.timing_index),
+                self.progress_interval)
+        # NOTE: the counters stand in for a testtools.StreamSummary, which
+        # would keep a formatted copy of the details of every failure and
+        # skip for the whole run.
+        outcomes = testtools.StreamToDict(self.show_outcome)
+        result = testtools.StreamResultRouter(outcomes)
+        result.add_rule(CatFiles(self.output, self._cat_file),
+                        'test_id', test_id=None)
+        if self.profiler is not None:
+            result.status = self.profiler.counting('events', result.status)
+        self.result = result
+        self.start_time = datetime.datetime.now(datetime.timezone.utc)
+        result.startTestRun()
+
+    def stop(self):
+        """Stop the test run once all the events have been fed in."""
+        try:
+            self.result.stopTestRun()
+            if self.json_writer is not None:
+                self.json_writer.flush()
+            if self.progress_line is not None:
+                self.progress_line.finish()
+        finally:
+            self.stop_time = datetime.datetime.now(datetime.timezone.utc)
+            if self.timing_index is not None:
+                self.timing_index.close()
+                self.timing_index = None
+
+    def report(self):
+        """Write out the final reports and get the return code of the run."""
+        with profiling.phase(self.profiler, 'summary'):
+            return self._report()
+
+    def close_sinks(self, regressions=None):
+        """Finish the outputs the run is teed to."""
+        if not self.sinks:
+            return
+        summary = self.summary_data(self.stop_time - self.start_time,
+                                    regressions)
+        for sink in self.sinks:
+            sink.close(summary)
+
+    def _report(self):
+        stream = self.output
+        if self.counters.total == 0:
+            self.close_sinks()
+            if self.json_writer is not None:
+                if not self.no_summary:
+                    self.json_writer.write_summary(
+                        self.summary_data(self.stop_time - self.start_time))
             else:
-                num, time = worker_stats(w)
-                out_str = " - Worker %s (%s tests) => %s" % (w, num, time)
-                if time.isdigit():
-                    out_str += 's'
-                out_str += '\n'
-                stream.write(out_str)
+                stream.write("The test run didn't actually run any tests\n")
+            return 1
+        if self.balance_plan:
+            self.write_balance_plan(self.balance_plan)
+        report = None
+        if self.regression_baseline:
+            report = self.regression_analysis()
+            if self.regression_report:
+                with open(self.regression_report, 'w') as report_file:
+                    json.dump(report.to_dict(), report_file, indent=2)
+                    report_file.write('\n')
+        if self.timing_history:
+            self.update_timing_history()
+        self.close_sinks(report)
+        if self.json_writer is not None:
+            if not self.no_summary:
+                self.json_writer.write_summary(self.summary_data(
+                    self.stop_time - self.start_time, report))
+            return 0 if (self.counters.statuses['success'] and
+                         self.counters.was_successful()) else 1
+        if self.post_fails:
+            self.print_fails()
+        if not self.no_summary:
+            self.print_summary(self.stop_time - self.start_time)
+            if report is not None:
+                self.print_regressions(report)
+
+        # NOTE(mtreinish): Ideally this should live in testtools
+        # streamSummary this is just in place until the behavior lands there
+        # (if it ever does)
+        if self.counters.statuses['success'] == 0:
+            stream.write("\nNo tests were successful during the run\n")
+            return 1
+        return 0 if self.counters.was_successful() else 1
+
+    def consume(self, stdin):
+        """Trace a subunit v2 byte stream without reporting on it.
+
+        A gzip or zstd compressed stream is decompressed while it is traced.
+        """
+        self.start()
+        try:
+            with profiling.phase(self.profiler, 'decode'):
+                with compression.decompressed(stdin) as stream:
+                    self._decode(stream)
+        finally:
+            self.stop()
+
+    def _cat_file(self, file_name, file_bytes, route_code=None):
+        # Output which isn't part of a test is written as it is, unless it
+        # has to become a JSON event
+        for sink in self.sinks:
+            sink.file(file_name, file_bytes, route_code)
+        if self.json_writer is not None:
+            self.json_writer.write_file(file_name, file_bytes)
+        else:
+            self.output.write(file_bytes)
+
+    def _accumulator(self, source=None):
+        on_test = self.show_outcome
+        if source is not None:
+            on_test = functools.partial(on_test, source=source)
+        tests = subunit_v2.TestAccumulator(on_test, self._cat_file)
+        status = tests.status
+        if self.profiler is not None:
+            status = self.profiler.counting('events', status)
+        return tests, status
+
+    def _decode(self, stdin):
+        if not self.fast_decoder:
+            stream = subunit.ByteStreamToStreamResult(
+                stdin, non_subunit_name='stdout')
+            stream.run(self.result)
+            return
+        tests, status = self._accumulator()
+        try:
+            subunit_v2.PacketDecoder(
+                status, non_subunit_name='stdout').run(stdin)
+        finally:
+            tests.finish()
+
+    def follow(self, path, offset=None, checkpoint=None, idle_timeout=None,
+               poll_interval=tail.POLL_INTERVAL):
+        """Trace a subunit file while it is being written.
+
+        The file is decoded with ``subunit_v2.PacketDecoder`` as it grows,
+        an incomplete packet at its end is waited for, until nothing was
+        written to it for ``idle_timeout`` seconds or until interrupted by
+        Ctrl-C, then the run is reported on. The file is polled at most
+        every ``poll_interval`` seconds while idle.
+
+        :param offset: The offset to start reading the file from, it must be
+            the start of a packet. By default the offset saved in the
+            checkpoint, if any, is used.
+        :param checkpoint: A file to save the offset tracing can be resumed
+            from in, every ``tail.CHECKPOINT_INTERVAL`` seconds. Tests still
+            in progress at that offset are traced from their start, but
+            only the tests traced after resuming are in the summary.
+        :return: The return code of the run.
+        """
+        if offset is None:
+            offset = 0
+            if checkpoint:
+                offset = tail.read_checkpoint(checkpoint, path)
+        try:
+            self.start()
+            try:
+                with profiling.phase(self.profiler, 'decode'):
+                    self._follow(path, offset, checkpoint, idle_timeout,
+                                 poll_interval)
+            finally:
+                self.stop()
+            return self.report()
+        finally:
+            self.output.close()
+
+    def _follow(self, path, offset, checkpoint, idle_timeout, poll_interval):
+        tests, status = self._accumulator()
+        decoder = tail.ResumableDecoder(status, non_subunit_name='stdout',
+                                        offset=offset)
+        chunks = tail.tail(path, offset, poll_interval=poll_interval,
+                           idle_timeout=idle_timeout)
+        next_checkpoint = time.monotonic() + tail.CHECKPOINT_INTERVAL
+        try:
+            for data in chunks:
+                decoder.feed(data)
+                if checkpoint and time.monotonic() >= next_checkpoint:
+                    tail.write_checkpoint(checkpoint, path,
+                                          decoder.resume_offset)
+                    next_checkpoint = (time.monotonic() +
+                                       tail.CHECKPOINT_INTERVAL)
+        except KeyboardInterrupt:
+            # stop following, the run so far is still reported on
+            pass
+        finally:
+            chunks.close()
+            if checkpoint:
+                tail.write_checkpoint(checkpoint, path, decoder.resume_offset)
+        try:
+            decoder.close()
+        finally:
+            tests.finish()
+
+    def listen(self, address, connections=None, idle_timeout=None,
+               ready=None):
+        """Trace the subunit streams sent to a socket as one run.
+
+        Any number of clients can connect to the Unix or TCP ``address``
+        at once, the stream of each one is decoded with
+        ``subunit_v2.PacketDecoder`` as it arrives and its workers are
+        namespaced by the client, see ``aggregate.Aggregator``. Once
+        ``connections`` clients have disconnected, no client was connected
+        for ``idle_timeout`` seconds or when interrupted by Ctrl-C, the run
+        is reported on.
+
+        :param address: An ``aggregate.Address``.
+        :param ready: Called with the address listened on once it is bound.
+        :return: The return code of the run.
+        """
+        server = aggregate.Aggregator(address, self._stream_decoder,
+                                      connections=connections,
+                                      idle_timeout=idle_timeout, ready=ready)
+        try:
+            self.start()
+            try:
+                with profiling.phase(self.profiler, 'decode'):
+                    server.run()
+            except KeyboardInterrupt:
+                # stop listening, the run so far is still reported on
+                pass
+            finally:
+                self.stop()
+            return self.report()
+        finally:
+            self.output.close()
+
+    def _stream_decoder(self, source):
+        tests, status = self._accumulator(source)
+        decoder = subunit_v2.PacketDecoder(status, non_subunit_name='stdout')
+
+        def close():
+            try:
+                decoder.close()
+            finally:
+                tests.finish()
+        return decoder.feed, close
+
+    def export_results(self):
+        """Get the results collected by the session in a picklable form.
+
+        The attachments kept for ``--fails`` are rendered to text, the
+        session shouldn't be used to report on the run afterwards.
+        """
+        for record in self.fails:
+            record.render_details(self.attachments)
+        return {
+            'results': self.results,
+            'fails': self.fails,
+            'counters': self.counters,
+            'histogram': self.histogram,
+            'slowest': self.slowest,
+            'returncode_ids': self.returncode_ids,
+            'clusters': self.clusters,
+        }
+
+    def merge_results(self, results):
+        """Add the results exported by another session to this one.
+
+        The other session must have been created with the same summary
+        options and its workers should be namespaced by a ``source``.
+        """
+        for worker, records in results['results'].items():
+            self.results.setdefault(worker, []).extend(records)
+        self.fails.extend(results['fails'])
+        self.returncode_ids.update(results['returncode_ids'])
+        self.counters.merge(results['counters'])
+        if self.histogram is not None:
+            self.histogram.merge(results['histogram'])
+        if self.slowest is not None:
+            self.slowest.merge(results['slowest'])
+        if self.clusters is not None:
+            self.clusters.merge(results['clusters'])
+
+    def run(self, stdin):
+        """Trace a subunit v2 byte stream and return the run's return code."""
+        try:
+            self.consume(stdin)
+            return self.report()
+        finally:
+            # Always deliver the buffered output, even when the run is
+            # interrupted by an error or a signal.
+            self.output.close()
 
 
 __version__ = pbr.version.VersionInfo('os_testr').version_string()
 
 
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(spec):
+    """Get a number of bytes from a size like ``4096``, ``64k`` or ``1M``.
+    """
+    match = re.match(r'^(\d+)([kmg]?)b?$', spec.strip().lower())
+    if match is None:
+        raise ValueError("Invalid size '%s', expected a number of bytes "
+                         "optionally followed by K, M or G" % spec)
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2)]
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--version', action='version',
@@ -342,61 +1375,341 @@ def parse_args():
                         help="Threshold to use for displaying percent change "
                              "from the avg run time. If one is not specified "
                              "the percent change will always be displayed")
+    parser.add_argument('--timing-db', dest='timing_db',
+                        help="Historical run times to compare against with "
+                             "--perc-diff. This can be a stestr or "
+                             "testrepository repository or times.dbm file, a "
+                             "JSON file or a binary timing index. By default "
+                             "the .stestr and .testrepository repositories "
+                             "in the current directory are used.")
+    parser.add_argument('--timing-history', metavar='FILE',
+                        help="Add the run times of the tests which passed "
+                             "to the SQLite timing history in FILE, which is "
+                             "created if needed, and use it as the "
+                             "--timing-db if none is given")
     parser.add_argument('--no-summary', action='store_true',
                         help="Don't print the summary of the test run after "
                              " completes")
+    parser.add_argument('--percentiles', action='store_true',
+                        help="Print the 50th, 90th and 99th percentile of "
+                             "the test durations in the summary")
+    parser.add_argument('--slowest', type=int, default=0, metavar='N',
+                        help="Print the N slowest tests in the summary")
+    parser.add_argument('--slowest-by-class', action='store_true',
+                        help="Make --slowest print the classes with the "
+                             "largest total test duration instead of tests")
+    parser.add_argument('--balance', action='store_true',
+                        help="Print the busy and idle time of each worker "
+                             "and compare the makespan of the run with an "
+                             "ideal schedule in the summary")
+    parser.add_argument('--balance-plan', metavar='FILE',
+                        help="Write a JSON assignment of the tests to the "
+                             "same number of workers, balanced by their "
+                             "durations, to FILE")
+    parser.add_argument('--progress', action='store_true',
+                        help="Only print failures, followed by a line with "
+                             "the number of tests done, the tests per "
+                             "second and the time left estimated from the "
+                             "historical run times of --timing-db")
+    parser.add_argument('--expected-tests', metavar='FILE',
+                        help="The ids of the tests expected in the run, one "
+                             "per line, for the --progress estimate. By "
+                             "default all the tests with a historical run "
+                             "time are expected.")
+    parser.add_argument('--regression-baseline', metavar='FILE',
+                        help="List the tests significantly slower than in "
+                             "the run time statistics of FILE in the "
+                             "summary, ranked by the time they added")
+    parser.add_argument('--regression-report', metavar='FILE',
+                        help="Write the --regression-baseline comparison to "
+                             "FILE as JSON")
+    parser.add_argument('--regression-alpha', type=float, metavar='P',
+                        default=regression.DEFAULT_ALPHA,
+                        help="The significance level of the slowdowns "
+                             "flagged by --regression-baseline, by default "
+                             "%s" % regression.DEFAULT_ALPHA)
+    parser.add_argument('--attachment-limit', type=parse_size,
+                        metavar='SIZE',
+                        help="Print at most SIZE bytes of each attachment, "
+                             "its first and last SIZE/2 bytes, e.g. 64K")
+    parser.add_argument('--run-attachment-limit', type=parse_size,
+                        metavar='SIZE',
+                        help="Print at most SIZE bytes of attachments in "
+                             "all, the ones printed after that are elided, "
+                             "e.g. 10M")
+    parser.add_argument('--cluster-failures', action='store_true',
+                        help="Group the failures by the signature of their "
+                             "traceback, only print the output of the first "
+                             "failure of each group and list the groups in "
+                             "the summary, and in the --html-output report")
+    parser.add_argument('--json', action='store_true', dest='json_lines',
+                        help="Write a JSON object per test and one with the "
+                             "summary of the run, one per line, instead of "
+                             "text")
+    parser.add_argument('--html-output', metavar='FILE',
+                        help="Also write the HTML report of subunit2html to "
+                             "FILE, from the same decode of the stream")
+    parser.add_argument('--junit-output', metavar='FILE',
+                        help="Also write a JUnit XML report to FILE, from "
+                             "the same decode of the stream")
+    parser.add_argument('--json-output', metavar='FILE',
+                        help="Also write the JSON Lines of --json to FILE, "
+                             "from the same decode of the stream")
     parser.add_argument('--color', action='store_true',
                         help="Print results with colors")
+    parser.add_argument('--flush', dest='flush_policy', default='test',
+                        type=output.parse_flush_policy,
+                        help="When to flush the output: 'test' after every "
+                             "test (the default), 'end' only at the end of "
+                             "the run, N after every N tests or Nms at most "
+                             "every N milliseconds")
+    parser.add_argument('--fast-decoder', action='store_true',
+                        help="Decode the subunit stream with the built in "
+                             "decoder, which is faster than the subunit and "
+                             "testtools one and gives the same output")
+    parser.add_argument('--jobs', '-j', type=int, default=None, metavar='N',
+                        help="The number of processes tracing the input "
+                             "files in parallel, by default one per CPU")
+    parser.add_argument('--follow', metavar='FILE',
+                        help="Trace a subunit file while it is being "
+                             "written instead of stdin, until Ctrl-C or "
+                             "--follow-timeout")
+    parser.add_argument('--follow-timeout', type=float, metavar='SECONDS',
+                        help="Stop following the file once nothing was "
+                             "written to it for SECONDS")
+    parser.add_argument('--offset', type=int, metavar='N',
+                        help="The byte offset to start following the file "
+                             "from, it must be the start of a packet")
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help="Save the offset --follow can be resumed from "
+                             "to FILE every second, and resume from it when "
+                             "it exists and --offset isn't given")
+    parser.add_argument('--listen', metavar='ADDRESS',
+                        type=aggregate.parse_address,
+                        help="Trace the subunit streams sent to the socket "
+                             "ADDRESS, unix:PATH or tcp:HOST:PORT, by any "
+                             "number of clients at once as one run, until "
+                             "Ctrl-C, --listen-connections or "
+                             "--listen-timeout")
+    parser.add_argument('--listen-connections', type=int, metavar='N',
+                        help="Stop listening once N clients have sent their "
+                             "stream")
+    parser.add_argument('--listen-timeout', type=float, metavar='SECONDS',
+                        help="Stop listening once no client was connected "
+                             "for SECONDS")
+    parser.add_argument('inputs', nargs='*', metavar='FILE',
+                        help="Subunit files or glob patterns of files to "
+                             "trace instead of stdin, all of them are "
+                             "reported in one summary")
+    profiling.add_arguments(parser)
     return parser.parse_args()
 
 
 def trace(stdin, stdout, print_failures=False, failonly=False,
           enable_diff=False, abbreviate=False, color=False, post_fails=False,
-          no_summary=False):
-    stream = subunit.ByteStreamToStreamResult(
-        stdin, non_subunit_name='stdout')
-    outcomes = testtools.StreamToDict(
-        functools.partial(show_outcome, stdout,
-                          print_failures=print_failures,
-                          failonly=failonly,
-                          enable_diff=enable_diff,
-                          abbreviate=abbreviate,
-                          enable_color=color))
-    summary = testtools.StreamSummary()
-    result = testtools.CopyStreamResult([outcomes, summary])
-    result = testtools.StreamResultRouter(result)
-    cat = test_results.CatFiles(stdout)
-    result.add_rule(cat, 'test_id', test_id=None)
-    start_time = datetime.datetime.now(datetime.timezone.utc)
-    result.startTestRun()
+          no_summary=False, **kwargs):
+    """Trace a subunit stream, see ``TraceSession`` for the options."""
+    session = TraceSession(stdout, print_failures=print_failures,
+                           failonly=failonly, enable_diff=enable_diff,
+                           abbreviate=abbreviate, color=color,
+                           post_fails=post_fails, no_summary=no_summary,
+                           **kwargs)
+    return session.run(stdin)
+
+
+def follow_file(path, stdout, offset=None, checkpoint=None, idle_timeout=None,
+                **kwargs):
+    """Trace a file while it is written, see ``TraceSession.follow()``."""
+    session = TraceSession(stdout, **kwargs)
+    return session.follow(path, offset=offset, checkpoint=checkpoint,
+                          idle_timeout=idle_timeout)
+
+
+def listen(address, stdout, connections=None, idle_timeout=None, ready=None,
+           **kwargs):
+    """Trace the streams sent to a socket, see ``TraceSession.listen()``."""
+    session = TraceSession(stdout, **kwargs)
+    return session.listen(address, connections=connections,
+                          idle_timeout=idle_timeout, ready=ready)
+
+
+def expand_inputs(patterns):
+    """Expand the input file names and glob patterns to a list of files.
+
+    A file matched by several patterns is only listed the first time, or
+    its tests would be traced twice.
+    """
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise ValueError('No subunit files found for %s' % pattern)
+        for path in matches:
+            real_path = os.path.realpath(path)
+            if real_path not in seen:
+                seen.add(real_path)
+                paths.append(path)
+    return paths
+
+
+def _trace_file(path, color, options):
+    """Trace one input file, run in a worker process by trace_files()."""
+    text = io.StringIO()
+    session = TraceSession(text, source=path,
+                           flush_policy=output.EndFlushPolicy(), **options)
+    if color:
+        session.renderer = Renderer(
+            session.output, color=colorizer.AnsiColorizer(session.output))
+    with open(path, 'rb') as stream:
+        session.consume(stream)
+    session.output.close()
+    return text.getvalue(), session.export_results()
+
+
+def trace_files(paths, stdout, jobs=None, color=False, flush_policy=None,
+                profiler=None, **kwargs):
+    """Trace subunit files in parallel and report on them as one run.
+
+    Every file is traced by a ``TraceSession`` in a pool of ``jobs`` worker
+    processes, with its workers namespaced by the path of the file. The
+    per test output of each file is written out, in the order of the
+    paths, as soon as the file is done and the exported results are merged
+    into a single summary. The options are the ones of ``TraceSession``,
+    a ``profiler`` only gets the merging and reporting done in this process.
+    The files are traced in this process, one after the other, when the run
+    is teed to ``sinks``.
+    """
+    session = TraceSession(stdout, color=color, flush_policy=flush_policy,
+                           profiler=profiler, **kwargs)
+    # The workers write to memory, so they can't tell if the output is a
+    # terminal supporting colors, decide it for them.
+    color = isinstance(session.renderer.colorizer, colorizer.AnsiColorizer)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(paths)))
+    if kwargs.get('sinks'):
+        # every file has to be fed to the same sinks
+        jobs = 1
+    pool = None
     try:
-        stream.run(result)
+        session.start_time = datetime.datetime.now(datetime.timezone.utc)
+        if jobs == 1:
+            traced = map(_trace_file, paths, itertools.repeat(color),
+                         itertools.repeat(kwargs))
+        else:
+            pool = futures.ProcessPoolExecutor(jobs)
+            traced = pool.map(_trace_file, paths, itertools.repeat(color),
+                              itertools.repeat(kwargs))
+        for text, results in traced:
+            with profiling.phase(profiler, 'merge'):
+                session.output.write(text)
+                session.output.flush()
+                session.merge_results(results)
+        session.stop_time = datetime.datetime.now(datetime.timezone.utc)
+        return session.report()
     finally:
-        result.stopTestRun()
-    stop_time = datetime.datetime.now(datetime.timezone.utc)
-    elapsed_time = stop_time - start_time
-
-    if count_tests('status', '.*') == 0:
-        print("The test run didn't actually run any tests")
-        return 1
-    if post_fails:
-        print_fails(stdout)
-    if not no_summary:
-        print_summary(stdout, elapsed_time)
-
-    # NOTE(mtreinish): Ideally this should live in testtools streamSummary
-    # this is just in place until the behavior lands there (if it ever does)
-    if count_tests('status', '^success$') == 0:
-        print("\nNo tests were successful during the run")
-        return 1
-    return 0 if summary.wasSuccessful() else 1
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        session.output.close()
+
+
+def _exit_on_signal(signum, frame):
+    # Raising SystemExit unwinds through trace() so the buffered output is
+    # still written out
+    sys.exit(128 + signum)
+
+
+def _print_listening(address):
+    sys.stderr.write('Listening on %s\n' % aggregate.format_address(address))
+    sys.stderr.flush()
 
 
 def main():
     args = parse_args()
-    exit(trace(sys.stdin, sys.stdout, args.print_failures, args.failonly,
-               args.enable_diff, args.abbreviate, args.color, args.post_fails,
-               args.no_summary))
+    for signame in ('SIGTERM', 'SIGHUP'):
+        if hasattr(signal, signame):
+            signal.signal(getattr(signal, signame), _exit_on_signal)
+    options = dict(print_failures=args.print_failures,
+                   failonly=args.failonly, enable_diff=args.enable_diff,
+                   abbreviate=args.abbreviate, color=args.color,
+                   post_fails=args.post_fails, no_summary=args.no_summary,
+                   timing_db=args.timing_db, flush_policy=args.flush_policy,
+                   threshold=args.threshold, percentiles=args.percentiles,
+                   slowest=args.slowest,
+                   slowest_by_class=args.slowest_by_class,
+                   fast_decoder=args.fast_decoder, balance=args.balance,
+                   balance_plan=args.balance_plan, progress=args.progress,
+                   attachment_limit=args.attachment_limit,
+                   run_attachment_limit=args.run_attachment_limit,
+                   regression_baseline=args.regression_baseline,
+                   regression_report=args.regression_report,
+                   regression_alpha=args.regression_alpha,
+                   timing_history=args.timing_history,
+                   json_lines=args.json_lines,
+                   cluster_failures=args.cluster_failures)
+    if args.expected_tests:
+        options['expected_tests'] = progress.read_expected_tests(
+            args.expected_tests)
+    if args.json_lines and args.progress:
+        sys.exit("--progress can't be used with --json")
+    if args.regression_report and not args.regression_baseline:
+        sys.exit('--regression-report needs a --regression-baseline')
+    if args.timing_history:
+        try:
+            timing.TimingHistory(args.timing_history).close()
+        except ValueError as e:
+            sys.exit(str(e))
+    if (args.regression_baseline and
+            args.regression_baseline != args.timing_history):
+        if not os.path.isfile(args.regression_baseline):
+            sys.exit('The baseline %s does not exist' %
+                     args.regression_baseline)
+        # it is only read once the run is over, check it can be before
+        try:
+            regression.open_baseline(args.regression_baseline).close()
+        except ValueError as e:
+            sys.exit(str(e))
+    tee = []
+    if args.html_output:
+        tee.append(subunit2html.HtmlSink(
+            args.html_output, cluster_failures=args.cluster_failures))
+    if args.junit_output:
+        tee.append(sinks.JUnitXmlSink(args.junit_output))
+    if args.json_output:
+        tee.append(sinks.JsonSink(args.json_output))
+    options['sinks'] = tee
+    profiler = profiling.from_args('subunit-trace', args)
+    try:
+        if args.listen:
+            if args.inputs or args.follow:
+                sys.exit("--listen can't be used with --follow or input "
+                         "files")
+            exit(listen(args.listen, sys.stdout,
+                        connections=args.listen_connections,
+                        idle_timeout=args.listen_timeout,
+                        ready=_print_listening, profiler=profiler,
+                        **options))
+        if args.follow:
+            if args.inputs:
+                sys.exit("--follow can't be used with input files")
+            exit(follow_file(args.follow, sys.stdout, offset=args.offset,
+                             checkpoint=args.checkpoint,
+                             idle_timeout=args.follow_timeout,
+                             profiler=profiler, **options))
+        if args.inputs:
+            if args.progress:
+                sys.exit('--progress only works on a stream from stdin')
+            try:
+                paths = expand_inputs(args.inputs)
+            except ValueError as e:
+                sys.exit(str(e))
+            exit(trace_files(paths, sys.stdout, jobs=args.jobs,
+                             profiler=profiler, **options))
+        exit(trace(sys.stdin, sys.stdout, profiler=profiler, **options))
+    except (compression.DecompressionError, tail.FollowError) as e:
+        sys.exit(str(e))
+    finally:
+        if profiler is not None:
+            profiler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import json
+import os
+from unittest import mock
+
+import fixtures
+
+from os_testr import benchmark
+from os_testr.tests import base
+
+
+class TestBenchmark(base.TestCase):
+
+    scenarios = {'tiny': dict(num_tests=20, fail_rate=0.2, skip_rate=0.2,
+                              attachment_size=64, stdout_rate=0.2)}
+
+    def setUp(self):
+        super(TestBenchmark, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+
+    def test_run_benchmarks(self):
+        results = benchmark.run_benchmarks(
+            self.scenarios, benchmark.TARGETS, repeat=2,
+            tmp_dir=self.tmp_dir, measure_func=benchmark.measure)
+        self.assertEqual(['trace', 'trace-fast', 'html'],
+                         [result['target'] for result in results])
+        for result in results:
+            self.assertEqual('tiny', result['scenario'])
+            self.assertEqual(20, result['tests'])
+            self.assertGreater(result['stream_bytes'], 20 * 64)
+            self.assertGreater(result['tests_per_second'], 0)
+            self.assertAlmostEqual(20 / result['wall_time'],
+                                   result['tests_per_second'])
+
+    def test_compare(self):
+        baseline = {'results': [
+            {'scenario': 'a', 'target': 'trace', 'tests_per_second': 1000.0,
+             'peak_rss': 100},
+            {'scenario': 'b', 'target': 'trace', 'tests_per_second': 1000.0,
+             'peak_rss': 100},
+        ]}
+        results = [
+            {'scenario': 'a', 'target': 'trace', 'tests_per_second': 950.0,
+             'peak_rss': 105},
+            {'scenario': 'b', 'target': 'trace', 'tests_per_second': 800.0,
+             'peak_rss': 150},
+            {'scenario': 'c', 'target': 'trace', 'tests_per_second': 1.0,
+             'peak_rss': None},
+        ]
+        self.assertEqual(
+            [('b', 'trace', 'tests_per_second', 1000.0, 800.0),
+             ('b', 'trace', 'peak_rss', 100, 150)],
+            benchmark.compare(results, baseline, tolerance=0.1))
+        self.assertEqual([], benchmark.compare(results, baseline,
+                                               tolerance=0.6))
+
+    def test_speedups(self):
+        results = [
+            {'scenario': 'a', 'target': 'trace', 'wall_time': 6.0},
+            {'scenario': 'a', 'target': 'trace-fast', 'wall_time': 1.5},
+            {'scenario': 'a', 'target': 'html', 'wall_time': 3.0},
+            {'scenario': 'b', 'target': 'trace-fast', 'wall_time': 1.0},
+        ]
+        self.assertEqual({'a': 4.0}, benchmark.speedups(results))
+        stream = io.StringIO()
+        benchmark._print_results(stream, [
+            dict(result, tests=10, tests_per_second=1.0, peak_rss=None)
+            for result in results])
+        self.assertIn('a            trace-fast is 4.0x as fast as trace\n',
+                      stream.getvalue())
+
+    def test_main(self):
+        path = os.path.join(self.tmp_dir, 'results.json')
+        stdout = io.StringIO()
+        with mock.patch('sys.stdout', stdout):
+            self.assertEqual(0, benchmark.main(
+                ['--tests', '20', '--repeat', '1', '--target', 'trace',
+                 '--output', path]))
+        self.assertIn('custom       trace', stdout.getvalue())
+        with open(path) as results_file:
+            results = json.load(results_file)
+        self.assertEqual(benchmark.RESULTS_VERSION, results['version'])
+        self.assertEqual([('custom', 'trace')],
+                         [(r['scenario'], r['target'])
+                          for r in results['results']])
+        self.assertIsNotNone(results['results'][0]['peak_rss'])
+
+        # an impossible baseline fails the comparison
+        results['results'][0]['tests_per_second'] *= 1000
+        with open(path, 'w') as results_file:
+            json.dump(results, results_file)
+        with mock.patch('sys.stdout', io.StringIO()) as stdout:
+            self.assertEqual(1, benchmark.main(
+                ['--tests', '20', '--repeat', '1', '--target', 'trace',
+                 '--compare', path]))
+        self.assertIn('REGRESSION custom trace: tests_per_second',
+                      stdout.getvalue())
@@ -10,15 +10,23 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import gzip
+import io
+import os
 import sys
 
 from ddt import data
 from ddt import ddt
+import fixtures
+import subunit
 from subunit import RemotedTestCase
 from testtools import PlaceHolder
 
 from os_testr import subunit2html
+from os_testr import subunit_trace
 from os_testr.tests import base
+from os_testr.utils import profiling
+from os_testr.utils import synthetic
 
 
 @ddt
@@ -90,3 +98,144 @@ class TestSubunit2html(base.TestCase):
         # Add failure that contains no ascii characters
         obj.addFailure(test, err)
         obj._generate_report()
+
+    def test_results_keep_handles(self):
+        obj = subunit2html.HtmlOutput()
+        obj.addSuccess(PlaceHolder('example.path.to.test1.method'))
+        described = PlaceHolder('example.path.to.test1.other',
+                                short_description='Does other things')
+        obj.addSuccess(described)
+        obj.addSuccess(RemotedTestCase('example.path.to.test2.method'))
+        handles = [t for n, t, o, e in obj.result]
+        self.assertEqual([0, described, 1], handles)
+        self.assertEqual('example.path.to.test2.method',
+                         obj.test_ids.test_id(handles[2]))
+        report = obj._generate_report()
+        self.assertIn('pt1.2: Does other things', report)
+        self.assertEqual(
+            ['example.path.to.test1', 'example.path.to.test2'],
+            [str(cls) for cls, _ in obj._sortResult(obj.result)])
+
+    def test_class_grouping(self):
+        # the classes are the ids up to their last dot, scenarios and tags
+        # included
+        obj = subunit2html.HtmlOutput()
+        for test_id in ('a.b.C.test_x(scen)[tag.x]', 'a.b.C.test_y(scen)',
+                        'a.b.C.test_z[id-1,smoke]', 'a.b.C.test_w'):
+            obj.addSuccess(PlaceHolder(test_id))
+        self.assertEqual(
+            ['a.b.C', 'a.b.C.test_x(scen)[tag'],
+            [str(cls) for cls, _ in obj._sortResult(obj.result)])
+
+    def test_write_html_profile(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        html_file = os.path.join(tmp_dir, 'results.html')
+        profiler = profiling.PhaseProfiler('subunit2html')
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'sample_streams', 'successful.subunit')
+        with open(path, 'rb') as stream:
+            subunit2html.write_html(stream, html_file, profiler=profiler)
+        self.assertTrue(os.path.exists(html_file))
+        report = profiler.report()
+        self.assertEqual(['decode', 'results', 'v1', 'report', 'render'],
+                         list(report['phases']))
+        self.assertEqual(1, report['phases']['render']['calls'])
+        self.assertGreater(report['counters']['events'], 0)
+
+    def test_write_html_gzip(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'sample_streams', 'successful.subunit')
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        html_files = []
+        for stream in (io.BytesIO(data), io.BytesIO(gzip.compress(data))):
+            html_file = os.path.join(tmp_dir, '%d.html' % len(html_files))
+            subunit2html.write_html(stream, html_file)
+            with open(html_file) as html:
+                html_files.append(html.read())
+        self.assertEqual(html_files[0], html_files[1])
+
+    @data(False, True)
+    def test_html_sink(self, fast_decoder):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        stream = io.BytesIO()
+        synthetic.generate_stream(stream, num_tests=50, fail_rate=0.2,
+                                  skip_rate=0.1, attachment_size=100,
+                                  stdout_rate=0.1)
+        expected_file = os.path.join(tmp_dir, 'expected.html')
+        subunit2html.write_html(io.BytesIO(stream.getvalue()), expected_file)
+        html_file = os.path.join(tmp_dir, 'results.html')
+        subunit_trace.trace(io.BytesIO(stream.getvalue()), io.StringIO(),
+                            fast_decoder=fast_decoder,
+                            sinks=[subunit2html.HtmlSink(html_file)])
+        with open(expected_file) as expected, open(html_file) as html:
+            self.assertEqual(expected.read(), html.read())
+
+    def test_cluster_failures(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        html_file = os.path.join(tmp_dir, 'results.html')
+        output = io.BytesIO()
+        stream = subunit.v2.StreamResultToBytes(output)
+        for i in range(3):
+            test_id = 'os_testr.tests.test_fail.TestFail.test_%d' % i
+            stream.status(test_id=test_id, test_status='inprogress')
+            stream.status(test_id=test_id, file_name='traceback',
+                          file_bytes=b'Traceback (most recent call last):\n'
+                                     b'ConnectionError: refused at 0x%x\n' % i,
+                          mime_type='text/x-traceback; charset=utf8')
+            stream.status(test_id=test_id, test_status='fail')
+        subunit2html.write_html(io.BytesIO(output.getvalue()), html_file,
+                                cluster_failures=True)
+        with open(html_file) as html:
+            report = html.read()
+        self.assertIn('Failure clusters', report)
+        self.assertEqual(2, report.count('refused at 0x0'))
+        self.assertNotIn('refused at 0x1', report)
+        self.assertEqual(2, report.count(
+            'Same failure as os_testr.tests.test_fail.TestFail.test_0'))
+        self.assertIn('<td class="small">3</td>', report)
+        self.assertIn('os_testr.tests.test_fail.TestFail.test_1<br/>'
+                      'os_testr.tests.test_fail.TestFail.test_2', report)
+
+    def test_parse_args(self):
+        args = subunit2html.parse_args(
+            ['--cluster-failures', '--profile', 'run.subunit'])
+        self.assertTrue(args.cluster_failures)
+        self.assertTrue(args.profile)
+        self.assertEqual('run.subunit', args.subunit_file)
+        self.assertEqual('results.html', args.html_file)
+        args = subunit2html.parse_args(['run.subunit', 'out.html'])
+        self.assertFalse(args.cluster_failures)
+        self.assertEqual('out.html', args.html_file)
+        stdout = self.useFixture(fixtures.StringStream('stdout')).stream
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', stdout))
+        self.assertRaises(SystemExit, subunit2html.parse_args, ['--help'])
+        stdout.seek(0)
+        usage = stdout.read()
+        for option in ('--cluster-failures', '--profile-file',
+                       '--profile-stats', 'subunit_stream'):
+            self.assertIn(option, usage)
+
+    @data(False, True)
+    def test_html_sink_route_codes(self, fast_decoder):
+        # v1 output of two workers, interleaved
+        output = io.BytesIO()
+        stream = subunit.v2.StreamResultToBytes(output)
+        for route_code, line in (('0', b'test: a.A.test_1\n'),
+                                 ('1', b'test: b.B.test_2\n'),
+                                 ('0', b'success: a.A.test_1\n'),
+                                 ('1', b'failure: b.B.test_2\n')):
+            stream.status(file_name='stdout', file_bytes=line,
+                          route_code=route_code)
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        expected_file = os.path.join(tmp_dir, 'expected.html')
+        subunit2html.write_html(io.BytesIO(output.getvalue()), expected_file)
+        html_file = os.path.join(tmp_dir, 'results.html')
+        sink = subunit2html.HtmlSink(html_file)
+        subunit_trace.trace(io.BytesIO(output.getvalue()), io.StringIO(),
+                            fast_decoder=fast_decoder, sinks=[sink])
+        self.assertEqual(1, sink.html_result.success_count)
+        self.assertEqual(1, sink.html_result.failure_count)
+        with open(expected_file) as expected, open(html_file) as html:
+            self.assertEqual(expected.read(), html.read())
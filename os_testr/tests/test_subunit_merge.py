@@ -0,0 +1,76 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import io
+import os
+import subprocess
+import sys
+
+import fixtures
+
+from os_testr import subunit_merge
+from os_testr import subunit_trace
+from os_testr.tests import base
+
+
+class TestSubunitMerge(base.TestCase):
+
+    def setUp(self):
+        super(TestSubunitMerge, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'sample_streams', 'successful.subunit')
+        with open(path, 'rb') as stream:
+            self.sample = stream.read()
+        self.paths = []
+        for name, data in (('node1.subunit', self.sample),
+                           ('node2.subunit.gz', gzip.compress(self.sample))):
+            self.paths.append(os.path.join(self.tmp_dir, name))
+            with open(self.paths[-1], 'wb') as stream:
+                stream.write(data)
+
+    def _trace(self, stream):
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(stdout)
+        returncode = session.run(io.BytesIO(stream))
+        return returncode, session, stdout.getvalue()
+
+    def test_merge_files(self):
+        output = io.BytesIO()
+        workers = subunit_merge.merge_files(self.paths, output)
+        self.assertEqual(16, len(workers.workers))
+        returncode, session, summary = self._trace(output.getvalue())
+        self.assertEqual(0, returncode)
+        self.assertEqual(42, session.counters.total)
+        self.assertEqual(list(range(16)), sorted(session.counters.workers))
+        self.assertNotIn('WARNING: missing Worker', summary)
+
+    def test_command(self):
+        merged = os.path.join(self.tmp_dir, 'merged.subunit')
+        subprocess.check_call([sys.executable, '-m', 'os_testr.subunit_merge',
+                               '-o', merged] + self.paths)
+        with open(merged, 'rb') as stream:
+            returncode, session, _ = self._trace(stream.read())
+        self.assertEqual(0, returncode)
+        self.assertEqual(42, session.counters.total)
+        stdout = subprocess.check_output(
+            [sys.executable, '-m', 'os_testr.subunit_merge'] + self.paths)
+        self.assertEqual(42, self._trace(stdout)[1].counters.total)
+
+    def test_missing_file(self):
+        process = subprocess.run(
+            [sys.executable, '-m', 'os_testr.subunit_merge',
+             os.path.join(self.tmp_dir, 'missing.subunit')],
+            capture_output=True)
+        self.assertEqual(1, process.returncode)
+        self.assertIn(b'missing.subunit', process.stderr)
@@ -14,18 +14,38 @@
 # under the License.
 
 from datetime import datetime as dt
+from datetime import timedelta
+import gzip
 import io
+import itertools
+import json
 import os
+import re
 import subprocess
 import sys
+import threading
+import tracemalloc
+from unittest import mock
 from unittest.mock import patch
 
 from ddt import data
 from ddt import ddt
 from ddt import unpack
+import fixtures
+import subunit
+from subunit import iso8601
+import testtools
+from testtools import content
 
 from os_testr import subunit_trace
 from os_testr.tests import base
+from os_testr.utils import aggregate
+from os_testr.utils import colorizer
+from os_testr.utils import output
+from os_testr.utils import profiling
+from os_testr.utils import regression
+from os_testr.utils import sinks
+from os_testr.utils import timing
 
 
 @ddt
@@ -56,13 +76,58 @@ class TestSubunitTrace(base.TestCase):
            0.0))
     @unpack
     def test_run_time(self, timestamps, expected_result):
-        patched_res = {
-            0: [
-                {'timestamps': timestamps}
-            ]
-        }
-        with patch.dict(subunit_trace.RESULTS, patched_res, clear=True):
-            self.assertEqual(subunit_trace.run_time(), expected_result)
+        session = subunit_trace.TraceSession(io.StringIO())
+        session.counters.add(0, 'success', timestamps)
+        self.assertEqual(session.run_time(), expected_result)
+
+    @data(('pkg.mod.Class.test_a', 'pkg.mod.Class'),
+          ('pkg.mod.Class.test_a[id-1,smoke]', 'pkg.mod.Class'),
+          ('pkg.mod.Class.test_a(scenario)', 'pkg.mod.Class'))
+    @unpack
+    def test_get_class_name(self, test_id, expected):
+        self.assertEqual(expected, subunit_trace.get_class_name(test_id))
+
+    def test_counters(self):
+        session = subunit_trace.TraceSession(io.StringIO())
+        counters = session.counters
+        start = dt(2015, 4, 17, 22, 23, 14, 111111)
+        stop = dt(2015, 4, 17, 22, 23, 15, 111111)
+        counters.add(0, 'success', [start, stop])
+        counters.add(1, 'fail', [start, stop])
+        counters.add(0, 'skip', [stop, stop + timedelta(seconds=2)])
+        self.assertEqual(3, counters.total)
+        self.assertEqual(1, counters.statuses['success'])
+        self.assertEqual(1, counters.statuses['fail'])
+        self.assertEqual(0, counters.statuses['xfail'])
+        self.assertEqual(4.0, counters.run_time)
+        self.assertEqual((2, '0:00:03'), session.worker_stats(0))
+        self.assertEqual((1, '0:00:01'), session.worker_stats(1))
+
+    def test_summary_reads_counters(self):
+        # The summary is built from the running counters, the recorded
+        # results are never scanned, so its cost doesn't grow with the run.
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(stdout)
+        start = dt(2015, 4, 17, 22, 23, 14, 111111)
+        stop = dt(2015, 4, 17, 22, 23, 15, 111111)
+        for i in range(100):
+            session.counters.add(i % 8, 'success' if i else 'fail',
+                                 [start, stop])
+        session.results = mock.MagicMock()
+        for method in ('__iter__', '__getitem__', '__contains__', 'items',
+                       'values', 'keys'):
+            getattr(session.results, method).side_effect = AssertionError
+        self.useFixture(fixtures.MockPatchObject(
+            session, 'count_tests', side_effect=AssertionError))
+        session.print_summary(timedelta(seconds=1))
+        summary = session.summary_data(timedelta(seconds=1))
+        session.output.close()
+        self.assertIn('Ran: 100 tests', stdout.getvalue())
+        self.assertIn(' - Failed: 1\n', stdout.getvalue())
+        self.assertIn(' - Worker 7 (12 tests) => 0:00:01\n', stdout.getvalue())
+        self.assertEqual(100, summary['total'])
+        self.assertEqual(99, summary['statuses']['success'])
+        self.assertEqual(8, len(summary['workers']))
 
     def test_return_code_all_skips(self):
         skips_stream = os.path.join(
@@ -82,6 +147,36 @@ class TestSubunitTrace(base.TestCase):
             p.communicate(stream.read())
         self.assertEqual(0, p.returncode)
 
+    def test_invalid_baseline(self):
+        # the baseline is checked before the stream is traced
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(tmp_dir, 'nb.json')
+        for baseline in (b'{}', b'not json'):
+            with open(path, 'wb') as baseline_file:
+                baseline_file.write(baseline)
+            process = subprocess.run(
+                ['subunit-trace', '--regression-baseline', path],
+                input=self._sample_stream('successful.subunit'),
+                capture_output=True)
+            self.assertEqual(1, process.returncode)
+            self.assertEqual(b'', process.stdout)
+            self.assertEqual(
+                ('%s is not a run time baseline\n' % path).encode(),
+                process.stderr)
+
+    def test_invalid_timing_history(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'history.subunit')
+        stream = self._sample_stream('successful.subunit')
+        with open(path, 'wb') as history_file:
+            history_file.write(stream)
+        process = subprocess.run(['subunit-trace', '--timing-history', path],
+                                 input=stream, capture_output=True)
+        self.assertEqual(1, process.returncode)
+        self.assertEqual(b'', process.stdout)
+        self.assertEqual(('%s is not a timing history\n' % path).encode(),
+                         process.stderr)
+
     def test_trace(self):
         regular_stream = os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
@@ -93,3 +188,865 @@ class TestSubunitTrace(base.TestCase):
         stdin = io.TextIOWrapper(io.BufferedReader(bytes_))
         returncode = subunit_trace.trace(stdin, sys.stdout)
         self.assertEqual(0, returncode)
+
+    def test_trace_probes_color_once(self):
+        regular_stream = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'sample_streams/successful.subunit')
+        with open(regular_stream, 'rb') as stream:
+            stdin = io.BytesIO(stream.read())
+        with patch.object(colorizer.AnsiColorizer, 'supported',
+                          return_value=False) as supported:
+            subunit_trace.trace(stdin, sys.stdout, color=True)
+        self.assertEqual(1, supported.call_count)
+
+    def test_renderer_tokens(self):
+        with patch.object(colorizer.AnsiColorizer, 'supported',
+                          return_value=True):
+            renderer = subunit_trace.Renderer(io.StringIO(), True)
+        self.assertEqual('\x1b[31;1mFAILED\x1b[0m', renderer.failed)
+        self.assertEqual('\x1b[32;1m.\x1b[0m',
+                         renderer.abbreviation('xfail'))
+        self.assertEqual('i', renderer.abbreviation('inprogress'))
+        renderer = subunit_trace.Renderer(io.StringIO(), False)
+        self.assertEqual('FAILED', renderer.failed)
+        self.assertEqual('ok', renderer.ok)
+        self.assertEqual('SKIPPED', renderer.skipped)
+
+    def test_trace_text_output(self):
+        regular_stream = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'sample_streams/successful.subunit')
+        with open(regular_stream, 'rb') as stream:
+            stdin = io.BytesIO(stream.read())
+        stdout = io.StringIO()
+        returncode = subunit_trace.trace(
+            stdin, stdout, flush_policy=output.EndFlushPolicy())
+        self.assertEqual(0, returncode)
+        self.assertIn(' ... ok\n', stdout.getvalue())
+        self.assertIn('Worker Balance', stdout.getvalue())
+
+    def _sample_stream(self, name='successful.subunit'):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'sample_streams', name)
+        with open(path, 'rb') as stream:
+            return stream.read()
+
+    def test_sessions_are_independent(self):
+        sample = self._sample_stream()
+        outputs = []
+        for _ in range(2):
+            stdout = io.StringIO()
+            subunit_trace.trace(io.BytesIO(sample), stdout)
+            outputs.append(stdout.getvalue())
+        # Results of the first run don't leak into the second one
+        self.assertIn('Ran: 21 tests', outputs[0])
+        self.assertIn('Ran: 21 tests', outputs[1])
+        self.assertIn(' - Passed: 20\n', outputs[1])
+
+    def test_concurrent_sessions(self):
+        streams = [self._sample_stream('successful.subunit'),
+                   self._sample_stream('all_skips.subunit')] * 4
+        sessions = [subunit_trace.TraceSession(io.StringIO())
+                    for _ in streams]
+        returncodes = [None] * len(streams)
+
+        def run(i):
+            returncodes[i] = sessions[i].run(io.BytesIO(streams[i]))
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(len(streams))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([0, 1] * 4, returncodes)
+        for session in sessions[::2]:
+            self.assertEqual(21, session.counters.total)
+            self.assertEqual(20, session.counters.statuses['success'])
+        for session in sessions[1::2]:
+            self.assertEqual(0, session.counters.statuses['success'])
+            self.assertEqual(session.counters.total,
+                             session.counters.statuses['skip'])
+
+    def test_incremental_events(self):
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(stdout)
+        session.start()
+        start = dt(2015, 4, 17, 22, 23, 14, 111111)
+        stop = dt(2015, 4, 17, 22, 23, 15, 111111)
+        session.result.status(test_id='test.a', test_status='inprogress',
+                              timestamp=start)
+        session.result.status(test_id='test.a', test_status='success',
+                              timestamp=stop)
+        session.stop()
+        self.assertEqual(0, session.report())
+        session.output.close()
+        self.assertIn('{0} test.a [1.000000s] ... ok', stdout.getvalue())
+        self.assertIn('Ran: 1 tests', stdout.getvalue())
+
+    def _attachment_stream(self, num_tests, attachment_size):
+        output = io.BytesIO()
+        stream = subunit.v2.StreamResultToBytes(output)
+        timestamp = dt(2015, 4, 17, 22, 23, 14, tzinfo=iso8601.UTC)
+        attachment = b'x' * (attachment_size - 1) + b'\n'
+        for i in range(num_tests):
+            test_id = 'os_testr.tests.test_memory.TestMemory.test_%06d' % i
+            tags = {'worker-%d' % (i % 4)}
+            stream.status(test_id=test_id, test_status='inprogress',
+                          timestamp=timestamp, test_tags=tags)
+            stream.status(test_id=test_id, file_name='stdout',
+                          file_bytes=attachment,
+                          mime_type='text/plain; charset=utf8')
+            stream.status(test_id=test_id,
+                          test_status='fail' if i % 10 == 0 else 'success',
+                          timestamp=timestamp + timedelta(seconds=1),
+                          test_tags=tags)
+        return output.getvalue()
+
+    def test_record_memory_ceiling(self):
+        session = subunit_trace.TraceSession(io.StringIO())
+        test = {'id': 'os_testr.tests.test_memory.TestMemory.test_000000',
+                'status': 'success', 'tags': {'worker-0'}, 'details': {},
+                'timestamps': [dt(2015, 4, 17, 22, 23, 14),
+                               dt(2015, 4, 17, 22, 23, 15)]}
+        num_tests = 10000
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(num_tests):
+                test['id'] = '%s%06d' % (test['id'][:-6], i)
+                session.show_outcome(test)
+            retained = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        self.assertLess(retained * 100000 // num_tests,
+                        subunit_trace.RECORD_MEMORY_CEILING)
+
+    def test_returncode_ids_merged(self):
+        sessions = [subunit_trace.TraceSession(io.StringIO(), source=source)
+                    for source in (None, 'node')]
+        for session in sessions:
+            for test_id in ('test.a', 'process-returncode[worker-0]'):
+                session.show_outcome({
+                    'id': test_id, 'status': 'success',
+                    'tags': {'worker-0'}, 'details': {},
+                    'timestamps': [dt(2015, 4, 17, 22, 23, 14),
+                                   dt(2015, 4, 17, 22, 23, 15)]})
+        sessions[0].merge_results(sessions[1].export_results())
+        self.assertEqual({'process-returncode[worker-0]'},
+                         sessions[0].returncode_ids)
+        self.assertEqual({'test.a': [1.0, 1.0]},
+                         sessions[0].test_durations())
+
+    def test_peak_memory_independent_of_attachments(self):
+        # 1000 tests with 32KiB of captured output each, retaining the
+        # attachments would need more than 30MiB.
+        num_tests = 1000
+        stream = self._attachment_stream(num_tests, 32 * 1024)
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(
+            stdout, failonly=True, print_failures=True)
+        tracemalloc.start()
+        try:
+            session.run(io.BytesIO(stream))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(num_tests, session.counters.total)
+        self.assertLess(peak, len(stream) // 10)
+        for records in session.results.values():
+            for record in records:
+                self.assertIsNone(record.details)
+
+    def test_details_kept_for_post_fails(self):
+        stream = self._attachment_stream(20, 16)
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(stdout, post_fails=True,
+                                             print_failures=True)
+        session.run(io.BytesIO(stream))
+        self.assertEqual(2, len(session.fails))
+        for record in session.fails:
+            self.assertIn('stdout', record.details)
+        self.assertIn('Failed 2 tests - output below', stdout.getvalue())
+        self.assertIn('Captured stdout:', stdout.getvalue())
+
+    def _failure_stream(self):
+        """Three tests failing the same way with a stray address, one not.
+        """
+        output = io.BytesIO()
+        stream = subunit.v2.StreamResultToBytes(output)
+        timestamp = dt(2015, 4, 17, 22, 23, 14, tzinfo=iso8601.UTC)
+        errors = ['ConnectionError: refused at 0x7f%04x' % i
+                  for i in range(3)] + ['AssertionError: 1 != 2']
+        for i, error in enumerate(errors):
+            test_id = 'os_testr.tests.test_fail.TestFail.test_%d' % i
+            traceback = ('Traceback (most recent call last):\n'
+                         '  File "client.py", line 7, in send\n'
+                         '    raise ConnectionError()\n' + error + '\n')
+            stream.status(test_id=test_id, test_status='inprogress',
+                          timestamp=timestamp, test_tags={'worker-0'})
+            stream.status(test_id=test_id, file_name='traceback',
+                          file_bytes=traceback.encode(),
+                          mime_type='text/x-traceback; charset=utf8')
+            stream.status(test_id=test_id, test_status='fail',
+                          timestamp=timestamp + timedelta(seconds=1),
+                          test_tags={'worker-0'})
+        return output.getvalue()
+
+    def test_cluster_failures(self):
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(stdout, post_fails=True,
+                                             cluster_failures=True)
+        self.assertEqual(1, session.run(io.BytesIO(self._failure_stream())))
+        result = stdout.getvalue()
+        first = 'os_testr.tests.test_fail.TestFail.test_0'
+        connection, assertion = session.clusters
+        self.assertEqual(3, connection.count)
+        self.assertEqual(1, assertion.count)
+        # the traceback of a cluster is printed once inline and once after,
+        # its headline by --fails and the summary
+        self.assertEqual(4, result.count('refused at 0x7f0000'))
+        self.assertNotIn('refused at 0x7f0001', result)
+        self.assertEqual(2, result.count(
+            '    [same failure as %s, cluster %s]\n' % (
+                first, connection.signature)))
+        self.assertIn('Failed 4 tests in 2 clusters - output below', result)
+        self.assertIn('[%s] ConnectionError: refused at 0x7f0000 '
+                      '(3 tests)\n' % connection.signature, result)
+        self.assertIn(' - [%s] ConnectionError: refused at 0x7f0000 '
+                      '(3 tests, first: %s)\n' % (connection.signature,
+                                                  first), result)
+        # only the first failure of a cluster keeps its attachments
+        self.assertEqual([True, False, False, True],
+                         [bool(record.details) for record in session.fails])
+        self.assertEqual(
+            session.clusters.to_list(),
+            session.summary_data(timedelta(seconds=1))['failure_clusters'])
+
+    def test_cluster_failures_trace_files(self):
+        _, paths = self._write_inputs([self._failure_stream()] * 2)
+        stdout = io.StringIO()
+        subunit_trace.trace_files(paths, stdout, jobs=2, post_fails=True,
+                                  cluster_failures=True)
+        result = stdout.getvalue()
+        self.assertIn('Failed 8 tests in 2 clusters - output below', result)
+        self.assertIn('ConnectionError: refused at 0x7f0000 (6 tests)',
+                      result)
+
+    # Trace stdin and report the peak RSS of the process, VmHWM is used
+    # because unlike ru_maxrss it isn't inherited from the forking parent.
+    _peak_rss_script = """
+import sys
+from os_testr import subunit_trace
+subunit_trace.trace(sys.stdin.buffer, open(%r, 'w'), failonly=True,
+                    print_failures=True)
+with open('/proc/self/status') as status:
+    for line in status:
+        if line.startswith('VmHWM:'):
+            sys.stderr.write(line.split()[1])
+""" % os.devnull
+
+    def _peak_rss(self, stream):
+        """Trace a stream in a new process and return its peak RSS."""
+        p = subprocess.Popen([sys.executable, '-c', self._peak_rss_script],
+                             stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, err = p.communicate(stream)
+        # VmHWM is reported in KiB
+        return int(err) * 1024
+
+    @testtools.skipUnless(os.path.exists('/proc/self/status'),
+                          'requires /proc/self/status')
+    def test_peak_rss(self):
+        small = self._peak_rss(self._attachment_stream(10, 32 * 1024))
+        large_stream = self._attachment_stream(1000, 32 * 1024)
+        large = self._peak_rss(large_stream)
+        self.assertLess(large - small, len(large_stream) // 4)
+
+    def test_duration_summary(self):
+        stream = self._attachment_stream(20, 16)
+        stdout = io.StringIO()
+        subunit_trace.trace(io.BytesIO(stream), stdout, percentiles=True,
+                            slowest=2)
+        output = stdout.getvalue()
+        self.assertIn('Duration Percentiles', output)
+        self.assertIn(' - p50: 1.0000 sec.', output)
+        self.assertIn('Slowest Tests', output)
+        self.assertEqual(2, output.count(
+            ' sec. os_testr.tests.test_memory.TestMemory.test_0000'))
+
+    def test_slowest_by_class_summary(self):
+        stream = self._attachment_stream(20, 16)
+        stdout = io.StringIO()
+        subunit_trace.trace(io.BytesIO(stream), stdout, slowest=2,
+                            slowest_by_class=True)
+        self.assertIn(' - 20.0000 sec. (20 tests) '
+                      'os_testr.tests.test_memory.TestMemory\n',
+                      stdout.getvalue())
+
+    def _write_inputs(self, streams):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        paths = []
+        for i, stream in enumerate(streams):
+            path = os.path.join(tmp_dir, 'node%d.subunit' % i)
+            with open(path, 'wb') as input_file:
+                input_file.write(stream)
+            paths.append(path)
+        return tmp_dir, paths
+
+    def test_expand_inputs(self):
+        tmp_dir, paths = self._write_inputs([b''] * 3)
+        self.assertEqual(
+            paths, subunit_trace.expand_inputs(
+                [os.path.join(tmp_dir, 'node*.subunit')]))
+        self.assertEqual(paths[:1], subunit_trace.expand_inputs(paths[:1]))
+        self.assertRaises(ValueError, subunit_trace.expand_inputs,
+                          [os.path.join(tmp_dir, 'missing*.subunit')])
+
+    def test_expand_inputs_overlapping(self):
+        tmp_dir, paths = self._write_inputs([b''] * 3)
+        self.assertEqual(
+            [paths[1], paths[0], paths[2]], subunit_trace.expand_inputs(
+                [paths[1], os.path.join(tmp_dir, 'node*.subunit'),
+                 paths[1], os.path.join(tmp_dir, '.', 'node0.subunit')]))
+
+    def test_trace_files(self):
+        streams = [self._sample_stream('successful.subunit'),
+                   self._attachment_stream(20, 16),
+                   self._sample_stream('all_skips.subunit')]
+        _, paths = self._write_inputs(streams)
+        stdout = io.StringIO()
+        returncode = subunit_trace.trace_files(
+            paths, stdout, jobs=2, post_fails=True, print_failures=True,
+            percentiles=True, slowest=3)
+        result = stdout.getvalue()
+        expected = subunit_trace.TraceSession(io.StringIO(), percentiles=True)
+        for stream in streams:
+            expected.consume(io.BytesIO(stream))
+        # the failures of the second file make the merged run fail
+        self.assertEqual(1, returncode)
+        self.assertIn('Ran: %s tests' % expected.counters.total, result)
+        self.assertIn(' - Passed: %s\n' %
+                      expected.counters.statuses['success'], result)
+        self.assertIn('Failed 2 tests - output below', result)
+        self.assertIn('Captured stdout:', result)
+        self.assertIn(' - Worker %s:3 (5 tests) => ' % paths[1], result)
+        self.assertIn('{%s:0} ' % paths[0], result)
+        self.assertNotIn('WARNING: missing Worker', result)
+        self.assertIn(' - p90: %.4f sec.' %
+                      expected.histogram.percentile(90), result)
+        # the output of the files is in the order they were given
+        self.assertLess(result.index(paths[0]), result.index(paths[1]))
+        self.assertLess(result.index(paths[1]), result.index(paths[2]))
+
+    def test_trace_files_in_process(self):
+        _, paths = self._write_inputs(
+            [self._sample_stream('successful.subunit')] * 2)
+        stdout = io.StringIO()
+        with patch('concurrent.futures.ProcessPoolExecutor') as pool:
+            returncode = subunit_trace.trace_files(paths, stdout, jobs=1)
+        self.assertEqual(0, returncode)
+        self.assertFalse(pool.called)
+        self.assertIn('Ran: 42 tests', stdout.getvalue())
+        self.assertIn(' - Passed: 40\n', stdout.getvalue())
+
+    def test_listen(self):
+        streams = [self._sample_stream('successful.subunit'),
+                   self._attachment_stream(20, 16)]
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'trace.sock')
+        address = aggregate.parse_address('unix:%s' % path)
+        ready = threading.Event()
+        stdout = io.StringIO()
+        returncodes = []
+        server = threading.Thread(target=lambda: returncodes.append(
+            subunit_trace.listen(address, stdout, connections=2,
+                                 ready=lambda bound: ready.set(),
+                                 print_failures=True, percentiles=True)))
+        server.start()
+        self.addCleanup(server.join, 10)
+        self.assertTrue(ready.wait(10))
+        clients = [threading.Thread(target=aggregate.send,
+                                    args=(address, io.BytesIO(stream)))
+                   for stream in streams]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        server.join(10)
+        expected = subunit_trace.TraceSession(io.StringIO(), percentiles=True)
+        for stream in streams:
+            expected.consume(io.BytesIO(stream))
+        result = stdout.getvalue()
+        self.assertEqual([1], returncodes)
+        self.assertIn('Ran: %s tests' % expected.counters.total, result)
+        self.assertIn(' - Passed: %s\n' %
+                      expected.counters.statuses['success'], result)
+        self.assertIn(' - p90: %.4f sec.' %
+                      expected.histogram.percentile(90), result)
+        # the 8 workers of the first stream and the 4 of the second one are
+        # kept apart
+        self.assertEqual(12, len([line for line in result.splitlines()
+                                  if line.startswith(' - Worker unix-')]))
+        self.assertIn('Captured stdout:', result)
+
+    def test_worker_balance_order(self):
+        session = subunit_trace.TraceSession(io.StringIO(), source='node')
+        for worker in (10, 2, 0):
+            session.counters.add('node:%d' % worker, 'success', (None, None))
+        session.print_summary(timedelta(seconds=1))
+        session.output.close()
+        summary = session.output.stream.getvalue()
+        self.assertLess(summary.index('Worker node:0'),
+                        summary.index('Worker node:2'))
+        self.assertLess(summary.index('Worker node:2'),
+                        summary.index('Worker node:10'))
+
+    def _trace_output(self, stream, **kwargs):
+        stdout = io.StringIO()
+        returncode = subunit_trace.trace(io.BytesIO(stream), stdout, **kwargs)
+        return returncode, re.sub(r'in [0-9.]+ sec', 'in X sec',
+                                  stdout.getvalue())
+
+    @data(*[(name, options)
+            for name in ('successful.subunit', 'all_skips.subunit', None)
+            for options in ({}, {'post_fails': True}, {'abbreviate': True},
+                            {'failonly': True},
+                            {'print_failures': True, 'post_fails': True},
+                            {'percentiles': True, 'slowest': 5})])
+    @unpack
+    def test_fast_decoder_output(self, name, options):
+        if name is None:
+            stream = (b'leading output\n' + self._attachment_stream(50, 64) +
+                      b'trailing output\n')
+        else:
+            stream = self._sample_stream(name)
+        self.assertEqual(self._trace_output(stream, **options),
+                         self._trace_output(stream, fast_decoder=True,
+                                            **options))
+
+    def test_truncated_stream_packet_data(self):
+        # the binary packet data of the parser error is only described
+        stream = self._attachment_stream(10, 64)[:-10]
+        returncode, text = self._trace_output(stream)
+        self.assertEqual(1, returncode)
+        self.assertIn('Captured Packet data:', text)
+        self.assertRegex(text, r'    \[\d+ bytes of application/octet-stream '
+                               r'not shown\]\n')
+
+    def test_fast_decoder_truncated_stream(self):
+        stream = self._attachment_stream(10, 64)[:-10]
+        expected = self._trace_output(stream, print_failures=True)
+        self.assertIn('subunit.parser', expected[1])
+        self.assertEqual(expected,
+                         self._trace_output(stream, print_failures=True,
+                                            fast_decoder=True))
+
+    @data(False, True)
+    def test_gzip_input(self, fast_decoder):
+        stream = self._attachment_stream(20, 64)
+        # a buffered stream, like stdin
+        compressed = io.BufferedReader(io.BytesIO(gzip.compress(stream)))
+        stdout = io.StringIO()
+        returncode = subunit_trace.trace(compressed, stdout,
+                                         print_failures=True,
+                                         fast_decoder=fast_decoder)
+        self.assertEqual(self._trace_output(stream, print_failures=True), (
+            returncode, re.sub(r'in [0-9.]+ sec', 'in X sec',
+                               stdout.getvalue())))
+
+    def test_trace_gzip_files(self):
+        tmp_dir, paths = self._write_inputs(
+            [gzip.compress(self._sample_stream('successful.subunit'))] * 2)
+        stdout = io.StringIO()
+        returncode = subunit_trace.trace_files(paths, stdout, jobs=1)
+        self.assertEqual(0, returncode)
+        self.assertIn('Ran: 42 tests', stdout.getvalue())
+
+    @data(False, True)
+    def test_profile(self, fast_decoder):
+        stream = self._attachment_stream(20, 64)
+        profiler = profiling.PhaseProfiler('subunit-trace')
+        self.assertEqual(
+            self._trace_output(stream, fast_decoder=fast_decoder),
+            self._trace_output(stream, fast_decoder=fast_decoder,
+                               profiler=profiler))
+        report = profiler.report()
+        self.assertEqual(['decode', 'tests', 'attachments', 'write',
+                          'summary'], list(report['phases']))
+        self.assertEqual(20, report['phases']['tests']['calls'])
+        self.assertEqual(20, report['phases']['attachments']['calls'])
+        self.assertLessEqual(report['phases']['tests']['wall_time'],
+                             report['phases']['decode']['wall_time'])
+        self.assertEqual(60, report['counters']['events'])
+
+    def test_balance(self):
+        plan_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'plan.json')
+        stream = self._sample_stream('successful.subunit')
+        returncode, summary = self._trace_output(
+            stream, balance=True, balance_plan=plan_path)
+        self.assertEqual(0, returncode)
+        self.assertIn('\n==================\nWorker Utilisation\n', summary)
+        self.assertRegex(summary, r' - Worker 0 \(\d+ tests\): busy [0-9.]+ '
+                                  r'sec\., idle [0-9.]+ sec\. in \d+ gaps')
+        self.assertIn('Rebalanced makespan: ', summary)
+        with open(plan_path) as plan_file:
+            plan = json.load(plan_file)
+        tests = [t for a in plan['assignments'] for t in a['tests']]
+        self.assertEqual(len(tests), len(set(tests)))
+        self.assertNotIn('process-returncode', tests)
+        self.assertLessEqual(plan['ideal_makespan'], plan['makespan'])
+
+    def test_regression_report(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        baseline_path = os.path.join(tmp_dir, 'baseline.json')
+        report_path = os.path.join(tmp_dir, 'report.json')
+        # every test of the stream takes 1 second
+        test_id = 'os_testr.tests.test_memory.TestMemory.test_%06d'
+        regression.write_baseline(baseline_path, [
+            (test_id % 0, regression.BaselineStats(0.5, 0.001, 10)),
+            (test_id % 1, regression.BaselineStats(0.9, 0.001, 10)),
+            (test_id % 2, regression.BaselineStats(0.9, 0.5, 10)),
+            (test_id % 3, regression.BaselineStats(1.0, 0.001, 10)),
+        ] + [(test_id % i, regression.BaselineStats(0.8, 0.001, 10))
+             for i in range(10, 25)])
+        returncode, summary = self._trace_output(
+            self._attachment_stream(20, 64), print_failures=True,
+            regression_baseline=baseline_path,
+            regression_report=report_path)
+        self.assertEqual(1, returncode)
+        self.assertIn(
+            '\n===================\nRuntime Regressions\n'
+            '===================\n'
+            '12 of 14 tests compared with the baseline are slower '
+            '(p < 0.01), adding 2.6000 sec.\n'
+            ' - +0.5000 sec. %s (0.5000 sec. -> 1.0000 sec., p=' % (
+                test_id % 0), summary)
+        self.assertIn(' - ... 2 more\n', summary)
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(14, report['compared'])
+        self.assertEqual([test_id % i for i in [0] + list(range(10, 20)) +
+                          [1]],
+                         [r['test_id'] for r in report['regressions']])
+
+    def test_timing_history(self):
+        history_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'history.sqlite')
+        test_id = 'os_testr.tests.test_memory.TestMemory.test_000001'
+        history = timing.TimingHistory(history_path)
+        history.add_run([(test_id, 2.0)])
+        history.close()
+        # every test of the stream takes 1 second
+        returncode, summary = self._trace_output(
+            self._attachment_stream(20, 64), print_failures=True,
+            enable_diff=True, timing_history=history_path)
+        self.assertEqual(1, returncode)
+        self.assertIn('test_000001 [1.000000s -50.00%] ... ok', summary)
+        history = timing.TimingHistory(history_path)
+        self.addCleanup(history.close)
+        self.assertEqual(2, history.runs)
+        # the failed tests aren't recorded
+        self.assertEqual(18, len(history))
+        self.assertEqual((1.5, 0.25, 2), history.stats([test_id])[test_id])
+
+    def _json_events(self, stream, **kwargs):
+        stdout = io.StringIO()
+        returncode = subunit_trace.trace(io.BytesIO(stream), stdout,
+                                         json_lines=True, **kwargs)
+        return returncode, [json.loads(line)
+                            for line in stdout.getvalue().splitlines()]
+
+    @data(False, True)
+    def test_json_output(self, fast_decoder):
+        stream = self._attachment_stream(20, 64)
+        returncode, events = self._json_events(
+            b'leading output\n' + stream, fast_decoder=fast_decoder,
+            percentiles=True, slowest=2, balance=True)
+        self.assertEqual(1, returncode)
+        self.assertEqual({'event': 'file', 'name': 'stdout',
+                          'data': 'leading output\n'}, events[0])
+        tests = events[1:-1]
+        self.assertEqual(20, len(tests))
+        self.assertEqual({
+            'event': 'test',
+            'id': 'os_testr.tests.test_memory.TestMemory.test_000001',
+            'status': 'success', 'worker': 1, 'duration': 1.0,
+            'tags': ['worker-1']}, tests[1])
+        self.assertEqual(2, len([t for t in tests if t['status'] == 'fail']))
+        summary = events[-1]
+        self.assertEqual('summary', summary['event'])
+        self.assertEqual(20, summary['total'])
+        self.assertEqual({'success': 18, 'skip': 0, 'xfail': 0,
+                          'uxsuccess': 0, 'fail': 2}, summary['statuses'])
+        self.assertEqual(20.0, summary['run_time'])
+        self.assertFalse(summary['successful'])
+        self.assertEqual([0, 1, 2, 3],
+                         [w['worker'] for w in summary['workers']])
+        self.assertEqual(5, summary['workers'][0]['tests'])
+        self.assertEqual([], summary['missing_workers'])
+        self.assertEqual(['p50', 'p90', 'p99'],
+                         sorted(summary['percentiles']))
+        self.assertEqual(2, len(summary['slowest_tests']))
+        self.assertEqual(4, len(summary['balance']['workers']))
+
+    def test_json_output_skips(self):
+        returncode, events = self._json_events(
+            self._sample_stream('all_skips.subunit'))
+        self.assertEqual(1, returncode)
+        skips = [e for e in events if e['event'] == 'test']
+        self.assertTrue(skips)
+        self.assertTrue(all(e['status'] == 'skip' and e['reason']
+                            for e in skips))
+        self.assertEqual(0, events[-1]['statuses']['success'])
+        self.assertFalse(events[-1]['successful'])
+
+    def test_json_output_successful(self):
+        returncode, events = self._json_events(
+            self._sample_stream('successful.subunit'), no_summary=True)
+        self.assertEqual(0, returncode)
+        self.assertEqual({'test'}, set(e['event'] for e in events))
+        self.assertNotIn('process-returncode',
+                         [e['id'] for e in events])
+
+    def test_json_output_no_tests(self):
+        self.assertEqual((1, [{
+            'event': 'summary', 'total': 0, 'elapsed': mock.ANY,
+            'statuses': {'success': 0, 'skip': 0, 'xfail': 0,
+                         'uxsuccess': 0, 'fail': 0},
+            'run_time': 0.0, 'workers': [], 'missing_workers': [],
+            'successful': False}]), self._json_events(b''))
+
+    def test_json_trace_files(self):
+        tmp_dir, paths = self._write_inputs(
+            [self._sample_stream('successful.subunit')] * 2)
+        stdout = io.StringIO()
+        returncode = subunit_trace.trace_files(paths, stdout, jobs=1,
+                                               json_lines=True)
+        self.assertEqual(0, returncode)
+        events = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(43, len(events))
+        self.assertEqual(42, events[-1]['total'])
+        self.assertIn('%s:0' % paths[1], [e['worker'] for e in events[:-1]])
+
+    def test_sinks(self):
+        class RecordingSink(sinks.Sink):
+            def __init__(self):
+                self.tests = []
+                self.files = []
+                self.summary = None
+
+            def test(self, record, test):
+                self.tests.append((record.test_id, test['status']))
+
+            def file(self, file_name, file_bytes, route_code=None):
+                self.files.append((file_name, file_bytes))
+
+            def close(self, summary):
+                self.summary = summary
+
+        sink = RecordingSink()
+        stream = self._sample_stream('successful.subunit')
+        returncode, text = self._trace_output(b'leading output\n' + stream,
+                                              sinks=[sink])
+        self.assertEqual(self._trace_output(b'leading output\n' + stream),
+                         (returncode, text))
+        self.assertEqual(21, len(sink.tests))
+        self.assertEqual(b'leading output\n',
+                         b''.join(data for _, data in sink.files))
+        self.assertEqual(21, sink.summary['total'])
+
+    def test_trace_files_sinks(self):
+        tmp_dir, paths = self._write_inputs(
+            [self._sample_stream('successful.subunit')] * 2)
+        sink = mock.Mock(spec=sinks.Sink)
+        with patch('concurrent.futures.ProcessPoolExecutor') as pool:
+            returncode = subunit_trace.trace_files(
+                paths, io.StringIO(), jobs=2, sinks=[sink])
+        self.assertEqual(0, returncode)
+        self.assertFalse(pool.called)
+        self.assertEqual(42, sink.test.call_count)
+        sink.close.assert_called_once_with(mock.ANY)
+        self.assertEqual(42, sink.close.call_args[0][0]['total'])
+
+    def test_progress(self):
+        stream = self._attachment_stream(20, 64)
+        expected = ['os_testr.tests.test_memory.TestMemory.test_%06d' % i
+                    for i in range(40)]
+        returncode, text = self._trace_output(
+            stream, progress=True, expected_tests=expected,
+            print_failures=True, timing_db=os.devnull, progress_interval=0)
+        self.assertEqual(1, returncode)
+        lines = text.splitlines()
+        # only failures and the progress are printed before the summary
+        self.assertEqual('Progress: 1/40 tests (2.5%)', lines[1][:27])
+        self.assertIn('test_000000 [1.000000s] ... FAILED', lines[0])
+        self.assertNotIn('... ok', text)
+        self.assertEqual(2, len([line for line in lines
+                                 if line.endswith('FAILED')]))
+        self.assertTrue(lines[22].startswith(
+            'Progress: 20/40 tests (50.0%), '))
+        self.assertEqual('', lines[23])
+        self.assertEqual('======', lines[24])
+
+    def _follow_output(self, path, **kwargs):
+        stdout = io.StringIO()
+        returncode = subunit_trace.follow_file(path, stdout, idle_timeout=0,
+                                               no_summary=True, **kwargs)
+        return returncode, stdout.getvalue()
+
+    def test_follow(self):
+        stream = self._attachment_stream(20, 64)
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'results.subunit')
+        with open(path, 'wb') as stream_file:
+            stream_file.write(stream)
+        self.assertEqual(self._trace_output(stream, no_summary=True),
+                         self._follow_output(path))
+
+    def test_follow_resume(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(tmp_dir, 'results.subunit')
+        checkpoint = os.path.join(tmp_dir, 'checkpoint.json')
+        stream = self._attachment_stream(20, 64)
+        # stop in the middle of the attachment of the 6th test
+        with open(path, 'wb') as stream_file:
+            attachment = stream.index(
+                b'test_000005', stream.index(b'test_000005') + 1)
+            stream_file.write(stream[:stream.index(b'xxx', attachment)])
+        _, text = self._follow_output(path, checkpoint=checkpoint,
+                                      print_failures=True)
+        self.assertIn('test_000004', text)
+        # the incomplete packet is reported once following stops
+        self.assertIn('subunit.parser', text)
+        self.assertNotIn('test_000005 [1.000000s]', text)
+        with open(path, 'wb') as stream_file:
+            stream_file.write(stream)
+        _, text = self._follow_output(path, checkpoint=checkpoint)
+        self.assertNotIn('test_000004', text)
+        self.assertTrue(text.startswith(
+            '{1} os_testr.tests.test_memory.TestMemory.test_000005 '
+            '[1.000000s] ... ok'))
+        self.assertIn('test_000019 [1.000000s] ... ok', text)
+
+    def test_follow_past_end(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'results.subunit')
+        with open(path, 'wb') as stream_file:
+            stream_file.write(self._sample_stream('successful.subunit'))
+        process = subprocess.run(
+            ['subunit-trace', '--follow', path, '--offset', '100000000',
+             '--follow-timeout', '5'], capture_output=True)
+        self.assertEqual(1, process.returncode)
+        self.assertEqual(
+            ('%s is shorter than the offset 100000000\n' % path).encode(),
+            process.stderr)
+
+
+class TestAttachmentPrinter(base.TestCase):
+
+    def _content(self, *chunks, **parameters):
+        parameters.setdefault('charset', 'utf8')
+        return content.Content(content.ContentType('text', 'plain',
+                                                   parameters),
+                               lambda: iter(chunks))
+
+    def _print(self, printer, **details):
+        stream = io.StringIO()
+        printer.print_details(stream, details)
+        return stream.getvalue()
+
+    def test_print_details(self):
+        details = {'stdout': self._content(b'first\nsec', b'ond\n'),
+                   'stderr': self._content(b'', b''),
+                   'log': self._content(b'not printed')}
+        stream = io.StringIO()
+        subunit_trace.print_details(stream, details)
+        self.assertEqual('\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n'
+                         '    first\n    second\n    \n', stream.getvalue())
+
+    def test_split_characters(self):
+        text = u'caf\xe9 \u2603'.encode('utf8')
+        self.assertEqual(
+            '\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n'
+            '    caf\xe9 \u2603\n',
+            self._print(subunit_trace.AttachmentPrinter(),
+                        stdout=self._content(*[text[i:i + 1]
+                                               for i in range(len(text))])))
+        self.assertEqual(
+            '\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n    caf\xe9\n',
+            self._print(subunit_trace.AttachmentPrinter(),
+                        stdout=self._content(b'caf\xe9', charset='latin1')))
+
+    def test_attachment_limit(self):
+        printer = subunit_trace.AttachmentPrinter(limit=9)
+        self.assertEqual(
+            '\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n'
+            '    line1\n    [... 15 bytes elided ...]\n    ne4\n    \n',
+            self._print(printer, stdout=self._content(
+                b'line1\nline2', b'\nline3\n', b'line4\n')))
+        self.assertEqual(9, printer.printed)
+        self.assertEqual(15, printer.elided)
+        # the head ends in the middle of a line
+        self.assertEqual(
+            '\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n'
+            '    ab\n    [... 8 bytes elided ...]\n    kl\n',
+            self._print(subunit_trace.AttachmentPrinter(limit=4),
+                        stdout=self._content(b'abcdefghijkl')))
+        # an attachment within the limit is printed whole
+        self.assertEqual(
+            '\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n    abcd\n',
+            self._print(subunit_trace.AttachmentPrinter(limit=4),
+                        stdout=self._content(b'ab', b'cd')))
+
+    def test_run_limit(self):
+        printer = subunit_trace.AttachmentPrinter(limit=4, run_limit=6)
+        self.assertEqual(
+            '\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n'
+            '    ab\n    [... 2 bytes elided ...]\n    ef\n'
+            '\nCaptured stderr:\n~~~~~~~~~~~~~~~~\n'
+            '    g\n    [... 4 bytes elided ...]\n    l\n',
+            self._print(printer, stdout=self._content(b'abcdef'),
+                        stderr=self._content(b'ghijkl')))
+        self.assertEqual(
+            '\nCaptured stdout:\n~~~~~~~~~~~~~~~~\n'
+            '    [... 3 bytes elided ...]\n    \n',
+            self._print(printer, stdout=self._content(b'xyz')))
+        self.assertEqual(6, printer.printed)
+        self.assertEqual(9, printer.elided)
+
+    def test_large_attachment_memory(self):
+        # 64MiB of output in 64KiB chunks, only 1MiB is printed
+        chunk = (b'x' * 1023 + b'\n') * 64
+        details = {'stdout': content.Content(
+            content.ContentType('text', 'plain', {'charset': 'utf8'}),
+            lambda: itertools.repeat(chunk, 1024))}
+        stream = output.OutputWriter(open(os.devnull, 'w'))
+        self.addCleanup(stream.close)
+        printer = subunit_trace.AttachmentPrinter(limit=1024 * 1024)
+        tracemalloc.start()
+        try:
+            printer.print_details(stream, details)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(1024 * 1024, printer.printed)
+        self.assertEqual(63 * 1024 * 1024, printer.elided)
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+    def test_session_limits(self):
+        stream = io.BytesIO(TestSubunitTrace._attachment_stream(None, 4, 64))
+        stdout = io.StringIO()
+        subunit_trace.trace(stream, stdout, attachment_limit=8,
+                            run_attachment_limit=20)
+        text = stdout.getvalue()
+        self.assertEqual(2, text.count('    xxxx\n    [... 56 bytes elided'))
+        self.assertIn('    xx\n    [... 60 bytes elided ...]\n    x\n', text)
+        self.assertIn('    [... 64 bytes elided ...]\n', text)
+
+    def test_parse_size(self):
+        self.assertEqual(4096, subunit_trace.parse_size('4096'))
+        self.assertEqual(64 * 1024, subunit_trace.parse_size('64K'))
+        self.assertEqual(1024 ** 2, subunit_trace.parse_size('1mb'))
+        self.assertRaises(ValueError, subunit_trace.parse_size, '1.5M')
@@ -0,0 +1,155 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import os
+import socket
+import threading
+import time
+
+from ddt import data
+from ddt import ddt
+from ddt import unpack
+import fixtures
+
+from os_testr.tests import base
+from os_testr.utils import aggregate
+
+
+@ddt
+class TestParseAddress(base.TestCase):
+
+    @data(('unix:/tmp/trace.sock', ('unix', None, None, '/tmp/trace.sock')),
+          ('tcp:127.0.0.1:4000', ('tcp', '127.0.0.1', 4000, None)),
+          ('tcp:[::1]:4000', ('tcp', '::1', 4000, None)),
+          ('tcp::0', ('tcp', None, 0, None)))
+    @unpack
+    def test_parse_address(self, spec, expected):
+        address = aggregate.parse_address(spec)
+        self.assertEqual(aggregate.Address(*expected), address)
+        if address.host is not None:
+            self.assertEqual(spec, aggregate.format_address(address))
+
+    @data('unix:', 'tcp:localhost', 'tcp:localhost:http',
+          'tcp:localhost:65536', 'udp:localhost:4000', '/tmp/trace.sock')
+    def test_invalid_address(self, spec):
+        self.assertRaises(aggregate.AddressError, aggregate.parse_address,
+                          spec)
+
+
+class TestAggregator(base.TestCase):
+
+    def setUp(self):
+        super(TestAggregator, self).setUp()
+        self.streams = {}
+        self.closed = []
+
+    def _on_connection(self, source):
+        data = self.streams[source] = bytearray()
+
+        def close():
+            self.closed.append(source)
+        return data.extend, close
+
+    def _serve(self, address, **kwargs):
+        bound = []
+        ready = threading.Event()
+
+        def on_ready(address):
+            bound.append(address)
+            ready.set()
+        server = aggregate.Aggregator(address, self._on_connection,
+                                      ready=on_ready, **kwargs)
+        errors = []
+
+        def run():
+            try:
+                server.run()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                ready.set()
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        self.assertTrue(ready.wait(10))
+        return server, thread, bound[0] if bound else None, errors
+
+    def _unix_address(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'trace.sock')
+        return aggregate.parse_address('unix:%s' % path)
+
+    def test_tcp_clients(self):
+        server, thread, address, errors = self._serve(
+            aggregate.parse_address('tcp:127.0.0.1:0'), connections=3)
+        self.assertNotEqual(0, address.port)
+        payloads = [os.urandom(200000) for _ in range(3)]
+        clients = [threading.Thread(target=aggregate.send,
+                                    args=(address, io.BytesIO(payload)))
+                   for payload in payloads]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([], errors)
+        self.assertEqual(3, server.accepted)
+        self.assertEqual(sorted(payloads),
+                         sorted(bytes(s) for s in self.streams.values()))
+        self.assertEqual(sorted(self.streams), sorted(self.closed))
+        for source in self.streams:
+            self.assertRegex(source, r'^127\.0\.0\.1:\d+$')
+
+    def test_unix_clients(self):
+        address = self._unix_address()
+        server, thread, bound, errors = self._serve(address, connections=2)
+        self.assertEqual(address, bound)
+        aggregate.send(address, io.BytesIO(b'first'))
+        aggregate.send(address, io.BytesIO(b'second'))
+        thread.join(10)
+        self.assertEqual([], errors)
+        self.assertEqual({'unix-1': b'first', 'unix-2': b'second'},
+                         self.streams)
+        # the socket is removed once the server is done
+        self.assertFalse(os.path.exists(address.path))
+
+    def test_idle_timeout(self):
+        address = self._unix_address()
+        start = time.monotonic()
+        server, thread, _, errors = self._serve(address, idle_timeout=0.2)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address.path)
+        client.sendall(b'partial')
+        # a connected client keeps the server going
+        time.sleep(0.4)
+        self.assertTrue(thread.is_alive())
+        client.close()
+        thread.join(10)
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+        self.assertEqual([], errors)
+        self.assertEqual({'unix-1': b'partial'}, self.streams)
+        self.assertEqual(['unix-1'], self.closed)
+
+    def test_decoder_error(self):
+        def on_connection(source):
+            def feed(data):
+                raise RuntimeError('broken')
+            return feed, lambda: None
+        self._on_connection = on_connection
+        address = self._unix_address()
+        server, thread, _, errors = self._serve(address)
+        aggregate.send(address, io.BytesIO(b'data'))
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(['broken'], [str(error) for error in errors])
@@ -0,0 +1,95 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from os_testr.subunit_trace import ResultRecord
+from os_testr.tests import base
+from os_testr.utils import balance
+
+
+def _records(worker, *intervals):
+    return [ResultRecord('test.%s.%d' % (worker, i), 'success', worker,
+                         start, stop)
+            for i, (start, stop) in enumerate(intervals)]
+
+
+class TestWorkerLoad(base.TestCase):
+
+    def test_gaps(self):
+        load = balance.WorkerLoad(0, [(0, 1), (1, 3), (4, 5), (7, 8)])
+        self.assertEqual(4, load.tests)
+        self.assertEqual(8, load.span)
+        self.assertEqual(5, load.busy)
+        self.assertEqual(3, load.idle)
+        self.assertEqual(2, load.gaps)
+        self.assertEqual(2, load.longest_gap)
+
+    def test_overlapping_tests(self):
+        load = balance.WorkerLoad(0, [(0, 4), (1, 2), (3, 6), (8, 9)])
+        self.assertEqual(7, load.busy)
+        self.assertEqual(2, load.idle)
+        self.assertEqual(1, load.gaps)
+
+
+class TestLptPartition(base.TestCase):
+
+    def test_partition(self):
+        durations = [(4, 'c'), (7, 'a'), (3, 'e'), (5, 'b'), (4, 'd'),
+                     (3, 'f')]
+        # the best split is 13 and 13, LPT is within 4/3 of it
+        self.assertEqual([(14, ['a', 'd', 'f']), (12, ['b', 'c', 'e'])],
+                         balance.lpt_partition(durations, 2))
+
+    def test_more_workers_than_tests(self):
+        self.assertEqual([(2, ['a']), (1, ['b']), (0.0, [])],
+                         balance.lpt_partition([(1, 'b'), (2, 'a')], 3))
+
+
+class TestBalanceReport(base.TestCase):
+
+    def _report(self):
+        # worker 0 is busy for 9 of the 10 seconds, worker 1 for 4 and it
+        # is done 6 seconds early
+        return balance.BalanceReport([
+            (0, _records(0, (0, 4), (5, 10))),
+            (1, _records(1, (0, 1), (1, 3), (2, 4)) +
+             [ResultRecord('test.unfinished', 'inprogress', 1, 1)]),
+        ])
+
+    def test_report(self):
+        report = self._report()
+        self.assertEqual([0, 1], [load.worker for load in report.workers])
+        self.assertEqual(10, report.makespan)
+        self.assertEqual(13, report.busy)
+        self.assertEqual(0.9, report.utilisation(report.workers[0]))
+        self.assertEqual(0.65, report.utilisation())
+        # the tests take 14 seconds in all
+        self.assertEqual(7, report.ideal_makespan)
+        self.assertEqual(7, report.lpt_makespan)
+
+    def test_plan_dict(self):
+        plan = self._report().plan_dict()
+        self.assertEqual(2, plan['workers'])
+        self.assertEqual(10, plan['observed_makespan'])
+        self.assertEqual([0, 1], [a['worker'] for a in plan['assignments']])
+        self.assertEqual(
+            ['test.0.0', 'test.0.1', 'test.1.0', 'test.1.1', 'test.1.2'],
+            sorted(t for a in plan['assignments'] for t in a['tests']))
+        self.assertEqual(plan['makespan'],
+                         max(a['load'] for a in plan['assignments']))
+
+    def test_no_timestamps(self):
+        report = balance.BalanceReport(
+            [(0, [ResultRecord('test.a', 'success', 0)])])
+        self.assertEqual([], report.workers)
+        self.assertEqual(0, report.makespan)
+        self.assertEqual(0, report.ideal_makespan)
+        self.assertEqual(0, report.lpt_makespan)
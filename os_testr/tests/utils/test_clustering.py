@@ -0,0 +1,164 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import pickle
+
+from ddt import data
+from ddt import ddt
+from ddt import unpack
+from testtools import content
+
+from os_testr.tests import base
+from os_testr.utils import clustering
+
+_TRACEBACK = """Traceback (most recent call last):
+  File "/src/pkg/tests/test_api.py", line %(line)d, in %(test)s
+    self.client.create()
+  File "/venv/lib/site-packages/requests/adapters.py", line 519, in send
+    raise ConnectionError(e, request=request)
+    ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+requests.exceptions.ConnectionError: %(message)s
+"""
+
+
+def _traceback(line=10, test='test_a', message='Connection refused'):
+    return _TRACEBACK % dict(line=line, test=test, message=message)
+
+
+@ddt
+class TestSignature(base.TestCase):
+
+    @data(('object at 0x7f3a2b1c0d90', 'object at <address>'),
+          ('request 6f1c9a2e-7b3d-4e8f-9a0b-1c2d3e4f5a6b failed',
+           'request <uuid> failed'),
+          ('at 2026-01-01T10:00:00.123456+00:00 and 10:00:01,5',
+           'at <time> and <time>'),
+          ('image 3f2a9c8e7d6b5a41 and port 38765',
+           'image <id> and port <number>'),
+          ('after 30.02 seconds, 3 != 4', 'after <number> seconds, 3 != 4'),
+          ('deadbeefcafe is a word', 'deadbeefcafe is a word'))
+    @unpack
+    def test_normalize(self, text, expected):
+        self.assertEqual(expected, clustering.normalize(text))
+
+    def test_same_cause(self):
+        first = clustering.signature(_traceback(
+            message='server 1234 at 0x7f00aa, request %s' % ('a1' * 8)),
+            'pkg.tests.test_api.Test.test_a')
+        second = clustering.signature(_traceback(
+            line=42, test='test_b',
+            message='server 9876 at 0x7f00bb, request %s' % ('b2' * 8)),
+            'pkg.tests.test_api.Test.test_b')
+        # only the innermost frame and the exception are signed
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(
+            'requests.exceptions.ConnectionError: server 1234 at 0x7f00aa, '
+            'request %s' % ('a1' * 8), first[1])
+
+    def test_different_cause(self):
+        self.assertNotEqual(
+            clustering.signature(_traceback())[0],
+            clustering.signature(_traceback(message='Timed out'))[0])
+        self.assertNotEqual(
+            clustering.signature(_traceback())[0],
+            clustering.signature(_traceback(), status='uxsuccess')[0])
+
+    def test_test_id_replaced(self):
+        signatures = set()
+        for test_id in ('pkg.test_a', 'pkg.test_b'):
+            signatures.add(clustering.signature(
+                _traceback(message='%s timed out' % test_id), test_id)[0])
+        self.assertEqual(1, len(signatures))
+
+    def test_not_a_traceback(self):
+        signature, headline = clustering.signature(
+            '\nFailed at 0x1234\nexit code 3\n')
+        self.assertEqual('Failed at 0x1234', headline)
+        self.assertEqual(signature, clustering.signature(
+            'Failed at 0xabcd\nexit code 3')[0])
+        self.assertEqual('uxsuccess',
+                         clustering.signature('', status='uxsuccess')[1])
+
+    def test_long_headline(self):
+        headline = clustering.signature(_traceback(message='x' * 500))[1]
+        self.assertEqual(clustering.HEADLINE_LIMIT, len(headline))
+        self.assertTrue(headline.endswith('...'))
+
+    def test_read_traceback(self):
+        details = {
+            'traceback': content.Content(
+                content.ContentType('text', 'x-traceback',
+                                    {'charset': 'utf8'}),
+                lambda: [b'x' * 1000] * 100 + [_traceback().encode()]),
+            'stdout': content.text_content('not a traceback'),
+        }
+        text = clustering.read_traceback(details)
+        self.assertEqual(clustering.TRACEBACK_LIMIT, len(text))
+        self.assertTrue(text.endswith(_traceback()))
+
+
+class TestFailureClusters(base.TestCase):
+
+    def test_add(self):
+        clusters = clustering.FailureClusters()
+        for i in range(5):
+            cluster = clusters.add('test_%d' % i, _traceback(
+                line=i, message='request at 0x%x' % i))
+            self.assertEqual(i + 1, cluster.count)
+        odd = clusters.add('test_odd', _traceback(message='Timed out'))
+        self.assertEqual(1, odd.count)
+        self.assertEqual(2, len(clusters))
+        self.assertEqual([5, 1], [cluster.count for cluster in clusters])
+        self.assertEqual('test_0', cluster.first)
+        self.assertEqual([
+            {'signature': cluster.signature,
+             'headline': 'requests.exceptions.ConnectionError: '
+                         'request at 0x0',
+             'count': 5, 'tests': ['test_%d' % i for i in range(5)]},
+            {'signature': odd.signature,
+             'headline': 'requests.exceptions.ConnectionError: Timed out',
+             'count': 1, 'tests': ['test_odd']}], clusters.to_list())
+
+    def test_add_test(self):
+        clusters = clustering.FailureClusters()
+        cluster = clusters.add_test({
+            'id': 'test_a', 'status': 'fail',
+            'details': {'traceback': content.text_content(_traceback())}})
+        self.assertEqual(clustering.signature(_traceback(), 'test_a')[0],
+                         cluster.signature)
+
+    def test_overflow(self):
+        clusters = clustering.FailureClusters(max_clusters=2)
+        for message in ('a', 'b', 'c', 'd', 'a'):
+            clusters.add('test_%s' % message, _traceback(message=message))
+        self.assertEqual(3, len(clusters))
+        self.assertEqual(['test_c', 'test_d'], clusters.overflow.tests)
+        self.assertEqual(clustering.OVERFLOW, clusters.overflow.signature)
+        self.assertEqual([2, 2, 1], [cluster.count for cluster in clusters])
+
+    def test_merge(self):
+        first = clustering.FailureClusters(max_clusters=2)
+        second = clustering.FailureClusters(max_clusters=2)
+        for message in ('a', 'b'):
+            cluster = first.add('first_%s' % message,
+                                _traceback(message=message))
+            cluster.sample = message
+        for message in ('b', 'c', 'd', 'e'):
+            second.add('second_%s' % message, _traceback(message=message))
+        # clusters are sent between processes by trace_files()
+        first.merge(pickle.loads(pickle.dumps(second)))
+        self.assertEqual(
+            [(['second_d', 'second_e', 'second_c'], None),
+             (['first_b', 'second_b'], 'b'),
+             (['first_a'], 'a')],
+            [(cluster.tests, cluster.sample) for cluster in first])
+        self.assertIs(first.overflow, list(first)[0])
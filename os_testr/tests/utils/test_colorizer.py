@@ -15,6 +15,7 @@
 
 import io
 import sys
+from unittest import mock
 
 from ddt import data
 from ddt import ddt
@@ -39,6 +40,12 @@ class TestNullColorizer(base.TestCase):
         c.write(text, color)
         self.assertEqual(text, output.getvalue())
 
+    @data(("foo", "red"), ("foo", "bar"))
+    @unpack
+    def test_render_string_ignore_color(self, text, color):
+        c = colorizer.NullColorizer(io.StringIO())
+        self.assertEqual(text, c.render(text, color))
+
     @data((None, "red"), (None, None))
     @unpack
     def test_write_none_exception(self, text, color):
@@ -68,9 +75,40 @@ class TestAnsiColorizer(base.TestCase):
         self.assertIn(text, output.getvalue())
         self.assertIn(color_code, output.getvalue())
 
+    @data(("foo", "red", "\x1b[31;1mfoo\x1b[0m"),
+          ("foo", "blue", "\x1b[34;1mfoo\x1b[0m"))
+    @unpack
+    def test_render_string_valid_color(self, text, color, expected):
+        c = colorizer.AnsiColorizer(io.StringIO())
+        self.assertEqual(expected, c.render(text, color))
+
     @data(("foo", None), ("foo", "invalid_color"))
     @unpack
     def test_write_string_invalid_color(self, text, color):
         output = io.StringIO()
         c = colorizer.AnsiColorizer(output)
         self.assertRaises(KeyError, c.write, text, color)
+
+
+class TestGetColorizer(base.TestCase):
+
+    def test_color_disabled(self):
+        c = colorizer.get_colorizer(sys.stdout, enable_color=False)
+        self.assertIsInstance(c, colorizer.NullColorizer)
+
+    def test_not_a_tty(self):
+        c = colorizer.get_colorizer(io.StringIO())
+        self.assertIsInstance(c, colorizer.NullColorizer)
+
+    def test_not_a_file(self):
+        c = colorizer.get_colorizer(None)
+        self.assertIsInstance(c, colorizer.NullColorizer)
+
+    def test_probes_given_stream(self):
+        stream = io.StringIO()
+        with mock.patch.object(colorizer.AnsiColorizer, 'supported',
+                               return_value=True) as supported:
+            c = colorizer.get_colorizer(stream)
+        supported.assert_called_once_with(stream)
+        self.assertIsInstance(c, colorizer.AnsiColorizer)
+        self.assertIs(stream, c.stream)
@@ -0,0 +1,81 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import io
+import os
+import sys
+from unittest import mock
+
+from os_testr.tests import base
+from os_testr.utils import compression
+from os_testr.utils import subunit_v2
+
+
+class TestDetect(base.TestCase):
+
+    def test_detect(self):
+        self.assertEqual('gzip', compression.detect(
+            io.BytesIO(gzip.compress(b'data'))))
+        self.assertEqual('zstd', compression.detect(
+            io.BytesIO(compression.ZSTD_MAGIC + b'frame')))
+        self.assertIsNone(compression.detect(io.BytesIO(b'\xb3\x29\x01')))
+        self.assertIsNone(compression.detect(io.BytesIO(b'')))
+
+    def test_detect_does_not_consume(self):
+        stream = io.BufferedReader(io.BytesIO(gzip.compress(b'data')))
+        self.assertEqual('gzip', compression.detect(stream))
+        self.assertEqual(compression.GZIP_MAGIC, stream.read(2))
+        stream = io.BytesIO(b'\xb3\x29\x01')
+        compression.detect(stream)
+        self.assertEqual(b'\xb3\x29\x01', stream.read())
+
+
+class TestDecompressed(base.TestCase):
+
+    def test_uncompressed_stream(self):
+        stream = io.BytesIO(b'\xb3\x29\x01')
+        with compression.decompressed(stream) as decompressed:
+            self.assertIs(stream, decompressed)
+
+    def test_gzip(self):
+        data = os.urandom(subunit_v2.READ_SIZE * 3 + 17)
+        # concatenated gzip files are a valid gzip file too
+        compressed = gzip.compress(data[:1000]) + gzip.compress(data[1000:])
+        with compression.decompressed(io.BytesIO(compressed)) as stream:
+            self.assertEqual(data[:1], stream.read(1))
+            self.assertEqual(data[1:], stream.read())
+            self.assertEqual(b'', stream.read())
+
+    def test_queue_is_bounded(self):
+        chunks = compression.QUEUE_SIZE * 4
+        compressed = gzip.compress(b'\0' * subunit_v2.READ_SIZE * chunks)
+        with compression.decompressed(io.BytesIO(compressed)) as stream:
+            stream.read(1)
+            raw = stream.raw
+            raw._thread.join(0.5)
+            self.assertTrue(raw._thread.is_alive())
+            self.assertLessEqual(raw._chunks.qsize(), compression.QUEUE_SIZE)
+        # closing the stream stops the thread blocked on the full queue
+        raw._thread.join(5)
+        self.assertFalse(raw._thread.is_alive())
+
+    def test_corrupt_gzip(self):
+        compressed = gzip.compress(b'data' * 1000)[:-20]
+        with compression.decompressed(io.BytesIO(compressed)) as stream:
+            self.assertRaises(compression.DecompressionError, stream.read)
+
+    def test_zstd_without_zstandard(self):
+        stream = io.BytesIO(compression.ZSTD_MAGIC + b'frame')
+        with mock.patch.dict(sys.modules, {'zstandard': None}):
+            self.assertRaises(compression.DecompressionError,
+                              compression.decompressed(stream).__enter__)
@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import json
+from unittest import mock
+
+from os_testr import subunit_trace
+from os_testr.tests import base
+from os_testr.utils import jsonl
+
+
+class TestJsonLinesWriter(base.TestCase):
+
+    def setUp(self):
+        super(TestJsonLinesWriter, self).setUp()
+        self.stream = io.StringIO()
+        self.writer = jsonl.JsonLinesWriter(self.stream)
+
+    def _events(self):
+        return [json.loads(line)
+                for line in self.stream.getvalue().splitlines()]
+
+    def test_write_test(self):
+        self.writer.write_test(
+            subunit_trace.ResultRecord('test_a', 'success', 0, 10.0, 10.25),
+            {'worker-0', 'smoke'})
+        self.assertEqual([{'event': 'test', 'id': 'test_a',
+                           'status': 'success', 'worker': 0,
+                           'duration': 0.25,
+                           'tags': ['smoke', 'worker-0']}],
+                         self._events())
+
+    def test_write_test_without_times(self):
+        self.writer.write_test(
+            subunit_trace.ResultRecord('test_a', 'skip', 'node:1', 10.0),
+            reason='not today')
+        self.assertEqual([{'event': 'test', 'id': 'test_a', 'status': 'skip',
+                           'worker': 'node:1', 'duration': None, 'tags': [],
+                           'reason': 'not today'}],
+                         self._events())
+
+    def test_escaping(self):
+        test_id = u'test_é"\n\\'
+        self.writer.write_test(
+            subunit_trace.ResultRecord(test_id, 'fail', 0, 1.0, 2.0))
+        self.writer.write_file('stdout', b'\xff output\n')
+        self.writer.flush()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        # the output is plain ASCII
+        self.stream.getvalue().encode('ascii')
+        events = self._events()
+        self.assertEqual(test_id, events[0]['id'])
+        self.assertEqual({'event': 'file', 'name': 'stdout',
+                          'data': u'� output\n'}, events[1])
+
+    def test_write_file(self):
+        self.writer.write_file('stdout', b'l')
+        self.writer.write_file('stdout', b'ine\n')
+        self.writer.write_file('stderr', b'error\n')
+        self.assertEqual('{"event":"file","name":"stdout","data":"line\\n"}\n',
+                         self.stream.getvalue())
+        self.writer.flush()
+        self.writer.flush()
+        self.assertEqual({'event': 'file', 'name': 'stderr',
+                          'data': 'error\n'}, self._events()[-1])
+        self.assertEqual(2, len(self._events()))
+
+    def test_encoded_cache(self):
+        with mock.patch.object(jsonl, '_CACHE_SIZE', 2):
+            for worker in range(5):
+                self.writer.write_test(subunit_trace.ResultRecord(
+                    'test_%d' % worker, 'success', worker, 1.0, 2.0))
+            self.assertLessEqual(len(self.writer._encoded), 2)
+        self.assertEqual(list(range(5)),
+                         [event['worker'] for event in self._events()])
+
+    def test_write_summary(self):
+        self.writer.write_summary({'total': 2, 'statuses': {'success': 2}})
+        self.assertEqual('{"event":"summary","total":2,'
+                         '"statuses":{"success":2}}\n',
+                         self.stream.getvalue())
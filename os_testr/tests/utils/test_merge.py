@@ -0,0 +1,150 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from datetime import datetime as dt
+from datetime import timedelta
+import io
+import tracemalloc
+
+import subunit
+from subunit import iso8601
+
+from os_testr import subunit_trace
+from os_testr.tests import base
+from os_testr.utils import merge
+from os_testr.utils import subunit_v2
+from os_testr.utils import synthetic
+
+START = dt(2015, 4, 17, 22, 23, 14, tzinfo=iso8601.UTC)
+
+
+def _stream(tests):
+    """Write a stream of (test_id, worker, start offset, duration) tests."""
+    output = io.BytesIO()
+    stream = subunit.v2.StreamResultToBytes(output)
+    for test_id, worker, offset, duration in tests:
+        tags = {'worker-%d' % worker}
+        start = START + timedelta(seconds=offset)
+        stream.status(test_id=test_id, test_status='inprogress',
+                      timestamp=start, test_tags=tags)
+        stream.status(test_id=test_id, file_name='stdout',
+                      file_bytes=b'output of %s\n' % test_id.encode(),
+                      mime_type='text/plain; charset=utf8')
+        stream.status(test_id=test_id, test_status='success',
+                      timestamp=start + timedelta(seconds=duration),
+                      test_tags=tags)
+    return output.getvalue()
+
+
+def _events(stream):
+    events = []
+    subunit_v2.PacketDecoder(lambda *event: events.append(event),
+                             non_subunit_name='stdout').run(
+                                 io.BytesIO(stream))
+    return events
+
+
+class TestMergeStreams(base.TestCase):
+
+    def _merge(self, streams):
+        output = io.BytesIO()
+        workers = merge.merge_streams([io.BytesIO(s) for s in streams],
+                                      output)
+        return output.getvalue(), workers
+
+    def test_timestamp_order(self):
+        first = _stream([('node1.test_a', 0, 0, 5), ('node1.test_b', 0, 5, 1)])
+        second = _stream([('node2.test_a', 0, 1, 1),
+                          ('node2.test_b', 1, 3, 1)])
+        merged, workers = self._merge([first, second])
+        events = _events(merged)
+        self.assertEqual(12, len(events))
+        timestamps = [event[7] for event in events if event[7] is not None]
+        self.assertEqual(sorted(timestamps), timestamps)
+        # the attachments stay with the packet before them in their stream
+        for i, event in enumerate(events):
+            if event[3] == 'stdout':
+                self.assertEqual(events[i - 1][0], event[0])
+                self.assertEqual(events[i - 1][6], event[6])
+        self.assertEqual({(0, 0): 0, (1, 0): 1, (1, 1): 2}, workers.workers)
+        self.assertEqual(
+            [('node1.test_a', {'worker-0'}, '0'),
+             ('node2.test_a', {'worker-1'}, '1'),
+             ('node2.test_a', {'worker-1'}, '1'),
+             ('node2.test_b', {'worker-2'}, '1'),
+             ('node2.test_b', {'worker-2'}, '1'),
+             ('node1.test_a', {'worker-0'}, '0'),
+             ('node1.test_b', {'worker-0'}, '0'),
+             ('node1.test_b', {'worker-0'}, '0')],
+            [(event[0], event[2], event[6]) for event in events
+             if event[2] is not None])
+
+    def test_same_tests_on_two_nodes(self):
+        stream = _stream([('test_a', 0, 0, 1), ('test_b', 1, 0, 2)])
+        merged, _ = self._merge([stream, stream])
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(stdout)
+        self.assertEqual(0, session.run(io.BytesIO(merged)))
+        self.assertEqual(4, session.counters.total)
+        self.assertEqual([0, 1, 2, 3], sorted(session.counters.workers))
+        self.assertNotIn('WARNING: missing Worker', stdout.getvalue())
+
+    def test_route_codes_and_flags(self):
+        output = io.BytesIO()
+        stream = subunit.v2.StreamResultToBytes(output)
+        stream.status(test_id='test_a', test_status='exists', runnable=False,
+                      route_code='3')
+        stream.status(file_name='stderr', file_bytes=b'done', eof=True)
+        merged, _ = self._merge([b'not subunit\n', output.getvalue()])
+        flags = []
+        events = []
+
+        def on_event(*event):
+            events.append(event)
+            flags.append(decoder.flags)
+        decoder = subunit_v2.PacketDecoder(on_event)
+        decoder.run(io.BytesIO(merged))
+        self.assertEqual(
+            [(None, 'stdout', b'not subunit\n', '0'),
+             ('test_a', None, None, '1/3'),
+             (None, 'stderr', b'done', '1')],
+            [(event[0], event[3], event[4], event[6]) for event in events])
+        self.assertFalse(flags[1] & subunit.v2.FLAG_RUNNABLE)
+        self.assertTrue(flags[2] & subunit.v2.FLAG_EOF)
+
+    def _merge_peak(self, num_tests):
+        streams = []
+        for seed in range(2):
+            stream = io.BytesIO()
+            synthetic.generate_stream(stream, num_tests=num_tests, workers=2,
+                                      seed=seed)
+            streams.append(io.BytesIO(stream.getvalue()))
+        tracemalloc.start()
+        try:
+            # the output isn't kept, only the merge itself is measured
+            merge.merge_streams(streams, _NullOutput())
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_memory_independent_of_length(self):
+        # only a chunk of each stream is held, however long they are
+        small = self._merge_peak(250)
+        large = self._merge_peak(2000)
+        # holding the whole streams would take 8 times as much
+        self.assertLess(large, small * 2)
+
+
+class _NullOutput(object):
+
+    def write(self, data):
+        return len(data)
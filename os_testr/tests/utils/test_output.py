@@ -0,0 +1,104 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+from unittest import mock
+
+from ddt import data
+from ddt import ddt
+from ddt import unpack
+
+from os_testr.tests import base
+from os_testr.utils import output
+
+
+@ddt
+class TestFlushPolicy(base.TestCase):
+
+    @data(('test', output.FlushPolicy),
+          (None, output.FlushPolicy),
+          ('end', output.EndFlushPolicy),
+          ('10', output.CountFlushPolicy),
+          ('250ms', output.IntervalFlushPolicy))
+    @unpack
+    def test_parse(self, spec, policy_cls):
+        self.assertIsInstance(output.parse_flush_policy(spec), policy_cls)
+
+    @data('', 'never', '0', '-1', 'ms', '-5ms', '1.5')
+    def test_parse_invalid(self, spec):
+        self.assertRaises(ValueError, output.parse_flush_policy, spec)
+
+    def test_count(self):
+        policy = output.CountFlushPolicy(3)
+        self.assertEqual([False, False, True, False, False, True],
+                         [policy.test_done() for _ in range(6)])
+
+    def test_interval(self):
+        with mock.patch('time.monotonic', return_value=10.0):
+            policy = output.IntervalFlushPolicy(0.5)
+            self.assertFalse(policy.test_done())
+        with mock.patch('time.monotonic', return_value=10.6):
+            self.assertTrue(policy.test_done())
+            self.assertFalse(policy.test_done())
+
+    def test_end(self):
+        self.assertFalse(output.EndFlushPolicy().test_done())
+
+
+class TestOutputWriter(base.TestCase):
+
+    def test_text_stream(self):
+        stream = io.StringIO()
+        writer = output.OutputWriter(stream, output.EndFlushPolicy())
+        writer.write('foo ')
+        writer.write(b'bar \xe2\x82\xac')
+        writer.test_done()
+        self.assertEqual('', stream.getvalue())
+        writer.close()
+        self.assertEqual('foo bar €', stream.getvalue())
+
+    def test_text_stream_split_character(self):
+        stream = io.StringIO()
+        writer = output.OutputWriter(stream, buffer_size=1)
+        writer.write(b'bar \xe2\x82')
+        writer.write(b'\xac \xe2')
+        self.assertEqual('bar € ', stream.getvalue())
+        writer.close()
+        self.assertEqual('bar € \ufffd', stream.getvalue())
+
+    def test_binary_buffer(self):
+        stream = io.TextIOWrapper(io.BytesIO(), encoding='utf8')
+        writer = output.OutputWriter(stream)
+        stream.write('direct ')
+        writer.write('buffered €')
+        writer.write(b' bytes')
+        writer.test_done()
+        self.assertEqual(b'direct buffered \xe2\x82\xac bytes',
+                         stream.buffer.getvalue())
+
+    def test_buffer_size(self):
+        stream = io.StringIO()
+        writer = output.OutputWriter(stream, output.EndFlushPolicy(),
+                                     buffer_size=4)
+        writer.write('foo')
+        self.assertEqual('', stream.getvalue())
+        writer.write('bar')
+        self.assertEqual('foobar', stream.getvalue())
+
+    def test_flush_every_count(self):
+        stream = mock.Mock(spec=['write', 'flush'], encoding='utf8')
+        writer = output.OutputWriter(stream, output.CountFlushPolicy(2))
+        for _ in range(4):
+            writer.write('foo\n')
+            writer.test_done()
+        self.assertEqual(2, stream.write.call_count)
+        self.assertEqual(2, stream.flush.call_count)
@@ -0,0 +1,108 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import json
+import os
+import pstats
+from unittest import mock
+
+import fixtures
+
+from os_testr.tests import base
+from os_testr.utils import profiling
+
+
+class TestPhaseProfiler(base.TestCase):
+
+    def _clock(self, *ticks):
+        ticks = iter(ticks)
+        clock = mock.Mock(perf_counter=lambda: float(next(ticks)),
+                          process_time=lambda: 0.0)
+        self.useFixture(fixtures.MonkeyPatch(
+            'os_testr.utils.profiling.time', clock))
+
+    def test_nested_phases(self):
+        # decode runs 0-10 and has tests nested in it at 2-5 and 6-7
+        self._clock(0, 2, 5, 6, 7, 10, 10)
+        profiler = profiling.PhaseProfiler('test')
+        tests = profiler.wrap('tests', lambda: None)
+        with profiler.phase('decode'):
+            tests()
+            tests()
+        phases = profiler.report()['phases']
+        self.assertEqual(['decode', 'tests'], list(phases))
+        self.assertEqual(1, phases['decode']['calls'])
+        self.assertEqual(10, phases['decode']['wall_time'])
+        self.assertEqual(6, phases['decode']['self_wall_time'])
+        self.assertEqual(2, phases['tests']['calls'])
+        self.assertEqual(4, phases['tests']['wall_time'])
+        self.assertEqual(4, phases['tests']['self_wall_time'])
+
+    def test_phase_on_error(self):
+        profiler = profiling.PhaseProfiler('test')
+
+        def fail():
+            raise ValueError()
+        self.assertRaises(ValueError, profiler.wrap('tests', fail))
+        self.assertEqual(1, profiler.report()['phases']['tests']['calls'])
+        self.assertEqual([], profiler._stack)
+
+    def test_counting(self):
+        profiler = profiling.PhaseProfiler('test')
+        double = profiler.counting('events', lambda x: x * 2)
+        self.assertEqual(4, double(2))
+        double(3)
+        self.assertEqual({'events': 2}, profiler.report()['counters'])
+
+    def test_no_profiler(self):
+        with profiling.phase(None, 'decode'):
+            pass
+
+    def test_report_to_stderr(self):
+        stderr = io.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stderr', stderr))
+        profiler = profiling.PhaseProfiler('test')
+        profiler.start()
+        with profiling.phase(profiler, 'decode'):
+            pass
+        profiler.close()
+        report = json.loads(stderr.getvalue())
+        self.assertEqual('test', report['tool'])
+        self.assertIn('decode', report['phases'])
+        self.assertGreaterEqual(report['wall_time'],
+                                report['phases']['decode']['wall_time'])
+
+    def test_report_and_stats_files(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        report_path = os.path.join(tmp_dir, 'profile.json')
+        stats_path = os.path.join(tmp_dir, 'profile.pstats')
+        with mock.patch('sys.stderr', io.StringIO()) as stderr:
+            profiler = profiling.PhaseProfiler(
+                'test', report_path=report_path, stats_path=stats_path)
+            profiler.start()
+            sorted(range(1000), key=lambda i: -i)
+            profiler.close()
+        self.assertEqual('', stderr.getvalue())
+        with open(report_path) as report_file:
+            self.assertEqual('test', json.load(report_file)['tool'])
+        self.assertTrue(pstats.Stats(stats_path).total_calls)
+
+    def test_from_args(self):
+        args, argv = profiling.parse_known_args(
+            ['results.subunit', '--profile-file', 'out.json', 'out.html'])
+        self.assertEqual(['results.subunit', 'out.html'], argv)
+        profiler = profiling.from_args('test', args)
+        self.assertEqual('out.json', profiler.report_path)
+        self.assertIsNone(profiler.stats_path)
+        args, argv = profiling.parse_known_args(['results.subunit'])
+        self.assertIsNone(profiling.from_args('test', args))
@@ -0,0 +1,160 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import os
+
+import fixtures
+
+from os_testr.tests import base
+from os_testr.utils import output
+from os_testr.utils import progress
+from os_testr.utils import timing
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _DictBackend(timing.TimingBackend):
+
+    def __init__(self, times):
+        self.times = times
+
+    def get(self, test_id):
+        return self.times.get(test_id)
+
+    def items(self):
+        return self.times.items()
+
+    def __len__(self):
+        return len(self.times)
+
+
+class TestProgressEstimator(base.TestCase):
+
+    def setUp(self):
+        super(TestProgressEstimator, self).setUp()
+        self.index = timing.TimingIndex(backend=_DictBackend(
+            {'test.a': 4.0, 'test.b': 2.0, 'test.c': 2.0}))
+
+    def test_expected_tests(self):
+        # test.d has no run time and counts as the average of the others
+        estimator = progress.ProgressEstimator(
+            ['test.a', 'test.b', 'test.d'], self.index)
+        self.assertEqual(3, estimator.expected)
+        self.assertEqual(9.0, estimator.remaining_work)
+        estimator.add('test.a')
+        self.assertEqual(5.0, estimator.remaining_work)
+        # 4 seconds of work took 10 seconds, 5 are left
+        self.assertEqual(12.5, estimator.eta(10))
+        self.assertAlmostEqual(4.0 / 9, estimator.fraction())
+        estimator.add('test.d')
+        estimator.add('test.x')
+        self.assertEqual(3, estimator.completed)
+        self.assertEqual(2.0, estimator.remaining_work)
+
+    def test_historical_tests(self):
+        estimator = progress.ProgressEstimator(timing_index=self.index)
+        self.assertEqual(3, estimator.expected)
+        self.assertEqual(8.0, estimator.remaining_work)
+        estimator.add('test.b')
+        estimator.add('test.unknown')
+        self.assertEqual(6.0, estimator.remaining_work)
+        self.assertEqual(0.25, estimator.fraction())
+
+    def test_no_timing_data(self):
+        estimator = progress.ProgressEstimator(['test.a', 'test.b'])
+        estimator.add('test.a')
+        self.assertEqual(0.5, estimator.fraction())
+        self.assertEqual(3, estimator.eta(3))
+        estimator = progress.ProgressEstimator()
+        estimator.add('test.a')
+        self.assertIsNone(estimator.expected)
+        self.assertIsNone(estimator.fraction())
+        self.assertIsNone(estimator.eta(3))
+
+    def test_more_tests_than_expected(self):
+        estimator = progress.ProgressEstimator(['test.a'])
+        estimator.add('test.a')
+        estimator.add('test.b')
+        self.assertEqual(0, estimator.eta(10))
+        self.assertEqual(1.0, estimator.fraction())
+
+    def test_read_expected_tests(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'tests.txt')
+        with open(path, 'w') as tests_file:
+            tests_file.write('test.a\n\ntest.b[id-1]\n')
+        self.assertEqual(['test.a', 'test.b[id-1]'],
+                         progress.read_expected_tests(path))
+
+
+class FakeTerminal(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+class TestProgressLine(base.TestCase):
+
+    def _line(self, stream, interval=None):
+        self.clock = FakeClock()
+        estimator = progress.ProgressEstimator(['test.a', 'test.b'])
+        return progress.ProgressLine(output.OutputWriter(stream), estimator,
+                                     interval, clock=self.clock)
+
+    def test_redraw_rate(self):
+        stream = FakeTerminal()
+        line = self._line(stream, interval=1)
+        line.update('test.a')
+        self.assertEqual('', stream.getvalue())
+        self.clock.now = 2
+        line.update('test.b')
+        self.assertEqual(
+            '\rProgress: 2/2 tests (100.0%), 1.0 tests/s, ETA 0:00:00',
+            stream.getvalue())
+
+    def test_in_place(self):
+        stream = FakeTerminal()
+        line = self._line(stream, interval=0)
+        self.clock.now = 1
+        line.update('test.a')
+        line.clear()
+        line.stream.write('FAILED\n')
+        self.clock.now = 2
+        line.update('test.b')
+        line.finish()
+        line.stream.close()
+        text = ('Progress: 1/2 tests (50.0%), 1.0 tests/s, ETA 0:00:01')
+        self.assertEqual(
+            '\r' + text + '\r' + ' ' * len(text) + '\rFAILED\n'
+            '\rProgress: 2/2 tests (100.0%), 1.0 tests/s, ETA 0:00:00'
+            '\rProgress: 2/2 tests (100.0%), 1.0 tests/s, ETA 0:00:00\n',
+            stream.getvalue())
+
+    def test_log_lines(self):
+        stream = io.StringIO()
+        line = self._line(stream)
+        self.assertEqual(progress.LOG_INTERVAL, line.interval)
+        self.clock.now = progress.LOG_INTERVAL
+        line.update('test.a')
+        line.finish()
+        line.stream.close()
+        self.assertEqual(
+            'Progress: 1/2 tests (50.0%), 0.1 tests/s, ETA 0:00:10\n' * 2,
+            stream.getvalue())
@@ -0,0 +1,162 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+
+from ddt import data
+from ddt import ddt
+from ddt import unpack
+import fixtures
+
+from os_testr.tests import base
+from os_testr.utils import regression
+from os_testr.utils import timing
+
+
+class _DictBaseline(regression.Baseline):
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.batches = []
+
+    def lookup(self, test_ids):
+        self.batches.append(len(test_ids))
+        return {test_id: self.stats[test_id] for test_id in test_ids
+                if test_id in self.stats}
+
+
+@ddt
+class TestStatistics(base.TestCase):
+
+    # one-sided critical values of Student's t
+    @data((0.0, 5, 0.5), (2.0, 10, 0.036694), (1.812461, 10, 0.05),
+          (31.820516, 1, 0.01), (1.959964, 10 ** 6, 0.025),
+          (-2.0, 10, 0.963306))
+    @unpack
+    def test_t_sf(self, t, df, expected):
+        self.assertAlmostEqual(expected, regression.t_sf(t, df), places=5)
+
+    def test_single_duration(self):
+        baseline = regression.BaselineStats(1.0, 0.01, 11)
+        # 2 standard deviations of the samples away, the t value is 1.91
+        self.assertAlmostEqual(
+            0.0423, regression.slowdown_p_value([1.2], baseline), places=4)
+        self.assertGreater(regression.slowdown_p_value([1.05], baseline),
+                           0.3)
+
+    def test_several_durations(self):
+        baseline = regression.BaselineStats(1.0, 0.01, 10)
+        self.assertLess(
+            regression.slowdown_p_value([1.2, 1.25, 1.15], baseline), 0.01)
+        self.assertGreater(
+            regression.slowdown_p_value([0.8, 1.4], baseline), 0.1)
+
+    def test_no_variance(self):
+        baseline = regression.BaselineStats(1.0, 0.0, 5)
+        self.assertEqual(0.0, regression.slowdown_p_value([1.1], baseline))
+        self.assertEqual(1.0, regression.slowdown_p_value([1.0, 1.0],
+                                                          baseline))
+
+
+class TestRegressionReport(base.TestCase):
+
+    def test_report(self):
+        baseline = _DictBaseline({
+            'test.a': regression.BaselineStats(1.0, 0.01, 20),
+            'test.b': regression.BaselineStats(0.1, 0.0001, 20),
+            'test.noisy': regression.BaselineStats(1.0, 4.0, 20),
+            'test.faster': regression.BaselineStats(3.0, 0.01, 20),
+            'test.new': regression.BaselineStats(0.1, 0.0, 1),
+        })
+        durations = {'test.a': [1.5], 'test.b': [0.2, 0.2, 0.25],
+                     'test.noisy': [2.0], 'test.faster': [1.0],
+                     'test.new': [5.0], 'test.unknown': [9.0]}
+        report = regression.RegressionReport(durations, baseline)
+        # the baseline gets all the tests at once
+        self.assertEqual([6], baseline.batches)
+        self.assertEqual(4, report.compared)
+        self.assertEqual(['test.a', 'test.b'],
+                         [r.test_id for r in report.regressions])
+        self.assertAlmostEqual(0.5, report.regressions[0].added)
+        self.assertAlmostEqual(0.35, report.regressions[1].added)
+        self.assertAlmostEqual(0.85, report.added)
+        result = report.to_dict()
+        self.assertEqual(regression.REPORT_VERSION, result['version'])
+        self.assertEqual(3, result['regressions'][1]['count'])
+        self.assertAlmostEqual(0.01,
+                               result['regressions'][1]['baseline_stddev'])
+
+
+class TestJsonBaseline(base.TestCase):
+
+    def test_round_trip(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'baseline.json')
+        stats = regression.BaselineStats(1.5, 0.25, 8)
+        regression.write_baseline(path, [('test.a', stats)])
+        baseline = regression.open_baseline(path)
+        self.assertEqual({'test.a': stats},
+                         baseline.lookup(['test.a', 'test.b']))
+
+    def test_not_a_baseline(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'times.json')
+        with open(path, 'w') as times_file:
+            json.dump({'test.a': 1.0}, times_file)
+        self.assertRaises(ValueError, regression.open_baseline, path)
+        for baseline in (b'{}', b'[]', b'not json', b'\xff\xfe\x00',
+                         b'{"version": %d}' % regression.BASELINE_VERSION):
+            with open(path, 'wb') as times_file:
+                times_file.write(baseline)
+            self.assertRaises(ValueError, regression.open_baseline, path)
+
+
+class TestHistoryBaseline(base.TestCase):
+
+    def test_history_baseline(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'history.sqlite')
+        history = timing.TimingHistory(path)
+        for _ in range(30):
+            history.add_run([('test.a', 1.0), ('test.a', 3.0)])
+        history.add_run([('test.b', 1.0), ('test.b', 3.0)])
+        history.close()
+        baseline = regression.open_baseline(path)
+        self.addCleanup(baseline.close)
+        self.assertIsInstance(baseline, regression.HistoryBaseline)
+        stats = baseline.lookup(['test.a', 'test.b', 'test.c'])
+        # the moving average of weight 0.1 is worth 19 samples
+        self.assertEqual(19, stats['test.a'].count)
+        self.assertEqual(regression.BaselineStats(2.0, 1.0, 2),
+                         stats['test.b'])
+        self.assertNotIn('test.c', stats)
+
+    def test_history_read_whole(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'history.sqlite')
+        history = timing.TimingHistory(path)
+        for _ in range(2):
+            history.add_run(('test.%04d' % i, 1.0) for i in range(2000))
+        history.close()
+        baseline = regression.open_baseline(path)
+        self.addCleanup(baseline.close)
+        statements = []
+        baseline._history._db.set_trace_callback(statements.append)
+        durations = {'test.%04d' % i: [1.0] for i in range(1000)}
+        report = regression.RegressionReport(durations, baseline)
+        self.assertEqual(1000, report.compared)
+        # half of the history is read in one scan, not 2 batched lookups
+        selects = [statement for statement in statements
+                   if statement.startswith('SELECT test_id')]
+        self.assertEqual(['SELECT test_id, mean, variance, count FROM tests'],
+                         selects)
@@ -0,0 +1,138 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import json
+import os
+from xml.etree import ElementTree
+
+import fixtures
+from testtools import content
+
+from os_testr import subunit_trace
+from os_testr.tests import base
+from os_testr.utils import sinks
+from os_testr.utils import synthetic
+
+
+def _test(test_id, status, worker=0, start=10.0, stop=10.5, details=None):
+    record = subunit_trace.ResultRecord(test_id, status, worker, start, stop)
+    return record, {'id': test_id, 'status': status,
+                    'tags': {'worker-%s' % worker},
+                    'details': details or {},
+                    'timestamps': [None, None]}
+
+
+class TestJUnitXmlSink(base.TestCase):
+
+    def setUp(self):
+        super(TestJUnitXmlSink, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'junit.xml')
+
+    def _report(self, tests, **kwargs):
+        sink = sinks.JUnitXmlSink(self.path, **kwargs)
+        for record, test in tests:
+            sink.test(record, test)
+        sink.close({})
+        return ElementTree.parse(self.path).getroot()
+
+    def test_statuses(self):
+        suite = self._report([
+            _test('pkg.mod.TestA.test_pass[id-1,smoke]', 'success'),
+            _test('pkg.mod.TestA.test_xfail', 'xfail'),
+            _test('pkg.mod.TestA.test_skip', 'skip', details={
+                'reason': content.text_content('not today')}),
+            _test('pkg.mod.TestB.test_fail', 'fail', start=9.0, details={
+                'traceback': content.text_content('Traceback <here>\n')}),
+            _test('pkg.mod.TestB.test_uxsuccess', 'uxsuccess', stop=12.0),
+            _test('pkg.mod.TestB.test_unfinished', 'inprogress', start=None,
+                  stop=None),
+            _test('process-returncode', 'fail'),
+        ])
+        self.assertEqual('testsuite', suite.tag)
+        self.assertEqual({'tests': '6', 'failures': '2', 'errors': '1',
+                          'skipped': '1', 'time': '3.000', 'name': ''},
+                         suite.attrib)
+        cases = suite.findall('testcase')
+        self.assertEqual(('pkg.mod.TestA', 'test_pass[id-1,smoke]', '0.500'),
+                         (cases[0].get('classname'), cases[0].get('name'),
+                          cases[0].get('time')))
+        self.assertEqual([], list(cases[1]))
+        self.assertEqual('not today', cases[2].find('skipped').get('message'))
+        self.assertEqual('traceback: {{{\nTraceback <here>\n\n}}}\n',
+                         cases[3].find('failure').text)
+        self.assertEqual('unexpected success',
+                         cases[4].find('failure').get('message'))
+        self.assertEqual(('pkg.mod.TestB', 'test_unfinished', 'inprogress'),
+                         (cases[5].get('classname'), cases[5].get('name'),
+                          cases[5].find('error').get('message')))
+        # the process-returncode pseudo test isn't reported
+        self.assertEqual(6, len(cases))
+
+    def test_attachment_limit(self):
+        suite = self._report([
+            _test('test_fail', 'fail', details={
+                'stdout': content.text_content('x' * 100 + '\x00\x1b'),
+                'image': content.Content(
+                    content.ContentType('image', 'png'), lambda: [b'\x89'])}),
+            _test('test_control', 'fail', details={
+                'stdout': content.text_content('a\x00b\x1bc')}),
+        ], attachment_limit=10)
+        failures = [case.find('failure').text
+                    for case in suite.findall('testcase')]
+        self.assertEqual(
+            'stdout: {{{\n' + 'x' * 10 + '\n[... elided ...]\n}}}\n',
+            failures[0])
+        self.assertEqual(u'stdout: {{{\na\ufffdb\ufffdc\n}}}\n', failures[1])
+
+
+class TestJsonSink(base.TestCase):
+
+    def test_json_lines(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'run.jsonl')
+        stream = io.BytesIO()
+        synthetic.generate_stream(stream, num_tests=20, fail_rate=0.2,
+                                  stdout_rate=0.2)
+        stdout = io.StringIO()
+        subunit_trace.trace(io.BytesIO(stream.getvalue()), io.StringIO(),
+                            sinks=[sinks.JsonSink(path)])
+        subunit_trace.trace(io.BytesIO(stream.getvalue()), stdout,
+                            json_lines=True)
+        with open(path) as json_file:
+            events = [json.loads(line) for line in json_file]
+        expected = [json.loads(line)
+                    for line in stdout.getvalue().splitlines()]
+        for event in events[-1:] + expected[-1:]:
+            event.pop('elapsed')
+        self.assertEqual(expected, events)
+        self.assertEqual(20, len([e for e in events if e['event'] == 'test']))
+
+    def test_same_tests_as_junit(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        json_sink = sinks.JsonSink(os.path.join(tmp_dir, 'run.jsonl'))
+        junit_sink = sinks.JUnitXmlSink(os.path.join(tmp_dir, 'junit.xml'))
+        for record, test in (_test('pkg.mod.TestA.test_pass', 'success'),
+                             _test('process-returncode', 'fail'),
+                             _test('process-returncode[worker-1]', 'fail')):
+            for sink in (json_sink, junit_sink):
+                sink.test(record, test)
+        for sink in (json_sink, junit_sink):
+            sink.close({})
+        with open(json_sink.path) as json_file:
+            events = [json.loads(line) for line in json_file]
+        self.assertEqual(['pkg.mod.TestA.test_pass'],
+                         [e['id'] for e in events
+                          if e['event'] == 'test'])
+        suite = ElementTree.parse(junit_sink.path).getroot()
+        self.assertEqual('1', suite.get('tests'))
@@ -0,0 +1,122 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import math
+import random
+
+from ddt import data
+from ddt import ddt
+
+from os_testr.tests import base
+from os_testr.utils import stats
+
+
+@ddt
+class TestDurationHistogram(base.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(stats.DurationHistogram().percentile(50))
+
+    @data(50, 90, 99)
+    def test_percentile_precision(self, percent):
+        rand = random.Random(42)
+        durations = [rand.lognormvariate(-2, 1.5) for _ in range(10000)]
+        histogram = stats.DurationHistogram(precision=0.01)
+        for duration in durations:
+            histogram.add(duration)
+        durations.sort()
+        exact = durations[int(math.ceil(percent / 100.0 * 10000)) - 1]
+        estimate = histogram.percentile(percent)
+        self.assertLess(abs(estimate - exact) / exact, 0.01)
+
+    def test_extremes(self):
+        histogram = stats.DurationHistogram()
+        histogram.add(0.0)
+        histogram.add(0.0)
+        histogram.add(5e7)
+        self.assertEqual(0.0, histogram.percentile(50))
+        self.assertEqual(5e7, histogram.percentile(100))
+
+    def test_constant_memory(self):
+        histogram = stats.DurationHistogram()
+        buckets = len(histogram._counts)
+        for i in range(1, 10000):
+            histogram.add(i / 100.0)
+        self.assertEqual(buckets, len(histogram._counts))
+        self.assertEqual(9999, histogram.count)
+
+    def test_merge(self):
+        rand = random.Random(42)
+        durations = [rand.lognormvariate(-2, 1.5) for _ in range(1000)]
+        whole = stats.DurationHistogram()
+        first = stats.DurationHistogram()
+        second = stats.DurationHistogram()
+        for i, duration in enumerate(durations):
+            whole.add(duration)
+            (first if i % 3 else second).add(duration)
+        first.merge(second)
+        self.assertEqual(whole.count, first.count)
+        self.assertEqual(whole.smallest, first.smallest)
+        self.assertEqual(whole.largest, first.largest)
+        for percent in (50, 90, 99):
+            self.assertEqual(whole.percentile(percent),
+                             first.percentile(percent))
+
+    def test_merge_different_buckets(self):
+        self.assertRaises(ValueError, stats.DurationHistogram().merge,
+                          stats.DurationHistogram(precision=0.1))
+
+
+class TestSlowest(base.TestCase):
+
+    def test_slowest_tests(self):
+        slowest = stats.SlowestTests(3)
+        for i, duration in enumerate([0.5, 3.0, 1.0, 3.0, 0.1, 2.0]):
+            slowest.add(duration, 'test_%s' % i)
+        self.assertEqual([(3.0, 'test_3'), (3.0, 'test_1'), (2.0, 'test_5')],
+                         slowest.slowest())
+        self.assertEqual(3, len(slowest._heap))
+
+    def test_slowest_tests_disabled(self):
+        slowest = stats.SlowestTests(0)
+        slowest.add(1.0, 'test_a')
+        self.assertEqual([], slowest.slowest())
+
+    def test_slowest_classes(self):
+        slowest = stats.SlowestClasses(2)
+        slowest.add(1.0, 'a.A')
+        slowest.add(1.5, 'a.B')
+        slowest.add(1.0, 'a.A')
+        slowest.add(0.1, 'a.C')
+        self.assertEqual([(2.0, 2, 'a.A'), (1.5, 1, 'a.B')],
+                         slowest.slowest())
+
+    def test_merge_slowest_tests(self):
+        first = stats.SlowestTests(2)
+        second = stats.SlowestTests(2)
+        first.add(1.0, 'test_a')
+        first.add(3.0, 'test_b')
+        second.add(2.0, 'test_c')
+        second.add(0.5, 'test_d')
+        first.merge(second)
+        self.assertEqual([(3.0, 'test_b'), (2.0, 'test_c')],
+                         first.slowest())
+
+    def test_merge_slowest_classes(self):
+        first = stats.SlowestClasses(2)
+        second = stats.SlowestClasses(2)
+        first.add(1.0, 'a.A')
+        second.add(1.5, 'a.A')
+        second.add(2.0, 'a.B')
+        first.merge(second)
+        self.assertEqual([(2.5, 2, 'a.A'), (2.0, 1, 'a.B')],
+                         first.slowest())
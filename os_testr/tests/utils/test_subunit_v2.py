@@ -0,0 +1,284 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from datetime import datetime as dt
+from datetime import timedelta
+import io
+import os
+import tempfile
+
+from ddt import data
+from ddt import ddt
+import subunit
+from subunit import iso8601
+import testtools
+
+from os_testr.tests import base
+from os_testr.utils import subunit_v2
+
+
+class EventLog(testtools.StreamResult):
+    """Record StreamResult events like PacketDecoder reports them."""
+
+    def __init__(self):
+        super(EventLog, self).__init__()
+        self.events = []
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        self.events.append((test_id, test_status, test_tags, file_name,
+                            file_bytes, mime_type, route_code, timestamp))
+
+
+def _normalize(events):
+    # subunit hands out memoryviews of the packets for file bytes, and the
+    # chunking of non-subunit content depends on how fast it was read.
+    normalized = []
+    for event in events:
+        event = list(event)
+        if event[4] is not None:
+            event[4] = bytes(event[4])
+        if (normalized and event[0] is None and event[3] == 'stdout' and
+                normalized[-1][0] is None and normalized[-1][3] == 'stdout'):
+            normalized[-1][4] += event[4]
+            continue
+        normalized.append(event)
+    return normalized
+
+
+def _subunit_events(stream):
+    log = EventLog()
+    # subunit only gets non-subunit content right for sources it can
+    # select() on, like stdin, so give it a real file
+    with tempfile.TemporaryFile() as source:
+        source.write(stream)
+        source.seek(0)
+        subunit.ByteStreamToStreamResult(
+            source, non_subunit_name='stdout').run(log)
+    return _normalize(log.events)
+
+
+def _decoder_events(stream, chunk_size=None):
+    events = []
+    decoder = subunit_v2.PacketDecoder(lambda *event: events.append(event),
+                                       non_subunit_name='stdout')
+    if chunk_size is None:
+        decoder.run(io.BytesIO(stream))
+    else:
+        for i in range(0, len(stream), chunk_size):
+            decoder.feed(stream[i:i + chunk_size])
+        decoder.close()
+    return _normalize(events)
+
+
+def _sample_stream(name):
+    path = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'sample_streams', name)
+    with open(path, 'rb') as stream:
+        return stream.read()
+
+
+def _packets():
+    """A stream using every field of the v2 protocol."""
+    output = io.BytesIO()
+    stream = subunit.v2.StreamResultToBytes(output)
+    timestamp = dt(2015, 4, 17, 22, 23, 14, 123456, tzinfo=iso8601.UTC)
+    stream.status(test_id='test.a', test_status='inprogress',
+                  timestamp=timestamp, test_tags={'worker-0', 'tagé'})
+    stream.status(test_id='test.a', file_name='stdout',
+                  file_bytes=b'caf\xc3\xa9\n' * 100,
+                  mime_type='text/plain; charset=utf8', route_code='0')
+    stream.status(test_id='test.a', file_name='traceback',
+                  file_bytes=b'x' * 70000, eof=True)
+    stream.status(test_id='test.a', test_status='fail',
+                  timestamp=timestamp + timedelta(seconds=2, microseconds=7))
+    stream.status(test_id='test.b', test_status='exists', runnable=False)
+    stream.status(file_name='stderr', file_bytes=b'outside of a test\n')
+    for status in ('success', 'uxsuccess', 'skip', 'xfail'):
+        stream.status(test_id='test.%s' % status, test_status=status,
+                      timestamp=timestamp)
+    return output.getvalue()
+
+
+@ddt
+class TestPacketDecoder(base.TestCase):
+
+    @data('successful.subunit', 'all_skips.subunit')
+    def test_sample_streams(self, name):
+        stream = _sample_stream(name)
+        self.assertEqual(_subunit_events(stream), _decoder_events(stream))
+
+    def test_all_fields(self):
+        stream = _packets()
+        self.assertEqual(_subunit_events(stream), _decoder_events(stream))
+
+    @data(1, 7, 4096)
+    def test_incremental_feed(self, chunk_size):
+        stream = _packets() + b'trailing output\n'
+        self.assertEqual(_decoder_events(stream),
+                         _decoder_events(stream, chunk_size))
+
+    def test_non_subunit_content(self):
+        packets = _packets()
+        # \xc3\xb3 is an o with an acute accent, its second byte is the
+        # packet signature and must not be taken for the start of a packet
+        stream = (b'se\xc3\xb3sion\n' + packets + b'Adi\xc3\xb3s \xc3' +
+                  packets + b'\xc3\xb3 bye\n')
+        self.assertEqual(_subunit_events(stream), _decoder_events(stream))
+        self.assertEqual(_decoder_events(stream),
+                         _decoder_events(stream, 3))
+
+    def test_bad_checksum(self):
+        packets = bytearray(_packets())
+        packets[20] ^= 0xff
+        stream = bytes(packets)
+        events = _decoder_events(stream)
+        self.assertEqual(_subunit_events(stream), events)
+        self.assertEqual('subunit.parser', events[0][0])
+        self.assertIn(b'Bad checksum', events[1][4])
+
+    @data(1, 4, 30, -1)
+    def test_truncated(self, keep):
+        packets = _packets()
+        stream = packets[:len(packets) - keep]
+        if keep == -1:
+            stream = packets + b'\xb3\x20'
+        self.assertEqual(_subunit_events(stream), _decoder_events(stream))
+        self.assertEqual(_subunit_events(stream), _decoder_events(stream, 5))
+
+    def test_four_byte_length(self):
+        stream = b'\xb3\x20\x00\xc0\x00\x00\x00' + _packets()
+        self.assertEqual(_subunit_events(stream), _decoder_events(stream))
+
+    def test_invalid_utf8(self):
+        output = io.BytesIO()
+        subunit.v2.StreamResultToBytes(output).status(
+            test_id='test.é', test_status='success')
+        # make the test id invalid utf8 and fix up the checksum
+        packet = bytearray(output.getvalue())
+        position = packet.index(b'\xc3')
+        packet[position] = 0xff
+        packet[-4:] = subunit.v2.zlib.crc32(
+            bytes(packet[:-4])).to_bytes(4, 'big')
+        stream = bytes(packet) + _packets()
+        events = _decoder_events(stream)
+        self.assertEqual(_subunit_events(stream), events)
+        self.assertIn(b'is not UTF8', events[1][4])
+
+    def test_no_non_subunit_name(self):
+        decoder = subunit_v2.PacketDecoder(lambda *event: None)
+        self.assertRaises(subunit_v2.ParseError, decoder.feed, b'not subunit')
+
+    def test_flags(self):
+        flags = []
+        decoder = subunit_v2.PacketDecoder(
+            lambda *event: flags.append(decoder.flags),
+            non_subunit_name='stdout')
+        decoder.feed(b'output\n' + _packets())
+        decoder.close()
+        self.assertIsNone(flags[0])
+        # the traceback is the end of its file, test.b isn't runnable
+        self.assertTrue(flags[3] & subunit.v2.FLAG_EOF)
+        self.assertFalse(flags[5] & subunit.v2.FLAG_RUNNABLE)
+        self.assertTrue(flags[1] & subunit.v2.FLAG_RUNNABLE)
+
+
+_TIMESTAMP = dt(2015, 4, 17, 22, 23, 14, 123456, tzinfo=iso8601.UTC)
+
+
+@ddt
+class TestEncodePacket(base.TestCase):
+
+    @data({},
+          {'test_id': 'test.a', 'test_status': 'inprogress',
+           'timestamp': _TIMESTAMP, 'test_tags': {'worker-0'}},
+          {'test_id': 'test.é' * 30, 'test_status': 'fail',
+           'timestamp': _TIMESTAMP + timedelta(days=20000)},
+          {'test_id': 'test.a', 'file_name': 'stdout',
+           'file_bytes': b'x' * 70000, 'mime_type': 'text/plain',
+           'route_code': '0/1', 'eof': True},
+          {'file_name': 'stderr', 'file_bytes': b'', 'runnable': False},
+          {'test_id': 'test.b', 'test_status': 'exists', 'runnable': False},
+          {'test_id': 'test.c', 'file_name': 'big',
+           'file_bytes': b'y' * (4 * 1024 * 1024 - 100)})
+    def test_same_as_subunit(self, fields):
+        output = io.BytesIO()
+        subunit.v2.StreamResultToBytes(output).status(**fields)
+        self.assertEqual(output.getvalue(),
+                         subunit_v2.encode_packet(**fields))
+
+    def test_too_long(self):
+        self.assertRaises(ValueError, subunit_v2.encode_packet,
+                          file_name='big', file_bytes=b'y' * 4194300)
+
+    def test_round_trip(self):
+        events = []
+        subunit_v2.PacketDecoder(
+            lambda *event: events.append(event)).run(
+                io.BytesIO(_packets()))
+        stream = b''.join(subunit_v2.encode_packet(*event)
+                          for event in events)
+        self.assertEqual(_decoder_events(_packets()),
+                         _decoder_events(stream))
+
+
+class TestTestAccumulator(base.TestCase):
+
+    def _compare(self, stream):
+        expected = []
+        result = testtools.StreamToDict(expected.append)
+        result.startTestRun()
+        subunit.ByteStreamToStreamResult(
+            io.BytesIO(stream), non_subunit_name='stdout').run(result)
+        result.stopTestRun()
+        tests = []
+        files = []
+        accumulator = subunit_v2.TestAccumulator(
+            tests.append,
+            lambda name, data, route_code: files.append((name, data)))
+        subunit_v2.PacketDecoder(
+            accumulator.status, non_subunit_name='stdout').run(
+                io.BytesIO(stream))
+        accumulator.finish()
+        self.assertEqual(len(expected), len(tests))
+        for want, got in zip(expected, tests):
+            self.assertEqual(set(want), set(got))
+            for key in ('id', 'tags', 'status', 'timestamps'):
+                self.assertEqual(want[key], got[key])
+            self.assertEqual(sorted(want['details']), sorted(got['details']))
+            for name, detail in want['details'].items():
+                self.assertEqual(detail.content_type,
+                                 got['details'][name].content_type)
+                self.assertEqual(b''.join(detail.iter_bytes()),
+                                 b''.join(got['details'][name].iter_bytes()))
+        return files
+
+    def test_sample_stream(self):
+        self._compare(_sample_stream('successful.subunit'))
+
+    def test_all_fields(self):
+        files = self._compare(_packets())
+        self.assertEqual([('stderr', b'outside of a test\n')], files)
+
+    def test_unfinished_tests(self):
+        packets = _packets()
+        self._compare(packets[:len(packets) // 2])
+
+    def test_content_types_not_shared(self):
+        tests = []
+        accumulator = subunit_v2.TestAccumulator(tests.append)
+        for test_id in ('test.a', 'test.b'):
+            accumulator.status(test_id, 'fail', None, 'log', b'x',
+                               'test/plain', None, None)
+        tests[0]['details']['log'].content_type.type = 'text'
+        self.assertEqual('test', tests[1]['details']['log'].content_type.type)
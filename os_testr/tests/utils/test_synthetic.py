@@ -0,0 +1,62 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+
+from os_testr import subunit_trace
+from os_testr.tests import base
+from os_testr.utils import synthetic
+
+
+class TestGenerateStream(base.TestCase):
+
+    def _generate(self, **kwargs):
+        output = io.BytesIO()
+        synthetic.generate_stream(output, **kwargs)
+        return output.getvalue()
+
+    def _trace(self, stream):
+        stdout = io.StringIO()
+        session = subunit_trace.TraceSession(stdout)
+        session.run(io.BytesIO(stream))
+        return session, stdout.getvalue()
+
+    def test_deterministic(self):
+        self.assertEqual(self._generate(num_tests=50, fail_rate=0.5),
+                         self._generate(num_tests=50, fail_rate=0.5))
+        self.assertNotEqual(self._generate(num_tests=50, seed=1),
+                            self._generate(num_tests=50, seed=2))
+
+    def test_statuses(self):
+        session, _ = self._trace(self._generate(
+            num_tests=1000, workers=3, fail_rate=0.1, skip_rate=0.2))
+        counters = session.counters
+        self.assertEqual(1000, counters.total)
+        self.assertEqual([0, 1, 2], sorted(counters.workers))
+        self.assertTrue(60 < counters.statuses['fail'] < 140)
+        self.assertTrue(140 < counters.statuses['skip'] < 260)
+        self.assertEqual(1000, counters.statuses['success'] +
+                         counters.statuses['fail'] +
+                         counters.statuses['skip'])
+
+    def test_attachments(self):
+        stream = self._generate(num_tests=10, attachment_size=4096,
+                                fail_rate=1.0)
+        self.assertGreater(len(stream), 10 * 4096)
+        _, output = self._trace(stream)
+        self.assertEqual(10, output.count('Captured traceback:'))
+        self.assertEqual(10, output.count('Captured stdout:'))
+
+    def test_stdout(self):
+        stream = self._generate(num_tests=100, stdout_rate=1.0)
+        _, output = self._trace(stream)
+        self.assertEqual(100, output.count(': starting test_'))
@@ -0,0 +1,139 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import os
+
+import fixtures
+import subunit
+
+from os_testr.tests import base
+from os_testr.utils import tail
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTail(base.TestCase):
+
+    def setUp(self):
+        super(TestTail, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'results.subunit')
+        self.clock = FakeClock()
+
+    def _append(self, data):
+        with open(self.path, 'ab') as stream:
+            stream.write(data)
+
+    def _tail(self, offset=0, **kwargs):
+        return tail.tail(self.path, offset, sleep=self.clock.sleep,
+                         clock=self.clock, **kwargs)
+
+    def test_growing_file(self):
+        self._append(b'first')
+        chunks = self._tail(idle_timeout=0.05)
+        self.assertEqual(b'first', next(chunks))
+        self._append(b'second')
+        self.assertEqual(b'second', next(chunks))
+        self.assertEqual([], list(chunks))
+        # the polling backs off while the file doesn't grow
+        self.assertEqual([0.01, 0.02, 0.04], self.clock.sleeps)
+
+    def test_poll_interval(self):
+        self._append(b'data')
+        self.assertEqual([b'ta'], list(self._tail(
+            offset=2, poll_interval=0.015, idle_timeout=0.05)))
+        self.assertEqual([0.01, 0.015, 0.015, 0.015], self.clock.sleeps)
+
+    def test_missing_file(self):
+        original_sleep = self.clock.sleep
+
+        def sleep(seconds):
+            original_sleep(seconds)
+            if len(self.clock.sleeps) == 2:
+                self._append(b'created')
+        self.clock.sleep = sleep
+        chunks = self._tail(idle_timeout=1)
+        self.assertEqual([b'created'], list(chunks))
+
+    def test_truncated_file(self):
+        self._append(b'data')
+        chunks = self._tail()
+        next(chunks)
+        os.truncate(self.path, 2)
+        self.assertRaises(tail.FollowError, next, chunks)
+
+    def test_offset_past_end(self):
+        self._append(b'data')
+        chunks = self._tail(offset=10)
+        error = self.assertRaises(tail.FollowError, next, chunks)
+        self.assertEqual('%s is shorter than the offset 10' % self.path,
+                         str(error))
+
+
+class TestResumableDecoder(base.TestCase):
+
+    def test_resume_offset(self):
+        output = io.BytesIO()
+        stream = subunit.v2.StreamResultToBytes(output)
+        stream.status(test_id='test.a', test_status='inprogress')
+        test_b = output.tell()
+        stream.status(test_id='test.b', test_status='inprogress')
+        stream.status(test_id='test.a', test_status='success')
+        stream.status(test_id='test.b', file_name='log', file_bytes=b'x')
+        end = output.tell()
+        stream.status(test_id='test.b', test_status='success')
+        packets = output.getvalue()
+
+        events = []
+        decoder = tail.ResumableDecoder(lambda *event: events.append(event))
+        self.assertEqual(0, decoder.resume_offset)
+        # the last packet is incomplete
+        decoder.feed(packets[:end + 3])
+        self.assertEqual(end, decoder.offset)
+        self.assertEqual(test_b, decoder.resume_offset)
+        decoder.feed(packets[end + 3:])
+        self.assertEqual(len(packets), decoder.resume_offset)
+
+        resumed = []
+        decoder = tail.ResumableDecoder(lambda *event: resumed.append(event),
+                                        offset=test_b)
+        decoder.feed(packets[test_b:])
+        self.assertEqual(events[1:], resumed)
+        self.assertEqual(len(packets), decoder.offset)
+
+
+class TestCheckpoint(base.TestCase):
+
+    def test_checkpoint(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        checkpoint = os.path.join(tmp_dir, 'checkpoint.json')
+        followed = os.path.join(tmp_dir, 'results.subunit')
+        self.assertEqual(0, tail.read_checkpoint(checkpoint, followed))
+        tail.write_checkpoint(checkpoint, followed, 42)
+        tail.write_checkpoint(checkpoint, followed, 4242)
+        self.assertEqual(4242, tail.read_checkpoint(checkpoint, followed))
+        self.assertEqual(0, tail.read_checkpoint(
+            checkpoint, os.path.join(tmp_dir, 'other.subunit')))
+        self.assertEqual(['checkpoint.json'], os.listdir(tmp_dir))
@@ -0,0 +1,74 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from ddt import data
+from ddt import ddt
+from ddt import unpack
+
+from os_testr.tests import base
+from os_testr.utils import testids
+
+TEMPEST_ID = ('tempest.api.compute.test_servers.ServersTest.test_create'
+              '[id-0a1b,smoke](boot_from_volume)')
+
+
+@ddt
+class TestCleanName(base.TestCase):
+
+    @data(('a.B.test_c', 'a.B.test_c', 'a.B.test_c'),
+          ('a.B.test_c[id-1,smoke]', 'a.B.test_c', 'a.B.test_c'),
+          ('a.B.test_c(scenario)', 'a.B.test_c(scenario)', 'a.B.test_c'),
+          (TEMPEST_ID,
+           'tempest.api.compute.test_servers.ServersTest.test_create'
+           '(boot_from_volume)',
+           'tempest.api.compute.test_servers.ServersTest.test_create'),
+          ('[tags]', '[tags]', '[tags]'),
+          ('a.b]c[d', 'a.b]c[d', 'a.b]c[d'))
+    @unpack
+    def test_clean_name(self, test_id, name, without_scenario):
+        self.assertEqual(name, testids.clean_name(test_id))
+        self.assertEqual(without_scenario,
+                         testids.clean_name(test_id, strip_scenarios=True))
+
+    def test_keep_tags(self):
+        self.assertEqual(TEMPEST_ID,
+                         testids.clean_name(TEMPEST_ID, strip_tags=False))
+
+
+class TestTestIdRegistry(base.TestCase):
+
+    def setUp(self):
+        super(TestTestIdRegistry, self).setUp()
+        self.registry = testids.TestIdRegistry()
+
+    def test_handles(self):
+        first = self.registry.handle(TEMPEST_ID)
+        second = self.registry.handle('a.B.test_c')
+        self.assertEqual((0, 1), (first, second))
+        self.assertEqual(first, self.registry.handle(TEMPEST_ID))
+        self.assertEqual(2, len(self.registry))
+        self.assertIn('a.B.test_c', self.registry)
+        self.assertNotIn('a.B.test_d', self.registry)
+        self.assertEqual(TEMPEST_ID, self.registry.test_id(first))
+
+    def test_class_name(self):
+        handle = self.registry.handle(TEMPEST_ID)
+        self.assertEqual('tempest.api.compute.test_servers.ServersTest',
+                         self.registry.class_name(handle))
+
+    def test_interned_class_names(self):
+        # ids built at runtime, so that they and their classes are distinct
+        # string objects
+        first = self.registry.handle('.'.join(['a', 'B', 'test_c']))
+        second = self.registry.handle('.'.join(['a', 'B', 'test_d']))
+        self.assertIs(self.registry.class_name(first),
+                      self.registry.class_name(second))
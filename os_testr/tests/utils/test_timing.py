@@ -0,0 +1,265 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import dbm
+from dbm import dumb
+import json
+import os
+from unittest import mock
+
+import fixtures
+
+from os_testr.tests import base
+from os_testr.utils import timing
+
+
+class TestTimingIndex(base.TestCase):
+
+    def setUp(self):
+        super(TestTimingIndex, self).setUp()
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.db_path = os.path.join(tmp_dir, 'times.dbm')
+        db = dbm.open(self.db_path, 'c')
+        db['test_a'] = '2.0'
+        db['test_b'] = '0.5'
+        db['test_zero'] = '0'
+        db.close()
+
+    def test_get(self):
+        index = timing.TimingIndex(self.db_path)
+        self.assertEqual(2.0, index.get('test_a'))
+        self.assertEqual(0.5, index.get('test_b'))
+        self.assertIsNone(index.get('test_zero'))
+        self.assertIsNone(index.get('test_missing'))
+        index.close()
+
+    def test_backend_detection(self):
+        index = timing.TimingIndex(self.db_path)
+        index.get('test_a')
+        self.assertIsInstance(index._backend, timing.DbmBackend)
+        index.close()
+
+    def test_missing_database(self):
+        index = timing.TimingIndex(self.db_path + '.missing')
+        self.assertIsNone(index.get('test_a'))
+
+    def test_database_opened_once(self):
+        index = timing.TimingIndex(self.db_path)
+        with mock.patch.object(timing, 'open_backend',
+                               wraps=timing.open_backend) as db_open:
+            for _ in range(10):
+                index.get('test_a')
+                index.get('test_missing')
+        self.assertEqual(1, db_open.call_count)
+        index.close()
+
+    def test_bounded_cache(self):
+        index = timing.TimingIndex(self.db_path, cache_size=1)
+        index.get('test_a')
+        index.get('test_b')
+        self.assertEqual(['test_b'], list(index._cache))
+        self.assertEqual(2.0, index.get('test_a'))
+        index.close()
+
+    def test_prefetch(self):
+        index = timing.TimingIndex(self.db_path)
+        index.prefetch()
+        # The whole database was loaded, misses no longer hit the database
+        backend = index._backend
+        index._backend = mock.Mock()
+        index._backend.get.side_effect = AssertionError('not prefetched')
+        self.assertEqual(2.0, index.get('test_a'))
+        self.assertIsNone(index.get('test_missing'))
+        self.assertFalse(index._backend.get.called)
+        index._backend = backend
+        index.close()
+
+    def test_prefetch_ids(self):
+        index = timing.TimingIndex(self.db_path)
+        index.prefetch(['test_b'])
+        self.assertEqual({'test_b': 0.5}, dict(index._cache))
+        index.close()
+
+
+class TestTimingBackends(base.TestCase):
+
+    times = {
+        'test_a': 2.0,
+        'test_b': 0.5,
+        'test_\u00e9': 1.25,
+        'test_c[id-1234]': 3.0,
+    }
+
+    def setUp(self):
+        super(TestTimingBackends, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+
+    def _check_backend(self, backend):
+        for test_id, run_time in self.times.items():
+            self.assertEqual(run_time, float(backend.get(test_id)))
+        self.assertIsNone(backend.get('test_missing'))
+        self.assertEqual(len(self.times), len(backend))
+        self.assertEqual(self.times,
+                         {k: float(v) for k, v in backend.items()})
+        backend.close()
+
+    def test_json_backend(self):
+        path = os.path.join(self.tmp_dir, 'times.json')
+        with open(path, 'w') as json_file:
+            json.dump(self.times, json_file)
+        backend = timing.open_backend(path)
+        self.assertIsInstance(backend, timing.JsonBackend)
+        self._check_backend(backend)
+
+    def test_binary_index_backend(self):
+        path = os.path.join(self.tmp_dir, 'times.idx')
+        timing.write_binary_index(path, self.times.items())
+        backend = timing.open_backend(path)
+        self.assertIsInstance(backend, timing.BinaryIndexBackend)
+        self._check_backend(backend)
+
+    def test_binary_index_lookups(self):
+        path = os.path.join(self.tmp_dir, 'times.idx')
+        times = dict(('test_%05d' % i, float(i + 1))
+                     for i in range(0, 2000, 2))
+        timing.write_binary_index(path, times.items())
+        backend = timing.BinaryIndexBackend(path)
+        for i in range(2000):
+            expected = times.get('test_%05d' % i)
+            self.assertEqual(expected, backend.get('test_%05d' % i))
+        self.assertIsNone(backend.get('a'))
+        self.assertIsNone(backend.get('z'))
+        backend.close()
+
+    def test_empty_binary_index(self):
+        path = os.path.join(self.tmp_dir, 'times.idx')
+        timing.write_binary_index(path, [])
+        backend = timing.open_backend(path)
+        self.assertIsNone(backend.get('test_a'))
+        self.assertEqual(0, len(backend))
+        backend.close()
+
+    def test_stestr_repository(self):
+        repo = os.path.join(self.tmp_dir, '.stestr')
+        os.mkdir(repo)
+        db = dumb.open(os.path.join(repo, 'times.dbm'), 'c')
+        for test_id, run_time in self.times.items():
+            db[test_id] = str(run_time)
+        db.close()
+        self.useFixture(fixtures.MonkeyPatch('os.getcwd',
+                                             lambda: self.tmp_dir))
+        backend = timing.open_backend()
+        self.assertIsInstance(backend, timing.StestrBackend)
+        self._check_backend(backend)
+        backend = timing.open_backend(repo)
+        self._check_backend(backend)
+
+    def test_timing_history_backend(self):
+        path = os.path.join(self.tmp_dir, 'history.sqlite')
+        history = timing.TimingHistory(path)
+        history.add_run(self.times.items())
+        history.close()
+        backend = timing.open_backend(path)
+        self.assertIsInstance(backend, timing.TimingHistory)
+        self._check_backend(backend)
+
+    def test_no_repository(self):
+        self.useFixture(fixtures.MonkeyPatch('os.getcwd',
+                                             lambda: self.tmp_dir))
+        self.assertIsNone(timing.open_backend())
+        self.assertIsNone(timing.TimingIndex().get('test_a'))
+
+
+class TestTimingHistory(base.TestCase):
+
+    def setUp(self):
+        super(TestTimingHistory, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'history.sqlite')
+        self.history = timing.TimingHistory(self.path, weight=0.25)
+        self.addCleanup(self.history.close)
+
+    def test_moving_statistics(self):
+        # the first runs weigh the same, their mean and variance
+        for run_time in (1.0, 2.0, 3.0):
+            self.history.add_run([('test_a', run_time)])
+        mean, variance, count = self.history.stats(['test_a'])['test_a']
+        self.assertAlmostEqual(2.0, mean)
+        self.assertAlmostEqual(2.0 / 3, variance)
+        self.assertEqual(3, count)
+        # the fifth run onwards weigh 0.25
+        self.history.add_run([('test_a', 2.0)])
+        self.history.add_run([('test_a', 4.0)])
+        mean, variance, count = self.history.stats(['test_a'])['test_a']
+        self.assertAlmostEqual(2.5, mean)
+        self.assertAlmostEqual(0.75 * (0.5 + 0.25 * 4), variance)
+        self.assertEqual(5, count)
+        self.assertEqual(5, self.history.runs)
+
+    def test_not_a_history(self):
+        path = os.path.join(os.path.dirname(self.path), 'times.json')
+        with open(path, 'w') as times_file:
+            json.dump({'test_a': 1.0}, times_file)
+        self.assertRaises(ValueError, timing.TimingHistory, path)
+
+    def test_several_run_times(self):
+        self.history.add_run([('test_a', 3.0), ('test_b', 1.0),
+                              ('test_a', 1.0)])
+        self.assertEqual({'test_a': (2.0, 1.0, 2), 'test_b': (1.0, 0.0, 1)},
+                         self.history.stats(['test_a', 'test_b', 'test_c']))
+        self.assertEqual(1, self.history.runs)
+
+    def test_batched_stats(self):
+        self.history.add_run(('test_%05d' % i, float(i + 1))
+                             for i in range(1200))
+        stats = self.history.stats('test_%05d' % i for i in range(0, 2400, 2))
+        self.assertEqual(600, len(stats))
+        self.assertEqual((11.0, 0.0, 1), stats['test_00010'])
+
+    def test_tests_counted_once(self):
+        self.history.add_run(('test_%05d' % i, 1.0) for i in range(100))
+        statements = []
+        self.history._db.set_trace_callback(statements.append)
+        for _ in range(3):
+            self.history.stats(['test_00001'])
+        self.assertEqual(100, len(self.history))
+        self.assertEqual(1, sum('COUNT(*)' in statement
+                                for statement in statements))
+        # tests added by a run are counted
+        self.history.add_run([('test_new', 1.0)])
+        self.assertEqual(101, len(self.history))
+
+    def test_compaction(self):
+        self.useFixture(fixtures.MonkeyPatch(
+            'os_testr.utils.timing.COMPACT_INTERVAL', 4))
+        self.useFixture(fixtures.MonkeyPatch(
+            'os_testr.utils.timing.STALE_RUNS', 3))
+        self.history.add_run([('test_gone', 1.0), ('test_kept', 1.0)])
+        self.history.add_run([('test_kept', 1.0), ('test_new', 1.0)])
+        self.history.add_run([('test_kept', 1.0)])
+        self.assertEqual(3, len(self.history))
+        with mock.patch.object(self.history, 'compact',
+                               wraps=self.history.compact) as compact:
+            self.history.add_run([('test_kept', 1.0)])
+        compact.assert_called_once_with()
+        self.assertEqual(['test_kept', 'test_new'],
+                         sorted(test_id for test_id, _ in
+                                self.history.items()))
+
+    def test_reopen(self):
+        self.history.add_run([('test_a', 1.0)])
+        self.history.close()
+        self.history = timing.TimingHistory(self.path)
+        self.assertEqual(1, self.history.runs)
+        self.assertEqual(1.0, self.history.get('test_a'))
+        self.assertTrue(timing.is_timing_history(self.path))
+        self.assertFalse(timing.is_timing_history(self.path + '.missing'))
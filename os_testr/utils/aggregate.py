@@ -0,0 +1,220 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Aggregate the subunit streams test runners send to a socket.
+
+An ``Aggregator`` accepts any number of concurrent connections on a Unix
+or TCP socket, from an asyncio event loop, and hands the bytes of each one
+to its own decoder as they arrive, so the streams of runners on other hosts
+can be traced live as a single run.
+"""
+
+import asyncio
+import collections
+import os
+import socket
+
+from os_testr.utils import subunit_v2
+
+Address = collections.namedtuple('Address', ['family', 'host', 'port',
+                                             'path'])
+
+
+class AddressError(ValueError):
+    """An address to listen on couldn't be parsed."""
+
+
+def parse_address(spec):
+    """Parse a ``unix:PATH`` or ``tcp:HOST:PORT`` address.
+
+    An IPv6 host can be given in brackets, like ``tcp:[::1]:4000``, and an
+    empty host listens on all the interfaces. A port of 0 picks a free one.
+    """
+    family, _, rest = spec.partition(':')
+    if family == 'unix' and rest:
+        return Address('unix', None, None, rest)
+    if family == 'tcp':
+        host, sep, port = rest.rpartition(':')
+        if sep and port.isdigit() and int(port) < 65536:
+            if host.startswith('[') and host.endswith(']'):
+                host = host[1:-1]
+            return Address('tcp', host or None, int(port), None)
+    raise AddressError('Invalid address %s, expected unix:PATH or '
+                       'tcp:HOST:PORT' % spec)
+
+
+def format_address(address):
+    """Get the ``parse_address()`` form of an address."""
+    if address.family == 'unix':
+        return 'unix:%s' % address.path
+    host = address.host or ''
+    if ':' in host:
+        host = '[%s]' % host
+    return 'tcp:%s:%d' % (host, address.port)
+
+
+def send(address, stream):
+    """Send a subunit byte stream to an ``Aggregator``, from a client.
+
+    :param address: The ``Address`` the aggregator listens on.
+    :param stream: A binary file like object, read until its end.
+    """
+    if address.family == 'unix':
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address.path)
+    else:
+        client = socket.create_connection((address.host or 'localhost',
+                                           address.port))
+    with client:
+        stream = getattr(stream, 'buffer', stream)
+        while True:
+            data = stream.read(subunit_v2.READ_SIZE)
+            if not data:
+                break
+            client.sendall(data)
+        client.shutdown(socket.SHUT_WR)
+
+
+class Aggregator(object):
+    """Serve the subunit streams sent by any number of clients at once.
+
+    For every client ``on_connection`` is called with the name of its
+    source, the host and port of a TCP client or ``unix-N`` for the Nth
+    client of a Unix socket, and returns the ``(feed, close)`` functions its
+    stream is decoded with: ``feed`` is called with the bytes of the stream
+    as they arrive and ``close`` once the client disconnected. The clients
+    are all served from the one thread running the event loop, so their
+    decoders can share the same state without any locking.
+
+    ``run()`` serves until ``connections`` clients have disconnected, until
+    no client was connected for ``idle_timeout`` seconds or until
+    interrupted by Ctrl-C, whichever comes first. The streams of clients
+    still connected then are closed as they are.
+
+    :param address: The ``Address`` to listen on.
+    :param ready: Called with the ``Address`` listened on once the socket
+        is bound, e.g. to learn the port picked for a port of 0.
+    """
+
+    def __init__(self, address, on_connection, connections=None,
+                 idle_timeout=None, ready=None):
+        self.address = address
+        self.on_connection = on_connection
+        self.connections = connections
+        self.idle_timeout = idle_timeout
+        self.ready = ready
+        self.accepted = 0
+        self.closed = 0
+        # the writer of every connected client, by the task serving it
+        self._clients = {}
+        self._error = None
+        self._changed = None
+        self._last_activity = None
+
+    def run(self):
+        """Serve the clients, see the class documentation for how long."""
+        asyncio.run(self._serve())
+
+    async def _listen(self):
+        address = self.address
+        if address.family == 'unix':
+            # asyncio replaces a socket left behind by an earlier run
+            return await asyncio.start_unix_server(self._serve_client,
+                                                   path=address.path)
+        return await asyncio.start_server(self._serve_client, address.host,
+                                          address.port)
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._last_activity = loop.time()
+        server = await self._listen()
+        try:
+            if self.ready is not None:
+                bound = self.address
+                if bound.family == 'tcp':
+                    bound = bound._replace(
+                        port=server.sockets[0].getsockname()[1])
+                self.ready(bound)
+            await self._wait(loop)
+        finally:
+            server.close()
+            # the clients still connected see the end of their stream
+            clients = list(self._clients)
+            for writer in self._clients.values():
+                writer.transport.abort()
+            await asyncio.gather(*clients, return_exceptions=True)
+            await server.wait_closed()
+            if self.address.family == 'unix':
+                try:
+                    os.unlink(self.address.path)
+                except OSError:
+                    pass
+        if self._error is not None:
+            raise self._error
+
+    async def _wait(self, loop):
+        while self._error is None:
+            if (self.connections is not None and
+                    self.closed >= self.connections):
+                return
+            timeout = None
+            if self.idle_timeout is not None and not self._clients:
+                timeout = (self._last_activity + self.idle_timeout -
+                           loop.time())
+                if timeout <= 0:
+                    return
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _source(self, writer):
+        peer = writer.get_extra_info('peername')
+        if self.address.family == 'tcp' and peer:
+            host, port = peer[:2]
+            if ':' in host:
+                host = '[%s]' % host
+            return '%s:%d' % (host, port)
+        return 'unix-%d' % self.accepted
+
+    async def _serve_client(self, reader, writer):
+        client = asyncio.current_task()
+        self._clients[client] = writer
+        self.accepted += 1
+        self._changed.set()
+        try:
+            feed, close = self.on_connection(self._source(writer))
+            try:
+                while True:
+                    try:
+                        data = await reader.read(subunit_v2.READ_SIZE)
+                    except ConnectionError:
+                        # what was received so far is still traced
+                        break
+                    if not data:
+                        break
+                    feed(data)
+            finally:
+                close()
+        except Exception as error:
+            # the whole run is stopped by an error of the decoders, it
+            # couldn't be reported on correctly
+            if self._error is None:
+                self._error = error
+        finally:
+            writer.close()
+            del self._clients[client]
+            self.closed += 1
+            self._last_activity = asyncio.get_running_loop().time()
+            self._changed.set()
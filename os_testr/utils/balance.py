@@ -0,0 +1,177 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Analysis of how the tests of a run were balanced over its workers."""
+
+import heapq
+
+PLAN_VERSION = 1
+
+
+class WorkerLoad(object):
+    """How a worker spent its part of a run.
+
+    :ivar busy: The seconds in which the worker ran a test, time in which
+        several tests overlapped is counted once.
+    :ivar idle: The seconds between the first start and the last stop of
+        the worker in which it ran no test.
+    :ivar gaps: The number of idle gaps between its tests.
+    :ivar longest_gap: The longest of these gaps in seconds.
+    """
+
+    __slots__ = ('worker', 'tests', 'start', 'stop', 'busy', 'idle', 'gaps',
+                 'longest_gap')
+
+    def __init__(self, worker, intervals):
+        # intervals are the (start, stop) times of the tests of the worker,
+        # sorted by start time
+        self.worker = worker
+        self.tests = len(intervals)
+        self.start = intervals[0][0]
+        self.stop = intervals[0][1]
+        self.busy = 0.0
+        self.idle = 0.0
+        self.gaps = 0
+        self.longest_gap = 0.0
+        busy_start = self.start
+        for start, stop in intervals[1:]:
+            if start > self.stop:
+                gap = start - self.stop
+                self.busy += self.stop - busy_start
+                self.idle += gap
+                self.gaps += 1
+                self.longest_gap = max(self.longest_gap, gap)
+                busy_start = start
+            self.stop = max(self.stop, stop)
+        self.busy += self.stop - busy_start
+
+    @property
+    def span(self):
+        return self.stop - self.start
+
+
+def lpt_partition(durations, workers):
+    """Spread tests over workers with the longest processing time rule.
+
+    Every test, longest first, goes to the worker with the least work so
+    far. The makespan is at most 4/3 of the best possible one.
+
+    :param durations: (duration, test_id) tuples.
+    :param workers: The number of workers to spread the tests over.
+    :return: A list of (load, test_ids) tuples, one per worker.
+    """
+    loads = [(0.0, worker) for worker in range(max(workers, 1))]
+    assignments = [[] for _ in loads]
+    for duration, test_id in sorted(durations, key=lambda d: (-d[0], d[1])):
+        load, worker = heapq.heappop(loads)
+        assignments[worker].append(test_id)
+        heapq.heappush(loads, (load + duration, worker))
+    totals = dict((worker, load) for load, worker in loads)
+    return [(totals[worker], tests)
+            for worker, tests in enumerate(assignments)]
+
+
+class BalanceReport(object):
+    """Analyze how well the tests of a run were spread over its workers.
+
+    The busy time, idle gaps and utilisation of every worker are worked out
+    from the start and stop times of its tests. The makespan of the run,
+    from the first test start to the last test stop, is compared with the
+    lower bound of any schedule of the same tests on as many workers, and
+    with the makespan the longest processing time rule would get, whose
+    assignment of tests to workers is available from ``plan()``.
+
+    :param results: (worker, records) pairs, the records have ``test_id``,
+        ``start`` and ``stop`` attributes with times in seconds. Tests
+        without both times are left out.
+    """
+
+    def __init__(self, results):
+        self.workers = []
+        self.durations = []
+        for worker, records in results:
+            intervals = []
+            for record in records:
+                if record.start is None or record.stop is None:
+                    continue
+                intervals.append((record.start, record.stop))
+                self.durations.append(
+                    (record.stop - record.start, record.test_id))
+            if intervals:
+                intervals.sort()
+                self.workers.append(WorkerLoad(worker, intervals))
+        self._plan = None
+
+    @property
+    def start(self):
+        return min(load.start for load in self.workers)
+
+    @property
+    def stop(self):
+        return max(load.stop for load in self.workers)
+
+    @property
+    def makespan(self):
+        if not self.workers:
+            return 0.0
+        return self.stop - self.start
+
+    @property
+    def busy(self):
+        return sum(load.busy for load in self.workers)
+
+    def utilisation(self, load=None):
+        """The fraction of the makespan spent running tests.
+
+        :param load: A ``WorkerLoad``, by default the utilisation of all the
+            workers together is given.
+        """
+        makespan = self.makespan
+        if not makespan:
+            return 0.0
+        if load is not None:
+            return load.busy / makespan
+        return self.busy / (makespan * len(self.workers))
+
+    @property
+    def ideal_makespan(self):
+        """A lower bound of the makespan on the same number of workers."""
+        if not self.durations:
+            return 0.0
+        return max(sum(d for d, _ in self.durations) / len(self.workers),
+                   max(d for d, _ in self.durations))
+
+    def plan(self):
+        """Get the longest processing time assignment of the tests.
+
+        :return: A list of (load, test_ids) tuples, one per worker.
+        """
+        if self._plan is None:
+            self._plan = lpt_partition(self.durations, len(self.workers))
+        return self._plan
+
+    @property
+    def lpt_makespan(self):
+        return max(load for load, _ in self.plan()) if self.workers else 0.0
+
+    def plan_dict(self):
+        """Get the plan as a JSON serializable dict for test schedulers."""
+        return {
+            'version': PLAN_VERSION,
+            'workers': len(self.workers),
+            'makespan': self.lpt_makespan,
+            'ideal_makespan': self.ideal_makespan,
+            'observed_makespan': self.makespan,
+            'assignments': [{'worker': worker, 'load': load, 'tests': tests}
+                            for worker, (load, tests)
+                            in enumerate(self.plan())],
+        }
@@ -0,0 +1,233 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Cluster failed tests by the signature of their traceback.
+
+When a broken service fails thousands of tests the same way, their
+tracebacks only differ by addresses, ids and times. A traceback is
+normalised by replacing those with placeholders, and its signature is the
+hash of the innermost frame and the exception of the normalised traceback,
+so the failures with the same cause share a cluster which can be reported
+once.
+"""
+
+import collections
+import hashlib
+import re
+
+# The number of bytes read from the end of a traceback, which is where the
+# innermost frame and the exception are
+TRACEBACK_LIMIT = 64 * 1024
+# The number of clusters kept apart, the failures with a signature seen
+# after that many are counted in a single overflow cluster
+MAX_CLUSTERS = 1000
+# The longest headline of a cluster
+HEADLINE_LIMIT = 200
+# The signature of the overflow cluster
+OVERFLOW = 'overflow'
+
+_NORMALIZERS = (
+    (re.compile(r'[0-9a-fA-F]{8}-(?:[0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}'),
+     '<uuid>'),
+    (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}'
+                r'(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'), '<time>'),
+    (re.compile(r'\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?'), '<time>'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<address>'),
+    (re.compile(r'\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{12,}\b'), '<id>'),
+    (re.compile(r'\d+\.\d+'), '<number>'),
+    (re.compile(r'\d{4,}'), '<number>'),
+)
+_FRAME = re.compile(r'^\s*File "[^"]*", line \d+, in ')
+
+
+def normalize(text):
+    """Replace the addresses, ids, times and long numbers of a text."""
+    for pattern, placeholder in _NORMALIZERS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def _split(text):
+    """Get the innermost frame and the exception lines of a traceback.
+
+    Text which isn't a python traceback has no frame, all of it is taken
+    for the exception.
+    """
+    lines = text.splitlines()
+    last = None
+    for index, line in enumerate(lines):
+        if _FRAME.match(line):
+            last = index
+    if last is None:
+        return '', [line for line in lines if line.strip()]
+    frame = lines[last].strip()
+    exception = []
+    for line in lines[last + 1:]:
+        # skip the source line and markers of the frame
+        if not exception and (not line.strip() or line[:1].isspace()):
+            continue
+        if line.strip():
+            exception.append(line)
+    return frame, exception
+
+
+def signature(text, test_id=None, status='fail'):
+    """Get the ``(signature, headline)`` of the traceback of a failure.
+
+    :param text: The traceback, or whatever the failure is reported with.
+    :param test_id: The id of the failed test, which is replaced by a
+        placeholder where the traceback mentions it.
+    :param status: The status of the test, failures without a traceback
+        are clustered by it.
+    :return: The signature, a hex digest, and the headline of the
+        traceback, its first exception line.
+    """
+    if test_id:
+        text = text.replace(test_id, '<test>')
+    frame, exception = _split(text)
+    key = '\n'.join([status, frame] + [normalize(line).rstrip()
+                                       for line in exception])
+    headline = exception[0].strip() if exception else status
+    if len(headline) > HEADLINE_LIMIT:
+        headline = headline[:HEADLINE_LIMIT - 3] + '...'
+    digest = hashlib.sha256(key.encode('utf8', 'replace')).hexdigest()
+    return digest[:12], headline
+
+
+def read_traceback(details):
+    """Get the text of the traceback attachments of a test.
+
+    Only the last ``TRACEBACK_LIMIT`` bytes of each are read, a chunk at a
+    time.
+    """
+    texts = []
+    for name, detail in details.items():
+        if not name.startswith('traceback'):
+            continue
+        tail = collections.deque()
+        size = 0
+        for chunk in detail.iter_bytes():
+            tail.append(chunk)
+            size += len(chunk)
+            while size - len(tail[0]) >= TRACEBACK_LIMIT:
+                size -= len(tail.popleft())
+        data = b''.join(tail)[-TRACEBACK_LIMIT:]
+        charset = detail.content_type.parameters.get('charset', 'utf8')
+        try:
+            texts.append(data.decode(charset, 'replace'))
+        except LookupError:
+            texts.append(data.decode('utf8', 'replace'))
+    return '\n'.join(texts)
+
+
+class FailureCluster(object):
+    """The failed tests sharing a traceback signature.
+
+    ``tests`` holds the ids of the tests in the order they failed, the
+    first one is the one reported in full. ``sample`` is free for the
+    caller to keep what it reports the cluster with, e.g. the result of the
+    first test.
+    """
+
+    __slots__ = ('signature', 'headline', 'tests', 'sample')
+
+    def __init__(self, signature, headline):
+        self.signature = signature
+        self.headline = headline
+        self.tests = []
+        self.sample = None
+
+    @property
+    def count(self):
+        return len(self.tests)
+
+    @property
+    def first(self):
+        return self.tests[0]
+
+    def to_dict(self):
+        return {'signature': self.signature, 'headline': self.headline,
+                'count': self.count, 'tests': list(self.tests)}
+
+
+class FailureClusters(object):
+    """Group failures into clusters as they come.
+
+    Only the ids of the tests and a headline are kept per cluster, not the
+    tracebacks, and at most ``max_clusters`` clusters are kept apart: the
+    failures with a new signature after that are counted in one overflow
+    cluster, so the memory used stays bounded however many distinct
+    failures a run has.
+
+    :param max_clusters: The number of clusters kept apart.
+    """
+
+    def __init__(self, max_clusters=MAX_CLUSTERS):
+        self.max_clusters = max_clusters
+        self.clusters = {}
+        self.overflow = None
+
+    def __len__(self):
+        return len(self.clusters) + (self.overflow is not None)
+
+    def __iter__(self):
+        """Iterate over the clusters, the largest first."""
+        clusters = list(self.clusters.values())
+        if self.overflow is not None:
+            clusters.append(self.overflow)
+        # sorted() is stable, equal clusters stay in the order they formed
+        return iter(sorted(clusters, key=lambda c: -c.count))
+
+    def _cluster(self, signature, headline):
+        cluster = self.clusters.get(signature)
+        if cluster is not None:
+            return cluster
+        if signature != OVERFLOW and len(self.clusters) < self.max_clusters:
+            cluster = self.clusters[signature] = FailureCluster(
+                signature, headline)
+            return cluster
+        if self.overflow is None:
+            self.overflow = FailureCluster(
+                OVERFLOW,
+                'Failures beyond the first %d clusters' % self.max_clusters)
+        return self.overflow
+
+    def add(self, test_id, text, status='fail'):
+        """Add a failed test with its traceback and get its cluster.
+
+        The test is the first of its cluster when the cluster's ``count``
+        is 1.
+        """
+        cluster = self._cluster(*signature(text, test_id, status))
+        cluster.tests.append(test_id)
+        return cluster
+
+    def add_test(self, test):
+        """Add a failed StreamToDict test dict, see ``add()``."""
+        return self.add(test['id'], read_traceback(test['details']),
+                        test['status'])
+
+    def merge(self, other):
+        """Add the clusters of another instance to this one.
+
+        The clusters with the same signature are joined, the first test and
+        ``sample`` of a cluster of this instance are kept.
+        """
+        for cluster in other:
+            mine = self._cluster(cluster.signature, cluster.headline)
+            if mine.sample is None:
+                mine.sample = cluster.sample
+            mine.tests.extend(cluster.tests)
+
+    def to_list(self):
+        """Get the clusters as JSON serializable dicts, the largest first."""
+        return [cluster.to_dict() for cluster in self]
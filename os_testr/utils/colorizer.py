@@ -42,7 +42,8 @@ class AnsiColorizer(object):
 
     allowing callers to write text to the stream in a particular color.
 
-    Colorizer classes must implement C{supported()} and C{write(text, color)}.
+    Colorizer classes must implement C{supported()}, C{render(text, color)}
+    and C{write(text, color)}.
     """
     _colors = dict(black=30, red=31, green=32, yellow=33,
                    blue=34, magenta=35, cyan=36, white=37)
@@ -74,6 +75,16 @@ class AnsiColorizer(object):
                 # guess false in case of error
                 return False
 
+    def render(self, text, color):
+        """Return the given text formatted to display in the given color.
+
+        @param text: Text to be formatted.
+
+        @param color: A string label for a color. e.g. 'red', 'white'.
+        """
+        color = self._colors[color]
+        return '\x1b[%s;1m%s\x1b[0m' % (color, text)
+
     def write(self, text, color):
         """Write the given text to the stream in the given color.
 
@@ -81,8 +92,7 @@ class AnsiColorizer(object):
 
         @param color: A string label for a color. e.g. 'red', 'white'.
         """
-        color = self._colors[color]
-        self.stream.write('\x1b[%s;1m%s\x1b[0m' % (color, text))
+        self.stream.write(self.render(text, color))
 
 
 class NullColorizer(object):
@@ -94,5 +104,26 @@ class NullColorizer(object):
     def supported(cls, stream=sys.stdout):
         return True
 
+    def render(self, text, color):
+        return text
+
     def write(self, text, color):
         self.stream.write(text)
+
+
+def get_colorizer(stream, enable_color=True):
+    """Get the best supported colorizer for a stream.
+
+    The colorizer is chosen by probing the stream itself, so the probe
+    (which can involve setting up the terminal through curses) should be
+    done once and the result reused.
+    """
+    if enable_color:
+        for color in [AnsiColorizer, NullColorizer]:
+            try:
+                if color.supported(stream):
+                    return color(stream)
+            except AttributeError:
+                # not a file like object which can tell if it is a tty
+                continue
+    return NullColorizer(stream)
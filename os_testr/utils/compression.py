@@ -0,0 +1,164 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Read compressed subunit streams as they are decompressed."""
+
+import contextlib
+import gzip
+import io
+import queue
+import threading
+
+from os_testr.utils import subunit_v2
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# The number of decompressed chunks of subunit_v2.READ_SIZE bytes which can
+# wait for the decoder, this bounds the memory used by a stream
+QUEUE_SIZE = 16
+# Seconds between two checks of the decompressing thread for the stream
+# being closed while the queue is full
+_PUT_TIMEOUT = 0.1
+
+
+class DecompressionError(Exception):
+    """A compressed stream couldn't be decompressed."""
+
+
+def detect(stream):
+    """Find out the compression of a binary stream from its magic bytes.
+
+    The stream isn't consumed, it has to either be buffered, like a file or
+    stdin, or seekable.
+
+    :return: 'gzip', 'zstd' or None when the stream isn't compressed, or it
+        can't be told without consuming it.
+    """
+    if hasattr(stream, 'peek'):
+        magic = stream.peek(len(ZSTD_MAGIC))[:len(ZSTD_MAGIC)]
+    elif getattr(stream, 'seekable', lambda: False)():
+        position = stream.tell()
+        magic = stream.read(len(ZSTD_MAGIC))
+        stream.seek(position)
+    else:
+        return None
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def _zstd_reader(stream):
+    try:
+        import zstandard
+    except ImportError:
+        raise DecompressionError(
+            'The stream is zstd compressed, the zstandard package is needed '
+            'to read it')
+    return zstandard.ZstdDecompressor().stream_reader(
+        stream, read_across_frames=True)
+
+
+class _DecompressedRaw(io.RawIOBase):
+    """The decompressed bytes of a stream, decompressed by a thread.
+
+    The thread reads and decompresses the stream a chunk at a time into a
+    queue of ``QUEUE_SIZE`` chunks, so decompressing overlaps with decoding
+    the bytes already decompressed and a fast decompressor doesn't get
+    ahead of the decoder by more than the queue.
+    """
+
+    def __init__(self, reader):
+        super(_DecompressedRaw, self).__init__()
+        self._chunks = queue.Queue(QUEUE_SIZE)
+        self._chunk = memoryview(b'')
+        self._done = False
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._decompress,
+                                        args=(reader,),
+                                        name='subunit-decompress',
+                                        daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._closing.is_set():
+            try:
+                self._chunks.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self, reader):
+        try:
+            while True:
+                data = reader.read(subunit_v2.READ_SIZE)
+                if not self._put(data) or not data:
+                    return
+        except Exception as e:
+            self._put(DecompressionError(
+                'Failed to decompress the stream: %s' % e))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._chunk:
+            if self._done:
+                return 0
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                self._done = True
+                raise chunk
+            if not chunk:
+                self._done = True
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            # The thread may be blocked reading a stream which is never
+            # going to end, so it is only told to stop and not waited for.
+            self._closing.set()
+            self._chunk = memoryview(b'')
+        super(_DecompressedRaw, self).close()
+
+
+@contextlib.contextmanager
+def decompressed(stream):
+    """Read a subunit stream whatever its compression.
+
+    A gzip or zstd compressed stream is decompressed on the fly, by a
+    thread, and never held in memory whole. Decompressing zstd needs the
+    zstandard package. Any other stream is read as it is.
+
+    :param stream: A binary file like object, or a text one with a
+        ``buffer``, like ``sys.stdin``.
+    :return: A context manager giving the stream to read from.
+    """
+    compression = detect(getattr(stream, 'buffer', stream))
+    if compression is None:
+        yield stream
+        return
+    source = getattr(stream, 'buffer', stream)
+    if compression == 'gzip':
+        reader = gzip.GzipFile(fileobj=source, mode='rb')
+    else:
+        reader = _zstd_reader(source)
+    with io.BufferedReader(_DecompressedRaw(reader),
+                           subunit_v2.READ_SIZE) as decompressed_stream:
+        yield decompressed_stream
@@ -0,0 +1,121 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Write the results of a test run as JSON Lines.
+
+Every line is a compact JSON object with an ``event`` key: ``test`` for a
+completed test, ``file`` for output which isn't part of a test and
+``summary`` for the summary of the run, which is always the last line.
+"""
+
+import json
+
+# The C string encoder of the json module when it is available, the output
+# is plain ASCII whatever the test ids contain
+encode_string = json.encoder.encode_basestring_ascii
+
+_TEST_LINE = ('{"event":"test","id":%s,"status":%s,"worker":%s,'
+              '"duration":%s,"tags":[%s]%s}\n')
+# The most encoded strings of each kind cached, like the statuses and the
+# workers, there are only a few of them in a run
+_CACHE_SIZE = 1024
+
+
+class JsonLinesWriter(object):
+    """Write test run events as JSON Lines to an ``output.OutputWriter``.
+
+    Test events are formatted from a fixed template, with only the strings
+    going through the json encoder, so no dict is built and serialized for
+    each test. The strings repeated across tests, the statuses, workers and
+    tags, are only encoded once. The lines are appended to the output
+    buffer, which is reused for the whole run and written out by its flush
+    policy.
+
+    A test event holds what the text output shows of the test, its
+    ``duration`` is in seconds with microsecond precision.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._encoded = {}
+        # the name and bytes of the output waiting to be written as a file
+        # event, which decoders may hand over a few bytes at a time
+        self._file_name = None
+        self._file_bytes = bytearray()
+        self._encoder = json.JSONEncoder(separators=(',', ':'),
+                                         check_circular=False)
+
+    def _encode(self, value):
+        # the JSON of a status, worker or tags
+        if len(self._encoded) >= _CACHE_SIZE:
+            self._encoded.clear()
+        if type(value) is tuple:
+            encoded = ','.join(encode_string(tag) for tag in sorted(value))
+        elif type(value) is int:
+            encoded = str(value)
+        else:
+            encoded = encode_string(str(value))
+        self._encoded[value] = encoded
+        return encoded
+
+    def write_test(self, record, tags=None, reason=None):
+        """Write a ``test`` event for a test record.
+
+        :param record: The ``ResultRecord`` of the test.
+        :param tags: The tags of the test.
+        :param reason: The reason the test was skipped, if any.
+        """
+        if self._file_name is not None:
+            self.flush()
+        encoded = self._encoded
+        status = record.status
+        worker = record.worker
+        tags = tuple(tags) if tags else ()
+        start = record.start
+        stop = record.stop
+        self.stream.write(_TEST_LINE % (
+            encode_string(record.test_id),
+            encoded.get(status) or self._encode(status),
+            encoded.get(worker) or self._encode(worker),
+            'null' if start is None or stop is None
+            else '%.6f' % (stop - start),
+            encoded.get(tags) or self._encode(tags) if tags else '',
+            ',"reason":%s' % encode_string(reason) if reason else ''))
+
+    def write_file(self, file_name, file_bytes):
+        """Write a ``file`` event for output which isn't part of a test.
+
+        Consecutive output of the same name is written as one event, once
+        anything else is written or on ``flush()``.
+        """
+        if file_name != self._file_name:
+            self.flush()
+            self._file_name = file_name
+        self._file_bytes += file_bytes
+
+    def flush(self):
+        """Write out the file event being put together, if any."""
+        if self._file_name is None:
+            return
+        self.stream.write('{"event":"file","name":%s,"data":%s}\n' % (
+            encode_string(self._file_name),
+            encode_string(self._file_bytes.decode('utf8', 'replace'))))
+        self._file_name = None
+        del self._file_bytes[:]
+
+    def write_summary(self, summary):
+        """Write the ``summary`` event, from a JSON serializable dict."""
+        self.flush()
+        event = {'event': 'summary'}
+        event.update(summary)
+        self.stream.write(self._encoder.encode(event))
+        self.stream.write('\n')
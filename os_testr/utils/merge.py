@@ -0,0 +1,134 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Merge the subunit v2 streams of several nodes into one.
+
+The streams are decoded packet by packet and merged on the timestamps of
+their packets with a heap, so only the packets of the current chunk of each
+stream are held in memory whatever the length of the streams. The workers
+of the streams are renumbered so they don't collide, and the route codes of
+their packets are prefixed by the number of their stream, so the same test
+running on two nodes at once is still two tests.
+"""
+
+import collections
+import datetime
+import heapq
+import operator
+
+from subunit import v2
+
+from os_testr.utils import subunit_v2
+
+# The sort key of the packets before the first timestamp of a stream
+_NO_TIMESTAMP = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+def _packets(source, index):
+    """Yield the ``(key, index, event, flags)`` of each packet of a stream.
+
+    The key of a packet is the latest timestamp seen in the stream up to
+    it, so the packets without a timestamp, like the attachments of a
+    test, and the ones of a stream whose clock went back stay where they
+    are in their stream.
+    """
+    events = collections.deque()
+
+    def on_event(*event):
+        events.append((event, decoder.flags))
+    decoder = subunit_v2.PacketDecoder(on_event, non_subunit_name='stdout')
+    source = getattr(source, 'buffer', source)
+    read = getattr(source, 'read1', source.read)
+    latest = _NO_TIMESTAMP
+    while True:
+        data = read(subunit_v2.READ_SIZE)
+        if data:
+            decoder.feed(data)
+        else:
+            decoder.close()
+        while events:
+            event, flags = events.popleft()
+            timestamp = event[7]
+            if timestamp is not None and timestamp > latest:
+                latest = timestamp
+            yield latest, index, event, flags
+        if not data:
+            return
+
+
+class WorkerMap(object):
+    """Number the workers of several streams in a single namespace.
+
+    The workers get consecutive numbers in the order they are first seen,
+    ``workers`` maps the ``(stream, worker)`` of each one to its number.
+    """
+
+    def __init__(self):
+        self.workers = {}
+
+    def tags(self, index, tags):
+        """Get the tags of a packet of a stream with its worker renumbered.
+        """
+        remapped = set()
+        for tag in tags:
+            if tag.startswith('worker-'):
+                try:
+                    worker = int(tag[7:])
+                except ValueError:
+                    pass
+                else:
+                    key = (index, worker)
+                    number = self.workers.get(key)
+                    if number is None:
+                        number = self.workers[key] = len(self.workers)
+                    tag = 'worker-%d' % number
+            remapped.add(tag)
+        return remapped
+
+
+def merge_streams(sources, output):
+    """Merge subunit v2 byte streams into one, in the order of their times.
+
+    The packets of each stream keep their order, the ones of different
+    streams are interleaved by timestamp, ties going to the stream given
+    first. Content which isn't subunit is written as a ``stdout`` file
+    packet.
+
+    :param sources: The binary file like objects of the streams.
+    :param output: The binary file like object to write the merged stream
+        to.
+    :return: The ``WorkerMap`` of the workers of the streams.
+    """
+    workers = WorkerMap()
+    write = output.write
+    encode = subunit_v2.encode_packet
+    packets = heapq.merge(*[_packets(source, index)
+                            for index, source in enumerate(sources)],
+                          key=operator.itemgetter(0, 1))
+    for _, index, event, flags in packets:
+        (test_id, test_status, test_tags, file_name, file_bytes, mime_type,
+         route_code, timestamp) = event
+        if test_tags:
+            test_tags = workers.tags(index, test_tags)
+        if route_code is None:
+            route_code = str(index)
+        else:
+            route_code = '%d/%s' % (index, route_code)
+        if flags is None:
+            runnable = True
+            eof = False
+        else:
+            runnable = bool(flags & v2.FLAG_RUNNABLE)
+            eof = bool(flags & v2.FLAG_EOF)
+        write(encode(test_id, test_status, test_tags, file_name, file_bytes,
+                     mime_type, route_code, timestamp, runnable, eof))
+    return workers
@@ -0,0 +1,164 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Buffered output with a configurable flush policy."""
+
+import codecs
+import time
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class FlushPolicy(object):
+    """Flush the output after every test."""
+
+    def test_done(self):
+        """Called after each test, returns True when output is flushed."""
+        return True
+
+
+class CountFlushPolicy(FlushPolicy):
+    """Flush the output after every ``count`` tests."""
+
+    def __init__(self, count):
+        self.count = count
+        self._pending = 0
+
+    def test_done(self):
+        self._pending += 1
+        if self._pending >= self.count:
+            self._pending = 0
+            return True
+        return False
+
+
+class IntervalFlushPolicy(FlushPolicy):
+    """Flush the output at most once every ``interval`` seconds."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = time.monotonic()
+
+    def test_done(self):
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
+
+
+class EndFlushPolicy(FlushPolicy):
+    """Only flush the output when the writer is closed."""
+
+    def test_done(self):
+        return False
+
+
+def parse_flush_policy(spec):
+    """Get the flush policy for a --flush command line value.
+
+    Accepted values are ``test``, ``end``, a number of tests ``N`` or an
+    interval in milliseconds ``Nms``.
+    """
+    if spec is None or spec == 'test':
+        return FlushPolicy()
+    if spec == 'end':
+        return EndFlushPolicy()
+    try:
+        if spec.endswith('ms'):
+            interval = int(spec[:-2])
+            if interval >= 0:
+                return IntervalFlushPolicy(interval / 1000.0)
+        else:
+            count = int(spec)
+            if count > 0:
+                return CountFlushPolicy(count)
+    except ValueError:
+        pass
+    raise ValueError("Invalid flush policy '%s', expected 'test', 'end', a "
+                     "number of tests or a number of milliseconds like "
+                     "'500ms'" % spec)
+
+
+class OutputWriter(object):
+    """Buffer output written to a stream.
+
+    Text and bytes are both accepted and are kept, in order, in a single
+    byte buffer. The buffer is written out when it grows past
+    ``buffer_size`` and flushed to the stream whenever the flush policy
+    asks for it after a test, so output is delivered with a few large
+    writes instead of many small writes and flushes.
+
+    :param stream: The text stream to write to. If it has a binary
+        ``buffer`` the encoded output is written straight to that,
+        otherwise it is decoded again, a character split between two
+        writes of bytes is kept until the rest of it comes.
+    :param policy: A ``FlushPolicy``, by default flush after every test.
+    """
+
+    def __init__(self, stream, policy=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.stream = stream
+        self.policy = policy or FlushPolicy()
+        self.buffer_size = buffer_size
+        self.encoding = getattr(stream, 'encoding', None) or 'utf8'
+        self.errors = getattr(stream, 'errors', None) or 'replace'
+        self._binary = getattr(stream, 'buffer', None)
+        self._decoder = None
+        if self._binary is None:
+            self._decoder = codecs.getincrementaldecoder(self.encoding)(
+                'replace')
+        self._buffer = bytearray()
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode(self.encoding, self.errors)
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            self._drain()
+
+    def _drain(self):
+        if not self._buffer:
+            return
+        if self._binary is not None:
+            # Anything written to the text layer directly has to go out
+            # first to keep the output in order.
+            self.stream.flush()
+            self._binary.write(self._buffer)
+        else:
+            self.stream.write(self._decoder.decode(self._buffer))
+        del self._buffer[:]
+
+    def flush(self):
+        """Write out and flush everything buffered so far."""
+        self._drain()
+        if self._binary is not None:
+            self._binary.flush()
+        else:
+            self.stream.flush()
+
+    def test_done(self):
+        """Flush the output if the policy asks for it after a test."""
+        if self.policy.test_done():
+            self.flush()
+
+    def close(self):
+        """Flush the remaining output, the stream itself is left open."""
+        self._drain()
+        if self._decoder is not None:
+            # an incomplete character left at the end is written replaced
+            tail = self._decoder.decode(b'', final=True)
+            if tail:
+                self.stream.write(tail)
+        self.flush()
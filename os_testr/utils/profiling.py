@@ -0,0 +1,226 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Per phase timing of the command line tools for ``--profile``."""
+
+import argparse
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import platform
+import sys
+import time
+
+import pbr.version
+
+REPORT_VERSION = 1
+
+
+def peak_rss():
+    """Get the peak resident memory of the process in bytes, if known."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere except on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _Phase(object):
+
+    __slots__ = ('calls', 'wall_time', 'cpu_time', 'self_wall_time',
+                 'self_cpu_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.self_wall_time = 0.0
+        self.self_cpu_time = 0.0
+
+
+class PhaseProfiler(object):
+    """Record the wall time, CPU time and calls of the phases of a run.
+
+    Phases nest, the report has both the total time spent in each phase and
+    the time spent in it outside of any nested phase, so the self times of
+    all the phases and the unaccounted time add up to the whole run.
+    Nothing is recorded unless code is explicitly run in a phase, through
+    ``phase()`` or a function wrapped with ``wrap()``, so a run without a
+    profiler pays nothing for this.
+
+    :param tool: The name of the tool being profiled.
+    :param report_path: The file to write the JSON report to, by default
+        it is written to stderr.
+    :param stats_path: If given a cProfile of the run is collected and
+        dumped to this file, it can be loaded with ``pstats``.
+    """
+
+    def __init__(self, tool, report_path=None, stats_path=None):
+        self.tool = tool
+        self.report_path = report_path
+        self.stats_path = stats_path
+        self.phases = collections.OrderedDict()
+        self.counters = collections.Counter()
+        # [phase, wall start, cpu start, nested wall, nested cpu]
+        self._stack = []
+        self._cprofile = None
+        self._start = None
+        self._stop = None
+
+    def start(self):
+        self._start = (time.perf_counter(), time.process_time())
+        if self.stats_path:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._stop = (time.perf_counter(), time.process_time())
+
+    def enter(self, name):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase()
+        self._stack.append(
+            [phase, time.perf_counter(), time.process_time(), 0.0, 0.0])
+
+    def exit(self):
+        phase, wall, cpu, nested_wall, nested_cpu = self._stack.pop()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        phase.calls += 1
+        phase.wall_time += wall
+        phase.cpu_time += cpu
+        phase.self_wall_time += wall - nested_wall
+        phase.self_cpu_time += cpu - nested_cpu
+        if self._stack:
+            parent = self._stack[-1]
+            parent[3] += wall
+            parent[4] += cpu
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def wrap(self, name, func):
+        """Get a version of func which runs in the named phase."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.exit()
+        return wrapper
+
+    def counting(self, name, func):
+        """Get a version of func which counts its calls."""
+        counters = self.counters
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            counters[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    def report(self):
+        """Get the report of the run as a JSON serializable dict."""
+        start = self._start or (0.0, 0.0)
+        stop = self._stop or (time.perf_counter(), time.process_time())
+        phases = collections.OrderedDict()
+        for name, phase in self.phases.items():
+            phases[name] = dict((key, getattr(phase, key))
+                                for key in _Phase.__slots__)
+        return {
+            'version': REPORT_VERSION,
+            'tool': self.tool,
+            'os_testr': pbr.version.VersionInfo(
+                'os_testr').version_string(),
+            'python': platform.python_version(),
+            'wall_time': stop[0] - start[0],
+            'cpu_time': stop[1] - start[1],
+            'peak_rss': peak_rss(),
+            'phases': phases,
+            'counters': dict(self.counters),
+        }
+
+    def close(self):
+        """Stop the run and write out the report and the cProfile dump."""
+        self.stop()
+        report = self.report()
+        if self.report_path:
+            with open(self.report_path, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+                report_file.write('\n')
+        else:
+            sys.stderr.write(json.dumps(report) + '\n')
+            sys.stderr.flush()
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(self.stats_path)
+
+
+def add_arguments(parser):
+    """Add the profiling options to an argparse parser."""
+    parser.add_argument('--profile', action='store_true',
+                        help="Write a JSON report of the time spent in each "
+                             "phase of the run to stderr")
+    parser.add_argument('--profile-file', metavar='FILE',
+                        help="Write the --profile report to FILE instead "
+                             "of stderr")
+    parser.add_argument('--profile-stats', metavar='FILE',
+                        help="Also dump a cProfile of the run to FILE, "
+                             "which can be read with pstats")
+
+
+def parse_known_args(argv):
+    """Take the profiling options out of a list of command line arguments.
+
+    This is for the tools which parse their other arguments by hand.
+
+    :return: The parsed options and the remaining arguments.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser)
+    return parser.parse_known_args(argv)
+
+
+def from_args(tool, args):
+    """Start a profiler for the parsed options, None if not asked for."""
+    if not (args.profile or args.profile_file or args.profile_stats):
+        return None
+    profiler = PhaseProfiler(tool, report_path=args.profile_file,
+                             stats_path=args.profile_stats)
+    profiler.start()
+    return profiler
+
+
+def phase(profiler, name):
+    """Get a context manager running in a phase of a profiler, if any."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
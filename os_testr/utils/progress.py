@@ -0,0 +1,181 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Progress and ETA of a test run from the historical run times."""
+
+import datetime
+import time
+
+# Seconds between redraws of the progress line on a terminal, and between
+# progress lines written anywhere else, like a CI log
+TTY_INTERVAL = 0.5
+LOG_INTERVAL = 10.0
+
+
+def read_expected_tests(path):
+    """Read the ids of the tests expected in a run, one per line."""
+    with open(path) as expected_file:
+        return [line.strip() for line in expected_file if line.strip()]
+
+
+class ProgressEstimator(object):
+    """Estimate how much of a run is left.
+
+    Every test is weighed by its historical run time, tests without one
+    count as the average of the known ones, or as 1 when no run times are
+    known at all, in which case the estimate is based on the number of
+    tests. The remaining time is the remaining work at the rate the work
+    was done so far, which takes the number of workers into account.
+
+    :param expected: The ids of the tests expected in the run. Without them
+        every test with a historical run time is expected.
+    :param timing_index: A ``timing.TimingIndex`` with the historical run
+        times, if any.
+    """
+
+    def __init__(self, expected=None, timing_index=None):
+        self.timing_index = timing_index
+        self.completed = 0
+        self.completed_work = 0.0
+        self._expected_work = 0.0
+        known = 0
+        known_work = 0.0
+        if expected is not None:
+            self._pending = {}
+            for test_id in expected:
+                run_time = self._run_time(test_id)
+                self._pending[test_id] = run_time
+                if run_time is not None:
+                    known += 1
+                    known_work += run_time
+            self.expected = len(self._pending)
+        else:
+            self._pending = None
+            if timing_index is not None:
+                known, known_work = timing_index.totals()
+            self.expected = known or None
+        self._mean = known_work / known if known else 1.0
+        self._remaining_work = known_work
+        if self._pending is not None:
+            self._remaining_work += self._mean * (self.expected - known)
+
+    def _run_time(self, test_id):
+        if self.timing_index is None:
+            return None
+        return self.timing_index.get(test_id)
+
+    def add(self, test_id):
+        """Count a test as completed."""
+        self.completed += 1
+        pending = self._pending
+        if pending is not None and test_id in pending:
+            run_time = pending.pop(test_id)
+            expected = True
+        else:
+            run_time = self._run_time(test_id)
+            # without a list every test with a run time is expected
+            expected = pending is None and run_time is not None
+        work = self._mean if run_time is None else run_time
+        if expected:
+            self._remaining_work -= work
+            self._expected_work += work
+        self.completed_work += work
+
+    @property
+    def remaining_work(self):
+        return max(self._remaining_work, 0.0)
+
+    def fraction(self):
+        """The fraction of the expected work done, None if unknown."""
+        if not self.expected:
+            return None
+        total = self._expected_work + self.remaining_work
+        return self._expected_work / total if total else 1.0
+
+    def eta(self, elapsed):
+        """The seconds left after ``elapsed`` seconds, None if unknown."""
+        if not self.expected or not self.completed_work:
+            return None
+        return self.remaining_work * elapsed / self.completed_work
+
+
+class ProgressLine(object):
+    """Show the progress of a run on a single line.
+
+    The line is redrawn at most every ``interval`` seconds, in place on a
+    terminal and as a new line anywhere else, so the cost per test is a
+    clock read.
+
+    :param stream: The output to write to, an ``output.OutputWriter``.
+    :param estimator: A ``ProgressEstimator``.
+    :param interval: The minimum number of seconds between two redraws, by
+        default ``TTY_INTERVAL`` on a terminal and ``LOG_INTERVAL``
+        otherwise.
+    :param clock: The clock the interval is measured with.
+    """
+
+    def __init__(self, stream, estimator, interval=None, clock=time.monotonic):
+        self.stream = stream
+        self.estimator = estimator
+        self.in_place = stream.isatty()
+        if interval is None:
+            interval = TTY_INTERVAL if self.in_place else LOG_INTERVAL
+        self.interval = interval
+        self.clock = clock
+        self.start = clock()
+        self._next = self.start + interval
+        self._shown = 0
+
+    def update(self, test_id):
+        """Count a completed test and redraw the line if it is due."""
+        self.estimator.add(test_id)
+        now = self.clock()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.draw(now)
+
+    def text(self, now):
+        estimator = self.estimator
+        elapsed = now - self.start
+        rate = estimator.completed / elapsed if elapsed > 0 else 0.0
+        if estimator.expected:
+            text = 'Progress: %s/%s tests (%.1f%%), %.1f tests/s' % (
+                estimator.completed, estimator.expected,
+                estimator.fraction() * 100, rate)
+            eta = estimator.eta(elapsed)
+            if eta is not None:
+                text += ', ETA %s' % datetime.timedelta(seconds=int(eta))
+            return text
+        return 'Progress: %s tests, %.1f tests/s' % (estimator.completed,
+                                                     rate)
+
+    def draw(self, now=None):
+        text = self.text(self.clock() if now is None else now)
+        if self.in_place:
+            self.stream.write('\r' + text.ljust(self._shown))
+            self._shown = len(text)
+        else:
+            self.stream.write(text + '\n')
+        self.stream.flush()
+
+    def clear(self):
+        """Clear the line before something else is written out."""
+        if self._shown:
+            self.stream.write('\r%s\r' % (' ' * self._shown))
+            self._shown = 0
+
+    def finish(self):
+        """Draw the final state of the run and end the line."""
+        self.draw()
+        if self.in_place:
+            self.stream.write('\n')
+            self._shown = 0
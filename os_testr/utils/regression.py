@@ -0,0 +1,279 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Detect test run time regressions against a baseline.
+
+The baseline holds the mean, variance and number of samples of the run
+time of every test. A test of a run is a regression when it is slower than
+its baseline mean and a one-sided Student's t-test says the slowdown is
+significant, so the tests which are noisy by nature don't get flagged for
+ordinary variations.
+"""
+
+import collections
+import json
+import math
+import os
+
+from os_testr.utils import timing
+
+BASELINE_VERSION = 1
+REPORT_VERSION = 1
+# The default significance level of the slowdowns flagged
+DEFAULT_ALPHA = 0.01
+# The baseline needs this many samples of a test to estimate its variance
+MIN_SAMPLES = 2
+
+BaselineStats = collections.namedtuple('BaselineStats',
+                                       ['mean', 'variance', 'count'])
+
+
+class Baseline(object):
+    """Base class for the stores baseline run time statistics are read from.
+    """
+
+    def lookup(self, test_ids):
+        """Get the statistics of the tests of a run.
+
+        :return: A dict of ``BaselineStats`` by test id, the tests without
+            statistics are left out.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class JsonBaseline(Baseline):
+    """Read baseline statistics from a JSON file, see ``write_baseline()``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as baseline_file:
+            try:
+                baseline = json.load(baseline_file)
+            except ValueError:
+                baseline = None
+        if (not isinstance(baseline, dict) or
+                baseline.get('version') != BASELINE_VERSION or
+                not isinstance(baseline.get('tests'), dict)):
+            raise ValueError('%s is not a run time baseline' % path)
+        self._tests = baseline['tests']
+
+    def lookup(self, test_ids):
+        found = {}
+        tests = self._tests
+        for test_id in test_ids:
+            stats = tests.get(test_id)
+            if stats is not None:
+                found[test_id] = BaselineStats(
+                    stats['mean'], stats['variance'], stats['count'])
+        return found
+
+
+class HistoryBaseline(Baseline):
+    """Read baseline statistics from a ``timing.TimingHistory``.
+
+    The moving averages of the history weigh the latest runs the most, the
+    sample count given is the number of runs they are about equivalent to,
+    or the number of runs of the test when it was run less than that.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._history = timing.TimingHistory(path)
+        weight = self._history.weight
+        self._samples = int(round((2.0 - weight) / weight))
+
+    def lookup(self, test_ids):
+        return {test_id: BaselineStats(mean, variance,
+                                       min(count, self._samples))
+                for test_id, (mean, variance, count)
+                in self._history.stats(test_ids).items()}
+
+    def close(self):
+        self._history.close()
+
+
+def write_baseline(path, stats):
+    """Write (test_id, ``BaselineStats``) pairs out as a JSON baseline.
+
+    The baseline is written to a temporary file and moved into place, so a
+    concurrent reader never sees it partially written.
+    """
+    tmp_path = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmp_path, 'w') as baseline_file:
+        json.dump({'version': BASELINE_VERSION,
+                   'tests': {test_id: test_stats._asdict()
+                             for test_id, test_stats in stats}},
+                  baseline_file)
+    os.replace(tmp_path, path)
+
+
+def open_baseline(path):
+    """Open the baseline statistics stored at path.
+
+    It is either a ``timing.TimingHistory`` or a JSON baseline.
+    """
+    if timing.is_timing_history(path):
+        return HistoryBaseline(path)
+    return JsonBaseline(path)
+
+
+def _continued_fraction(a, b, x):
+    # Lentz's evaluation of the continued fraction of the incomplete beta
+    # function, it converges quickly for x < (a + 1) / (a + b + 2)
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        for numerator in (
+                m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return result
+
+
+def _incomplete_beta(a, b, x):
+    """The regularized incomplete beta function I_x(a, b)."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _continued_fraction(a, b, x) / a
+    return 1.0 - front * _continued_fraction(b, a, 1.0 - x) / b
+
+
+def t_sf(t, df):
+    """The probability of Student's t with ``df`` degrees of freedom > t."""
+    tail = 0.5 * _incomplete_beta(df / 2.0, 0.5, df / (df + t * t))
+    return tail if t >= 0 else 1.0 - tail
+
+
+def slowdown_p_value(durations, baseline):
+    """Get the p-value of the durations of a test being slower by chance.
+
+    A single duration is compared with the distribution of the baseline
+    samples, several durations are compared with the baseline by Welch's
+    t-test.
+
+    :param durations: The durations of the test in the run.
+    :param baseline: The ``BaselineStats`` of the test.
+    """
+    count = len(durations)
+    mean = math.fsum(durations) / count
+    delta = mean - baseline.mean
+    if count > 1:
+        variance = math.fsum((d - mean) ** 2 for d in durations) / (count - 1)
+        baseline_error = baseline.variance / baseline.count
+        error = variance / count
+        variance_error = baseline_error + error
+        if variance_error > 0:
+            df = variance_error ** 2 / (
+                baseline_error ** 2 / (baseline.count - 1) +
+                error ** 2 / (count - 1))
+    else:
+        variance_error = baseline.variance * (1.0 + 1.0 / baseline.count)
+        df = baseline.count - 1
+    if variance_error <= 0:
+        # nothing varies, any slowdown is significant
+        return 0.0 if delta > 0 else 1.0
+    return t_sf(delta / math.sqrt(variance_error), df)
+
+
+class Regression(object):
+    """A test significantly slower than its baseline."""
+
+    __slots__ = ('test_id', 'baseline', 'duration', 'count', 'p_value')
+
+    def __init__(self, test_id, baseline, duration, count, p_value):
+        self.test_id = test_id
+        self.baseline = baseline
+        self.duration = duration
+        self.count = count
+        self.p_value = p_value
+
+    @property
+    def added(self):
+        """The run time the slowdown added to the run, in seconds."""
+        return (self.duration - self.baseline.mean) * self.count
+
+    def to_dict(self):
+        return {
+            'test_id': self.test_id,
+            'duration': self.duration,
+            'count': self.count,
+            'baseline_mean': self.baseline.mean,
+            'baseline_stddev': math.sqrt(self.baseline.variance),
+            'baseline_count': self.baseline.count,
+            'added': self.added,
+            'p_value': self.p_value,
+        }
+
+
+class RegressionReport(object):
+    """Compare the durations of the tests of a run with a baseline.
+
+    All the tests are looked up in the baseline at once, once the run is
+    over, so the comparison costs nothing while tracing and the baseline
+    can choose how to read them, e.g. a ``timing.TimingHistory`` reads
+    itself whole when the run has a large part of its tests. Tests with
+    fewer than ``MIN_SAMPLES`` baseline samples can't be compared.
+
+    :param durations: A dict of the durations of every test, by test id.
+    :param baseline: The ``Baseline`` to compare with.
+    :param alpha: The significance level of the slowdowns flagged.
+    """
+
+    def __init__(self, durations, baseline, alpha=DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.compared = 0
+        self.regressions = []
+        for test_id, stats in baseline.lookup(list(durations)).items():
+            if stats.count < MIN_SAMPLES:
+                continue
+            self.compared += 1
+            test_durations = durations[test_id]
+            duration = math.fsum(test_durations) / len(test_durations)
+            if duration <= stats.mean:
+                continue
+            p_value = slowdown_p_value(test_durations, stats)
+            if p_value < alpha:
+                self.regressions.append(Regression(
+                    test_id, stats, duration, len(test_durations), p_value))
+        self.regressions.sort(key=lambda r: (-r.added, r.test_id))
+
+    @property
+    def added(self):
+        """The run time all the regressions added to the run, in seconds."""
+        return math.fsum(r.added for r in self.regressions)
+
+    def to_dict(self):
+        return {
+            'version': REPORT_VERSION,
+            'alpha': self.alpha,
+            'compared': self.compared,
+            'added': self.added,
+            'regressions': [r.to_dict() for r in self.regressions],
+        }
@@ -0,0 +1,217 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Outputs a traced run is teed to, from a single decode of the stream.
+
+A sink gets the same events as the trace output of a
+``subunit_trace.TraceSession``, so any number of reports can be written
+while the stream is decoded once. The HTML report sink is
+``subunit2html.HtmlSink``.
+"""
+
+import re
+import shutil
+import tempfile
+from xml.sax import saxutils
+
+from os_testr.utils import jsonl
+from os_testr.utils import output
+from os_testr.utils import testids
+
+# The default number of bytes of each attachment of a failure in the JUnit
+# XML report
+JUNIT_ATTACHMENT_LIMIT = 64 * 1024
+
+# Characters which can't be part of an XML 1.0 document
+_INVALID_XML = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def skip_reason(test):
+    """Get the reason a test dict was skipped for, if any."""
+    reason = test['details'].get('reason')
+    if test['status'] != 'skip' or reason is None:
+        return None
+    return reason.as_text()
+
+
+def is_returncode(record):
+    """Check if a record is of the process-returncode test of a worker.
+
+    Like the trace output, the sinks leave these pseudo tests out.
+    """
+    return testids.clean_name(record.test_id) == 'process-returncode'
+
+
+class Sink(object):
+    """Base class of the outputs a traced run is teed to.
+
+    Every completed test is passed to ``test()`` and the output of the
+    stream which isn't part of a test to ``file()``, in the order of the
+    stream, then ``close()`` is called once the run is over.
+    """
+
+    def test(self, record, test):
+        """Handle a completed test.
+
+        :param record: The ``subunit_trace.ResultRecord`` of the test.
+        :param test: Its ``testtools.StreamToDict`` test dict, with its tags
+            and attachments. The attachments can only be read during the
+            call.
+        """
+
+    def file(self, file_name, file_bytes, route_code=None):
+        """Handle output of the stream which isn't part of a test.
+
+        :param route_code: The route code of the output, output with
+            different route codes comes from different workers.
+        """
+
+    def close(self, summary):
+        """Finish the output.
+
+        :param summary: The ``TraceSession.summary_data()`` of the run.
+        """
+
+
+class JsonSink(Sink):
+    """Write the run as JSON Lines to a file, like ``subunit-trace --json``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf8')
+        self._output = output.OutputWriter(self._file,
+                                           output.EndFlushPolicy())
+        self._writer = jsonl.JsonLinesWriter(self._output)
+
+    def test(self, record, test):
+        if is_returncode(record):
+            return
+        self._writer.write_test(record, test['tags'], skip_reason(test))
+
+    def file(self, file_name, file_bytes, route_code=None):
+        self._writer.write_file(file_name, file_bytes)
+
+    def close(self, summary):
+        self._writer.write_summary(summary)
+        self._output.close()
+        self._file.close()
+
+
+def _xml_text(text):
+    return saxutils.escape(_INVALID_XML.sub(u'\ufffd', text))
+
+
+def _xml_attribute(text):
+    return saxutils.quoteattr(_INVALID_XML.sub(u'\ufffd', text))
+
+
+class JUnitXmlSink(Sink):
+    """Write the run as a JUnit XML report.
+
+    The ``testcase`` elements are written to a temporary file as the tests
+    complete, so nothing but the totals of the run is held in memory, and
+    copied into the report on close, once the totals of the ``testsuite``
+    element are known. Failures get the text attachments of the test, each
+    cut down to its first ``attachment_limit`` bytes.
+
+    Expected failures are reported as passed tests and unexpected successes
+    as failures, tests which never completed as errors. The
+    process-returncode pseudo tests are left out, like they are by
+    ``JsonSink``.
+    """
+
+    def __init__(self, path, attachment_limit=JUNIT_ATTACHMENT_LIMIT):
+        self.path = path
+        self.attachment_limit = attachment_limit
+        self.tests = 0
+        self.failures = 0
+        self.errors = 0
+        self.skipped = 0
+        self.start = None
+        self.stop = None
+        self._cases = tempfile.TemporaryFile()
+
+    def _attachments(self, details):
+        texts = []
+        for name, content in details.items():
+            if content.content_type.type != 'text':
+                continue
+            data = bytearray()
+            for chunk in content.iter_bytes():
+                data += chunk
+                if len(data) > self.attachment_limit:
+                    break
+            elided = len(data) > self.attachment_limit
+            charset = content.content_type.parameters.get('charset', 'utf8')
+            data = bytes(data[:self.attachment_limit])
+            try:
+                text = data.decode(charset, 'replace')
+            except LookupError:
+                text = data.decode('utf8', 'replace')
+            if not text:
+                continue
+            texts.append(u'%s: {{{\n%s%s\n}}}\n' % (
+                name, text, u'\n[... elided ...]' if elided else u''))
+        return u''.join(texts)
+
+    def test(self, record, test):
+        if is_returncode(record):
+            return
+        status = record.status
+        base, bracket, tags = record.test_id.partition('[')
+        class_name, _, name = base.rpartition('.')
+        duration = record.duration
+        if record.start is not None:
+            if self.start is None or record.start < self.start:
+                self.start = record.start
+        if record.stop is not None:
+            if self.stop is None or record.stop > self.stop:
+                self.stop = record.stop
+        self.tests += 1
+        case = u'<testcase classname=%s name=%s time="%.3f"' % (
+            _xml_attribute(class_name), _xml_attribute(name + bracket + tags),
+            duration or 0.0)
+        if status == 'success' or status == 'xfail':
+            case += u'/>\n'
+        elif status == 'skip':
+            self.skipped += 1
+            case += u'>\n<skipped message=%s/>\n</testcase>\n' % (
+                _xml_attribute(skip_reason(test) or u''))
+        elif status == 'fail' or status == 'uxsuccess':
+            self.failures += 1
+            case += u'>\n<failure message=%s>%s</failure>\n</testcase>\n' % (
+                _xml_attribute(u'unexpected success' if status == 'uxsuccess'
+                               else u'test failed'),
+                _xml_text(self._attachments(test['details'])))
+        else:
+            self.errors += 1
+            case += u'>\n<error message=%s>%s</error>\n</testcase>\n' % (
+                _xml_attribute(status),
+                _xml_text(self._attachments(test['details'])))
+        self._cases.write(case.encode('utf8'))
+
+    def close(self, summary):
+        elapsed = 0.0
+        if self.start is not None and self.stop is not None:
+            elapsed = self.stop - self.start
+        with open(self.path, 'wb') as report:
+            report.write((
+                u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                u'<testsuite errors="%d" failures="%d" name="" skipped="%d" '
+                u'tests="%d" time="%.3f">\n' % (
+                    self.errors, self.failures, self.skipped, self.tests,
+                    elapsed)).encode('utf8'))
+            self._cases.seek(0)
+            shutil.copyfileobj(self._cases, report)
+            report.write(b'</testsuite>\n')
+        self._cases.close()
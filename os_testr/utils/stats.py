@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Streaming statistics of test durations."""
+
+import heapq
+import math
+
+
+class DurationHistogram(object):
+    """Streaming estimate of duration percentiles.
+
+    Durations are counted in fixed buckets whose bounds grow geometrically,
+    so the estimated percentiles are within ``precision`` (relative) of the
+    real ones while the memory used is constant, no matter how many
+    durations are added.
+
+    :param precision: The relative width of a bucket.
+    :param minimum: Durations up to this many seconds share the first bucket.
+    :param maximum: Durations from this many seconds share the last bucket.
+    """
+
+    def __init__(self, precision=0.01, minimum=1e-6, maximum=1e6):
+        self.minimum = minimum
+        self._log_growth = math.log1p(precision)
+        self._counts = [0] * (
+            int(math.log(maximum / minimum) / self._log_growth) + 2)
+        self.count = 0
+        self.smallest = None
+        self.largest = None
+
+    def add(self, duration):
+        if duration <= self.minimum:
+            index = 0
+        else:
+            index = min(
+                int(math.log(duration / self.minimum) / self._log_growth) + 1,
+                len(self._counts) - 1)
+        self._counts[index] += 1
+        self.count += 1
+        if self.smallest is None or duration < self.smallest:
+            self.smallest = duration
+        if self.largest is None or duration > self.largest:
+            self.largest = duration
+
+    def merge(self, other):
+        """Add the durations counted by another histogram to this one.
+
+        Both histograms must have been created with the same parameters.
+        """
+        if (other.minimum != self.minimum or
+                len(other._counts) != len(self._counts)):
+            raise ValueError('Only histograms with the same buckets can be '
+                             'merged')
+        for index, count in enumerate(other._counts):
+            self._counts[index] += count
+        self.count += other.count
+        for duration in (other.smallest, other.largest):
+            if duration is None:
+                continue
+            if self.smallest is None or duration < self.smallest:
+                self.smallest = duration
+            if self.largest is None or duration > self.largest:
+                self.largest = duration
+
+    def percentile(self, percent):
+        """Estimate the duration below which ``percent`` % of them fall."""
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                break
+        if index == 0:
+            return self.smallest
+        if index == len(self._counts) - 1:
+            return self.largest
+        # the geometric middle of the bucket
+        estimate = self.minimum * math.exp((index - 0.5) * self._log_growth)
+        return min(max(estimate, self.smallest), self.largest)
+
+
+class SlowestTests(object):
+    """Keep the ``count`` slowest tests seen with a bounded heap."""
+
+    def __init__(self, count):
+        self.count = count
+        self._heap = []
+        # tie breaker, so test ids are never compared
+        self._added = 0
+
+    def add(self, duration, test_id):
+        if self.count <= 0:
+            return
+        self._added += 1
+        entry = (duration, self._added, test_id)
+        if len(self._heap) < self.count:
+            heapq.heappush(self._heap, entry)
+        elif duration > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def slowest(self):
+        """Get a list of (duration, test_id) tuples, slowest first."""
+        return [(duration, test_id) for duration, _, test_id
+                in sorted(self._heap, reverse=True)]
+
+    def merge(self, other):
+        """Add the slowest tests kept by another ``SlowestTests``."""
+        for duration, test_id in other.slowest():
+            self.add(duration, test_id)
+
+
+class SlowestClasses(object):
+    """Total the durations of tests by class to find the slowest classes.
+
+    Unlike ``SlowestTests`` this keeps a running total per class, which is
+    still far less than a duration per test.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self._totals = {}
+
+    def add(self, duration, class_name):
+        totals = self._totals
+        entry = totals.get(class_name)
+        if entry is None:
+            totals[class_name] = [duration, 1]
+        else:
+            entry[0] += duration
+            entry[1] += 1
+
+    def merge(self, other):
+        """Add the class totals of another ``SlowestClasses``."""
+        totals = self._totals
+        for class_name, (duration, num) in other._totals.items():
+            entry = totals.get(class_name)
+            if entry is None:
+                totals[class_name] = [duration, num]
+            else:
+                entry[0] += duration
+                entry[1] += num
+
+    def slowest(self):
+        """Get a list of (total, number of tests, class) tuples."""
+        slowest = heapq.nlargest(self.count, self._totals.items(),
+                                 key=lambda item: item[1][0])
+        return [(total, num, name) for name, (total, num) in slowest]
@@ -0,0 +1,462 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A lean decoder for subunit v2 streams.
+
+``subunit.ByteStreamToStreamResult`` reads a stream one byte at a time
+between packets and passes every event as keyword arguments through a chain
+of ``StreamResult`` objects. ``PacketDecoder`` instead decodes packets from
+large chunks of the stream, checks their CRC and calls a single callback
+with positional arguments, and ``TestAccumulator`` collects the events of a
+test into the same test dict ``testtools.StreamToDict`` would. The events
+and test dicts produced are the same as the ones of the subunit and
+testtools path, including for corrupt packets and non-subunit content.
+"""
+
+import codecs
+import datetime
+import struct
+import zlib
+
+from subunit import v2
+from testtools import content
+from testtools.testresult import real
+
+SIGNATURE = 0xb3
+READ_SIZE = 64 * 1024
+
+_FLAGS = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT16 = struct.Struct('>H')
+_UINT24 = struct.Struct('>HB')
+
+_STATUSES = (None, 'exists', 'inprogress', 'success', 'uxsuccess', 'skip',
+             'fail', 'xfail')
+_STATUS_FLAGS = dict((status, flag) for flag, status in enumerate(_STATUSES))
+_VERSION_FLAGS = 0x2000
+
+
+class ParseError(Exception):
+    """A packet of the stream couldn't be decoded."""
+
+
+class _ShortRead(ParseError):
+    """The stream ended in the middle of a packet."""
+
+
+def _varint(data, pos):
+    """Decode the variable length integer at ``pos``.
+
+    :return: The value and the number of bytes it took up.
+    """
+    first = data[pos]
+    kind = first & 0xc0
+    value = first & 0x3f
+    if kind == 0x00:
+        return value, 1
+    elif kind == 0x40:
+        return (value << 8) | data[pos + 1], 2
+    elif kind == 0x80:
+        return (value << 16) | _UINT16.unpack_from(data, pos + 1)[0], 3
+    high, low = _UINT24.unpack_from(data, pos + 1)
+    return (value << 24) | high << 8 | low, 4
+
+
+def _utf8(data, pos):
+    length, consumed = _varint(data, pos)
+    pos += consumed
+    raw = data[pos:pos + length]
+    if len(raw) != length:
+        raise ParseError(
+            "UTF8 string at offset %d extends past end of packet: "
+            "claimed %d bytes, %d available" % (pos - 2, length, len(raw)))
+    if b'\0' in raw:
+        raise ParseError("UTF8 string at offset %d contains NUL byte" %
+                         (pos - 2,))
+    try:
+        return raw.decode('utf8'), pos + length
+    except UnicodeDecodeError:
+        raise ParseError("UTF8 string at offset %d is not UTF8" % (pos - 2,))
+
+
+class PacketDecoder(object):
+    """Incrementally decode a subunit v2 byte stream.
+
+    Bytes are passed in with ``feed()`` as they arrive and ``close()`` is
+    called at the end of the stream. For every event decoded ``on_event``
+    is called with the positional arguments ``(test_id, test_status,
+    test_tags, file_name, file_bytes, mime_type, route_code, timestamp)``,
+    which have the same meaning as the ``StreamResult.status()`` arguments.
+
+    ``offset`` is the position in the stream of the packet or content
+    being reported while ``on_event`` runs, and of the first byte which
+    hasn't been decoded yet, e.g. the start of an incomplete packet,
+    otherwise. ``flags`` are the flags of the packet being reported, with
+    the ``runnable`` and ``eof`` ones which aren't passed on, or None for
+    content which isn't a valid packet.
+
+    :param on_event: The callback events are passed to.
+    :param non_subunit_name: The file name bytes which aren't part of a
+        packet are reported under, if not given they are an error.
+    :param offset: The position in the stream of the first byte fed in,
+        when decoding starts in the middle of a stream.
+    """
+
+    def __init__(self, on_event, non_subunit_name=None, offset=0):
+        self.on_event = on_event
+        self.non_subunit_name = non_subunit_name
+        self.offset = offset
+        self.flags = None
+        # the start of a packet waiting for the rest of its bytes
+        self._pending = []
+        self._pending_size = 0
+        self._wanted = 0
+        self._codec = codecs.getincrementaldecoder('utf8')()
+        self._mid_character = False
+
+    def run(self, source):
+        """Decode a whole stream read from a binary file like object."""
+        source = getattr(source, 'buffer', source)
+        read = getattr(source, 'read1', source.read)
+        while True:
+            data = read(READ_SIZE)
+            if not data:
+                break
+            self.feed(data)
+        self.close()
+
+    def feed(self, data):
+        """Decode the complete packets of the bytes seen so far."""
+        if self._pending:
+            self._pending.append(data)
+            self._pending_size += len(data)
+            if self._pending_size < self._wanted:
+                return
+            data = b''.join(self._pending)
+        pos = self._decode(data, False)
+        if pos < len(data):
+            self._pending = [data[pos:]]
+            self._pending_size = len(data) - pos
+        else:
+            self._pending = []
+
+    def close(self):
+        """Decode what is left of the stream, reporting incomplete packets."""
+        data = b''.join(self._pending)
+        self._pending = []
+        self._decode(data, True)
+
+    def _decode(self, data, final):
+        """Decode packets and content from data.
+
+        :return: The offset of the first byte which still needs more data.
+        """
+        base = self.offset
+        pos = 0
+        end = len(data)
+        while pos < end:
+            self.offset = base + pos
+            if not self._mid_character and data[pos] == SIGNATURE:
+                packet_end = self._packet(data, pos, final)
+                if packet_end is None:
+                    return pos
+                pos = packet_end
+            else:
+                pos = self._non_subunit(data, pos)
+        self.offset = base + pos
+        return pos
+
+    def _non_subunit(self, data, pos):
+        if self.non_subunit_name is None:
+            raise ParseError("Non subunit content", data[pos:pos + 1])
+        start = pos
+        end = len(data)
+        while pos < end:
+            next_packet = data.find(b'\xb3', pos + 1)
+            if next_packet == -1:
+                next_packet = end
+            chunk = data[pos:next_packet]
+            if chunk.isascii():
+                # ASCII never continues a character, nor does it change
+                # what the decoder holds
+                self._mid_character = False
+            else:
+                self._mid_character = self._scan(chunk)
+            pos = next_packet
+            if not self._mid_character:
+                break
+        self.flags = None
+        self.on_event(None, None, None, self.non_subunit_name,
+                      data[start:pos], None, None, None)
+        return pos
+
+    def _scan(self, chunk):
+        """Track if the content ends in the middle of a utf8 character.
+
+        This is done byte by byte exactly like subunit does, a signature
+        byte in the middle of a character is content and not a packet.
+        Note that after an invalid byte the strict decoder keeps what it
+        held before, which subunit relies on.
+        """
+        decode = self._codec.decode
+        mid_character = self._mid_character
+        for i in range(len(chunk)):
+            try:
+                mid_character = not decode(chunk[i:i + 1])
+            except UnicodeDecodeError:
+                mid_character = False
+        return mid_character
+
+    def _packet(self, data, pos, final):
+        """Decode the packet at ``pos``.
+
+        :return: The offset after the packet or None when more data is
+            needed.
+        """
+        available = len(data) - pos
+        try:
+            if available < 6:
+                self._wanted = 6
+                raise _ShortRead("Short read - got %d bytes, wanted 5 bytes" %
+                                 (available - 1))
+            flags = _FLAGS.unpack_from(data, pos + 1)[0]
+            length, consumed = _varint(data, pos + 3)
+            if consumed == 4:
+                raise ParseError(
+                    "3 byte maximum given but 4 byte value found.")
+            if available < length:
+                self._wanted = length
+                raise _ShortRead("Short read - got %d bytes, wanted %d bytes" %
+                                 (available - 6, length - 6))
+            if length < 6:
+                raise ParseError("Packet length %d is too short" % length)
+        except _ShortRead as error:
+            if not final:
+                return None
+            # The stream ended, what is left is reported like subunit does
+            self._error(data[pos:pos + 6 if available >= 6 else pos + 1],
+                        error)
+            return len(data)
+        except ParseError as error:
+            self._error(data[pos:pos + 6], error)
+            return pos + 6
+        packet_end = pos + length
+        try:
+            self._decode_packet(data, pos, flags, consumed, packet_end)
+        except ParseError as error:
+            self._error(data[pos:packet_end], error)
+        return packet_end
+
+    def _decode_packet(self, data, pos, flags, consumed, packet_end):
+        crc = zlib.crc32(memoryview(data)[pos:packet_end - 4]) & 0xffffffff
+        stored = _UINT32.unpack_from(data, packet_end - 4)[0]
+        if crc != stored:
+            raise ParseError("Bad checksum - calculated (0x%x), stored (0x%x)"
+                             % (crc, stored))
+        # Field offsets are reported relative to where subunit's parser
+        # starts the body of the packet.
+        if consumed == 3:
+            body = data[pos + 6:packet_end - 4]
+            offset = 0
+        else:
+            body = data[pos + 1:packet_end - 4]
+            offset = 2 + consumed
+
+        if flags & v2.FLAG_TIMESTAMP:
+            seconds = _UINT32.unpack_from(body, offset)[0]
+            nanoseconds, consumed = _varint(body, offset + 4)
+            offset += 4 + consumed
+            timestamp = v2.EPOCH + datetime.timedelta(
+                seconds=seconds, microseconds=nanoseconds / 1000)
+        else:
+            timestamp = None
+        if flags & v2.FLAG_TEST_ID:
+            test_id, offset = _utf8(body, offset)
+        else:
+            test_id = None
+        if flags & v2.FLAG_TAGS:
+            count, consumed = _varint(body, offset)
+            offset += consumed
+            test_tags = set()
+            for _ in range(count):
+                tag, offset = _utf8(body, offset)
+                test_tags.add(tag)
+        else:
+            test_tags = None
+        if flags & v2.FLAG_MIME_TYPE:
+            mime_type, offset = _utf8(body, offset)
+        else:
+            mime_type = None
+        if flags & v2.FLAG_FILE_CONTENT:
+            file_name, offset = _utf8(body, offset)
+            size, consumed = _varint(body, offset)
+            offset += consumed
+            file_bytes = body[offset:offset + size]
+            if len(file_bytes) != size:
+                raise ParseError(
+                    "File content extends past end of packet: claimed %d "
+                    "bytes, %d available" % (size, len(file_bytes)))
+            offset += size
+        else:
+            file_name = file_bytes = None
+        if flags & v2.FLAG_ROUTE_CODE:
+            route_code, offset = _utf8(body, offset)
+        else:
+            route_code = None
+        self.flags = flags
+        self.on_event(test_id, _STATUSES[flags & 0x0007], test_tags,
+                      file_name, file_bytes, mime_type, route_code, timestamp)
+
+    def _error(self, packet, error):
+        self.flags = None
+        on_event = self.on_event
+        on_event('subunit.parser', None, None, 'Packet data', packet,
+                 'application/octet-stream', None, None)
+        on_event('subunit.parser', 'fail', None, 'Parser Error',
+                 error.args[0].encode('utf8'), 'text/plain;charset=utf8',
+                 None, None)
+
+
+def _number(value):
+    if value < 0x40:
+        return bytes((value,))
+    elif value < 0x4000:
+        return _UINT16.pack(value | 0x4000)
+    elif value < 0x400000:
+        return (value | 0x800000).to_bytes(3, 'big')
+    elif value < 0x40000000:
+        return _UINT32.pack(value | 0xc0000000)
+    raise ValueError("value too large to encode: %r" % (value,))
+
+
+def _utf8_field(text):
+    data = text.encode('utf8')
+    return _number(len(data)) + data
+
+
+def encode_packet(test_id=None, test_status=None, test_tags=None,
+                  file_name=None, file_bytes=None, mime_type=None,
+                  route_code=None, timestamp=None, runnable=True, eof=False):
+    """Encode an event as a subunit v2 packet.
+
+    The arguments are the ones of ``StreamResult.status()`` and the packet
+    is the one ``subunit.StreamResultToBytes`` writes, for a fraction of the
+    CPU time and without flushing anything.
+
+    :return: The bytes of the packet.
+    """
+    flags = _VERSION_FLAGS | _STATUS_FLAGS[test_status]
+    fields = []
+    if timestamp is not None:
+        flags |= v2.FLAG_TIMESTAMP
+        since_epoch = timestamp - v2.EPOCH
+        fields.append(_UINT32.pack(since_epoch.seconds +
+                                   since_epoch.days * 24 * 3600))
+        fields.append(_number(since_epoch.microseconds * 1000))
+    if test_id is not None:
+        flags |= v2.FLAG_TEST_ID
+        fields.append(_utf8_field(test_id))
+    if test_tags:
+        flags |= v2.FLAG_TAGS
+        fields.append(_number(len(test_tags)))
+        fields.extend(_utf8_field(tag) for tag in test_tags)
+    if runnable:
+        flags |= v2.FLAG_RUNNABLE
+    if mime_type:
+        flags |= v2.FLAG_MIME_TYPE
+        fields.append(_utf8_field(mime_type))
+    if file_name is not None:
+        flags |= v2.FLAG_FILE_CONTENT
+        fields.append(_utf8_field(file_name))
+        fields.append(_number(len(file_bytes)))
+        fields.append(file_bytes)
+    if eof:
+        flags |= v2.FLAG_EOF
+    if route_code is not None:
+        flags |= v2.FLAG_ROUTE_CODE
+        fields.append(_utf8_field(route_code))
+    body = b''.join(fields)
+    # the signature, the flags, the length itself and the CRC
+    length = len(body) + 7
+    if length <= 62:
+        length += 1
+    elif length <= 16381:
+        length += 2
+    elif length <= 4194300:
+        length += 3
+    else:
+        raise ValueError("Length too long: %r" % length)
+    content = b''.join((b'\xb3', _FLAGS.pack(flags), _number(length), body))
+    return content + _UINT32.pack(zlib.crc32(content) & 0xffffffff)
+
+
+class TestAccumulator(object):
+    """Collect the events of each test into a test dict.
+
+    This is the ``testtools.StreamToDict`` of ``PacketDecoder`` events:
+    ``on_test`` is called with the same dict once a test completes. Files
+    which don't belong to a test are passed to ``on_file`` with their name,
+    bytes and route code.
+    """
+
+    def __init__(self, on_test, on_file=None):
+        self.on_test = on_test
+        self.on_file = on_file
+        self._inprogress = {}
+        self._content_types = {}
+
+    def _content_type(self, mime_type):
+        parsed = self._content_types.get(mime_type)
+        if parsed is None:
+            content_type = real._make_content_type(mime_type)
+            parsed = (content_type.type, content_type.subtype,
+                      content_type.parameters)
+            self._content_types[mime_type] = parsed
+        # every attachment gets its own, output code may change it
+        return content.ContentType(parsed[0], parsed[1], dict(parsed[2]))
+
+    def status(self, test_id, test_status, test_tags, file_name, file_bytes,
+               mime_type, route_code, timestamp):
+        if test_id is None:
+            if file_name is not None and self.on_file is not None:
+                self.on_file(file_name, file_bytes, route_code)
+            return
+        key = (test_id, route_code)
+        test = self._inprogress.get(key)
+        if test is None:
+            test = {'id': test_id, 'tags': set(), 'details': {},
+                    'status': 'unknown', 'timestamps': [timestamp, None]}
+            self._inprogress[key] = test
+        if test_status is not None:
+            test['status'] = test_status
+        test['timestamps'][1] = timestamp
+        if file_name is not None and file_bytes:
+            details = test['details']
+            detail = details.get(file_name)
+            if detail is None:
+                chunks = []
+                detail = content.Content(self._content_type(mime_type),
+                                         lambda: chunks)
+                details[file_name] = detail
+            detail._get_bytes().append(file_bytes)
+        if test_tags is not None:
+            test['tags'] = test_tags
+        if test_status is not None and test_status != 'inprogress':
+            self.on_test(self._inprogress.pop(key))
+
+    def finish(self):
+        """Report the tests which never completed, like stopTestRun."""
+        inprogress = self._inprogress
+        while inprogress:
+            test = inprogress.popitem()[1]
+            test['timestamps'][1] = None
+            self.on_test(test)
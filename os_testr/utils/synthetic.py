@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Generate synthetic subunit v2 streams of realistic test runs."""
+
+import datetime
+import random
+
+import subunit
+from subunit import iso8601
+
+START_TIME = datetime.datetime(2015, 4, 17, 22, 23, 14, tzinfo=iso8601.UTC)
+
+_TRACEBACK = """Traceback (most recent call last):
+  File "%(module)s.py", line %(line)d, in %(method)s
+    self.assertEqual(expected, observed)
+  File "testtools/testcase.py", line 411, in assertEqual
+    self.assertThat(observed, matcher, message)
+testtools.matchers._impl.MismatchError: %(line)d != %(other)d
+"""
+
+
+def _attachment(rand, size):
+    """Log like text of about ``size`` bytes."""
+    lines = []
+    length = 0
+    while length < size:
+        line = '%s INFO [os_testr.synthetic] request %08x took %.3fs' % (
+            START_TIME.strftime('%Y-%m-%d %H:%M:%S'), rand.getrandbits(32),
+            rand.random())
+        lines.append(line)
+        length += len(line) + 1
+    return ('\n'.join(lines) + '\n').encode('utf8')[:size]
+
+
+def generate_stream(output, num_tests=1000, workers=4, fail_rate=0.0,
+                    skip_rate=0.0, attachment_size=0, stdout_rate=0.0,
+                    seed=0):
+    """Write a synthetic test run to ``output`` as a subunit v2 stream.
+
+    Tests are spread over classes and modules and run on ``workers``
+    workers, each with its own clock, with log normally distributed
+    durations. The stream is the same for the same arguments.
+
+    :param output: A binary file like object to write the stream to.
+    :param num_tests: The number of tests in the run.
+    :param workers: The number of workers running the tests.
+    :param fail_rate: The fraction of tests which fail.
+    :param skip_rate: The fraction of tests which are skipped.
+    :param attachment_size: The size in bytes of the stdout attachment of
+        every test, failures get a traceback on top of it.
+    :param stdout_rate: The fraction of tests preceded by a line of output
+        which isn't part of the subunit stream.
+    :param seed: The seed of the random choices made.
+    """
+    rand = random.Random(seed)
+    stream = subunit.v2.StreamResultToBytes(output)
+    clocks = [START_TIME] * max(workers, 1)
+    text = 'text/plain; charset=utf8'
+    for i in range(num_tests):
+        worker = i % len(clocks)
+        module = 'os_testr.synthetic.test_mod%d' % (i // 500)
+        method = 'test_%06d' % i
+        test_id = '%s.TestClass%d.%s[id-%08x,smoke]' % (
+            module, i // 25, method, rand.getrandbits(32))
+        tags = {'worker-%d' % worker}
+        start = clocks[worker]
+        stop = start + datetime.timedelta(
+            seconds=rand.lognormvariate(-3, 1.5))
+        clocks[worker] = stop
+        roll = rand.random()
+        if roll < fail_rate:
+            status = 'fail'
+        elif roll < fail_rate + skip_rate:
+            status = 'skip'
+        else:
+            status = 'success'
+
+        if stdout_rate and rand.random() < stdout_rate:
+            output.write(('worker %d: starting %s\n' % (
+                worker, method)).encode('utf8'))
+        stream.status(test_id=test_id, test_status='inprogress',
+                      test_tags=tags, timestamp=start)
+        if attachment_size:
+            stream.status(test_id=test_id, file_name='stdout',
+                          file_bytes=_attachment(rand, attachment_size),
+                          mime_type=text, eof=True)
+        if status == 'fail':
+            traceback = _TRACEBACK % {
+                'module': module.replace('.', '/'), 'method': method,
+                'line': rand.randint(10, 999), 'other': rand.randint(0, 9)}
+            stream.status(test_id=test_id, file_name='traceback',
+                          file_bytes=traceback.encode('utf8'),
+                          mime_type=text, eof=True)
+        elif status == 'skip':
+            stream.status(test_id=test_id, file_name='reason',
+                          file_bytes=b'Skipped by the synthetic run',
+                          mime_type=text, eof=True)
+        stream.status(test_id=test_id, test_status=status, test_tags=tags,
+                      timestamp=stop)
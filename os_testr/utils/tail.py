@@ -0,0 +1,144 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Follow a subunit file while it is being written."""
+
+import json
+import os
+import time
+
+from os_testr.utils import subunit_v2
+
+# Polling starts at MIN_POLL_INTERVAL seconds after the last data read and
+# backs off up to the poll interval asked for.
+MIN_POLL_INTERVAL = 0.01
+POLL_INTERVAL = 0.5
+# Seconds between two writes of the checkpoint file
+CHECKPOINT_INTERVAL = 1.0
+
+
+class FollowError(Exception):
+    """The followed file can't be followed any more."""
+
+
+def tail(path, offset=0, poll_interval=POLL_INTERVAL, idle_timeout=None,
+         sleep=time.sleep, clock=time.monotonic):
+    """Yield the bytes of a file from offset on, as they are written.
+
+    When the end of the file is reached it is polled again, first right
+    away and then less and less often, up to every ``poll_interval``
+    seconds. A file which doesn't exist yet is waited for the same way.
+
+    :param idle_timeout: Stop after this many seconds without new data, by
+        default the file is followed until the generator is closed.
+    :raises FollowError: When the file is truncated below what was read,
+        or is shorter than ``offset``.
+    """
+    start = offset
+    delay = MIN_POLL_INTERVAL
+    idle_since = clock()
+    source = None
+    try:
+        while True:
+            if source is None:
+                try:
+                    source = open(path, 'rb')
+                except FileNotFoundError:
+                    pass
+                else:
+                    source.seek(offset)
+            data = source.read1(subunit_v2.READ_SIZE) if source else b''
+            if data:
+                offset += len(data)
+                yield data
+                delay = MIN_POLL_INTERVAL
+                idle_since = clock()
+                continue
+            if (source is not None and
+                    os.fstat(source.fileno()).st_size < offset):
+                if offset == start:
+                    raise FollowError('%s is shorter than the offset %d'
+                                      % (path, offset))
+                raise FollowError('%s was truncated to less than the %d '
+                                  'bytes already read' % (path, offset))
+            if (idle_timeout is not None and
+                    clock() - idle_since >= idle_timeout):
+                return
+            sleep(delay)
+            delay = min(delay * 2, poll_interval)
+    finally:
+        if source is not None:
+            source.close()
+
+
+class ResumableDecoder(subunit_v2.PacketDecoder):
+    """A ``PacketDecoder`` which knows where it can be resumed from.
+
+    Decoding the stream again from ``resume_offset`` doesn't lose the
+    events of any test which hasn't completed yet, although the tests
+    which completed after that offset are reported again.
+    """
+
+    def __init__(self, on_event, non_subunit_name=None, offset=0):
+        super(ResumableDecoder, self).__init__(self._track, non_subunit_name,
+                                               offset)
+        self._on_event = on_event
+        # the offset of the first packet of every test still in progress
+        self._started = {}
+
+    def _track(self, test_id, test_status, test_tags, file_name, file_bytes,
+               mime_type, route_code, timestamp):
+        if test_id is not None:
+            key = (test_id, route_code)
+            if test_status is not None and test_status != 'inprogress':
+                self._started.pop(key, None)
+            elif key not in self._started:
+                self._started[key] = self.offset
+        self._on_event(test_id, test_status, test_tags, file_name,
+                       file_bytes, mime_type, route_code, timestamp)
+
+    @property
+    def resume_offset(self):
+        if self._started:
+            return min(self._started.values())
+        return self.offset
+
+
+def read_checkpoint(path, followed):
+    """Get the offset to resume following a file from.
+
+    :param path: The checkpoint file, it may not exist yet.
+    :param followed: The file followed, a checkpoint of another file isn't
+        used.
+    :return: The offset saved in the checkpoint, or 0.
+    """
+    try:
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (IOError, ValueError):
+        return 0
+    if checkpoint.get('path') != os.path.abspath(followed):
+        return 0
+    return checkpoint.get('offset', 0)
+
+
+def write_checkpoint(path, followed, offset):
+    """Save the offset to resume following a file from.
+
+    The checkpoint is replaced atomically, so it is never seen half written
+    by a tracer started after a crash.
+    """
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as checkpoint_file:
+        json.dump({'path': os.path.abspath(followed), 'offset': offset},
+                  checkpoint_file)
+    os.replace(tmp_path, path)
@@ -0,0 +1,90 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Clean up test ids, and intern them as integer handles.
+
+A test id looks like ``package.module.Class.method[tags](scenario)``, the
+tags and the testscenarios scenario being optional.
+"""
+
+
+def _enclosed(name, opening, closing):
+    # the (start, end) of the first opening...closing group of name, if any
+    start = name.find(opening)
+    if start > 0:
+        end = name.find(closing)
+        if end > start:
+            return start, end
+    return None
+
+
+def clean_name(name, strip_tags=True, strip_scenarios=False):
+    """Strip the tags, and optionally the scenario, out of a test id."""
+    if strip_tags:
+        tags = _enclosed(name, '[', ']')
+        if tags is not None:
+            name = name[:tags[0]] + name[tags[1] + 1:]
+    if strip_scenarios:
+        scenario = _enclosed(name, '(', ')')
+        if scenario is not None:
+            name = name[:scenario[0]] + name[scenario[1] + 1:]
+    return name
+
+
+class TestIdRegistry(object):
+    """Intern test ids as compact integer handles.
+
+    Every distinct id is kept once and numbered in the order it is first
+    seen, so a handle can stand for its test wherever the test itself
+    doesn't have to be kept. The class name of an id is worked out the
+    first time it is asked for and then memoised, and interned, all the
+    tests of a class share a single copy.
+    """
+
+    def __init__(self):
+        self._handles = {}
+        self._ids = []
+        self._classes = {}
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, test_id):
+        return test_id in self._handles
+
+    def _intern(self, string):
+        return self._strings.setdefault(string, string)
+
+    def handle(self, test_id):
+        """Get the handle of a test id, interning it if it is new."""
+        handle = self._handles.get(test_id)
+        if handle is None:
+            handle = self._handles[test_id] = len(self._ids)
+            self._ids.append(test_id)
+        return handle
+
+    def test_id(self, handle):
+        """Get the interned test id of a handle."""
+        return self._ids[handle]
+
+    def class_name(self, handle):
+        """Get the class name of a test, its id up to the last dot.
+
+        The tags and scenario are left as they are, this is how
+        subunit2html has always grouped the tests of its report.
+        """
+        class_name = self._classes.get(handle)
+        if class_name is None:
+            class_name = self._classes[handle] = self._intern(
+                self._ids[handle].rsplit('.', 1)[0])
+        return class_name
@@ -0,0 +1,529 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Lookup of historical test run times.
+
+Run times can be read from several backends:
+
+* the ``times.dbm`` database of a testrepository or stestr repository
+* a JSON file mapping test ids to their average run time in seconds
+* a sorted binary index, see ``write_binary_index()``, which is memory
+  mapped and binary searched so it never has to be loaded as a whole
+* a SQLite timing history, see ``TimingHistory``, which subunit-trace can
+  keep up to date itself
+"""
+
+import bisect
+import collections
+import json
+import mmap
+import os
+import sqlite3
+import struct
+
+# NOTE(mtreinish) on python3 anydbm was renamed dbm and the python2 dbm module
+# was renamed to dbm.ndbm, this block takes that into account
+try:
+    import anydbm as dbm
+except ImportError:
+    import dbm
+from dbm import dumb as dumb_dbm
+
+DEFAULT_CACHE_SIZE = 100000
+
+BINARY_INDEX_MAGIC = b'OSTRTIDX'
+BINARY_INDEX_VERSION = 1
+# magic, version, number of entries
+_BINARY_HEADER = struct.Struct('<8sII')
+# key offset, key length, run time
+_BINARY_ENTRY = struct.Struct('<QId')
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+HISTORY_VERSION = 1
+# The weight of the latest run time in the moving averages of the history
+HISTORY_WEIGHT = 0.1
+# The history is compacted every COMPACT_INTERVAL runs, the tests which
+# weren't run in the last STALE_RUNS runs are then dropped
+COMPACT_INTERVAL = 100
+STALE_RUNS = 1000
+# The number of test ids looked up in the history at once
+_LOOKUP_BATCH_SIZE = 500
+
+
+def default_times_db_path():
+    return os.path.join(os.getcwd(), '.testrepository', 'times.dbm')
+
+
+def default_stestr_times_db_path():
+    return os.path.join(os.getcwd(), '.stestr', 'times.dbm')
+
+
+class TimingBackend(object):
+    """Base class for the stores historical run times are read from.
+
+    Backends return the raw recorded value, filtering out unusable values
+    is left to ``TimingIndex``.
+    """
+
+    def get(self, test_id):
+        raise NotImplementedError()
+
+    def items(self):
+        """Iterate over all the (test_id, run_time) pairs of the backend."""
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class DbmBackend(TimingBackend):
+    """Read run times from a testrepository ``times.dbm`` database."""
+
+    dbm_module = dbm
+
+    def __init__(self, path):
+        self.path = path
+        self._db = self.dbm_module.open(path, 'r')
+
+    def get(self, test_id):
+        try:
+            return self._db.get(test_id)
+        except AttributeError:
+            # NOTE: gdbm doesn't support get()
+            try:
+                return self._db[test_id]
+            except KeyError:
+                return None
+
+    def items(self):
+        for key in self._db.keys():
+            test_id = key.decode('utf8') if isinstance(key, bytes) else key
+            yield test_id, self._db[key]
+
+    def __len__(self):
+        return len(self._db)
+
+    def close(self):
+        self._db.close()
+
+
+class StestrBackend(DbmBackend):
+    """Read run times from a stestr file repository.
+
+    stestr always stores its ``times.dbm`` with the pure python dbm.dumb
+    implementation.
+    """
+
+    dbm_module = dumb_dbm
+
+
+class JsonBackend(TimingBackend):
+    """Read run times from a JSON object mapping test ids to seconds."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as json_file:
+            self._times = json.load(json_file)
+
+    def get(self, test_id):
+        return self._times.get(test_id)
+
+    def items(self):
+        return iter(self._times.items())
+
+    def __len__(self):
+        return len(self._times)
+
+
+class _BinaryIndexKeys(object):
+    """Sequence view of the keys of a binary index for bisect."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, position):
+        return self._index._key(position)
+
+
+class BinaryIndexBackend(TimingBackend):
+    """Read run times from a memory mapped, sorted binary index.
+
+    The file holds a header, a table of fixed size entries sorted by test
+    id and the utf8 encoded test ids. Lookups binary search the entry table
+    in place, so only the pages touched by a lookup are ever read in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = None
+        header = self._file.read(_BINARY_HEADER.size)
+        if len(header) != _BINARY_HEADER.size:
+            self._file.close()
+            raise ValueError('%s is not a timing index' % path)
+        magic, version, self._count = _BINARY_HEADER.unpack(header)
+        if magic != BINARY_INDEX_MAGIC or version != BINARY_INDEX_VERSION:
+            self._file.close()
+            raise ValueError('%s is not a timing index' % path)
+        if self._count:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        self._keys = _BinaryIndexKeys(self)
+
+    def _entry(self, position):
+        return _BINARY_ENTRY.unpack_from(
+            self._map, _BINARY_HEADER.size + position * _BINARY_ENTRY.size)
+
+    def _key(self, position):
+        offset, length, _ = self._entry(position)
+        return self._map[offset:offset + length]
+
+    def get(self, test_id):
+        if not self._count:
+            return None
+        key = test_id.encode('utf8')
+        position = bisect.bisect_left(self._keys, key)
+        if position == self._count:
+            return None
+        offset, length, run_time = self._entry(position)
+        if self._map[offset:offset + length] != key:
+            return None
+        return run_time
+
+    def items(self):
+        for position in range(self._count):
+            offset, length, run_time = self._entry(position)
+            yield (self._map[offset:offset + length].decode('utf8'),
+                   run_time)
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+def write_binary_index(path, items):
+    """Write (test_id, run_time) pairs out as a binary timing index.
+
+    The index is written to a temporary file and moved into place, so
+    readers sharing the file never see a partially written index.
+    """
+    entries = sorted((test_id.encode('utf8'), float(run_time))
+                     for test_id, run_time in items)
+    keys_offset = _BINARY_HEADER.size + len(entries) * _BINARY_ENTRY.size
+    tmp_path = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as index_file:
+        index_file.write(_BINARY_HEADER.pack(
+            BINARY_INDEX_MAGIC, BINARY_INDEX_VERSION, len(entries)))
+        offset = keys_offset
+        for key, run_time in entries:
+            index_file.write(_BINARY_ENTRY.pack(offset, len(key), run_time))
+            offset += len(key)
+        for key, _ in entries:
+            index_file.write(key)
+    os.replace(tmp_path, path)
+
+
+class TimingHistory(TimingBackend):
+    """Exponentially weighted run time statistics of tests in SQLite.
+
+    For every test the history keeps the exponentially weighted moving
+    average and variance of its run time, the number of runs it was timed
+    in and the last of them. The first runs of a test weigh as much as each
+    other, until the latest run weighs ``weight``, so the statistics start
+    out as the plain mean and variance.
+
+    The statistics are kept in a table keyed by test id, without a separate
+    rowid index, and a run is added in a single transaction. Every
+    ``COMPACT_INTERVAL`` runs the tests not run in the last ``STALE_RUNS``
+    runs are dropped and the file is vacuumed.
+
+    :param path: The SQLite file, it is created if it doesn't exist.
+    :param weight: The weight of the latest run time in the averages.
+    """
+
+    # ?1 is the test id, ?2 its run time, ?3 the run and ?4 the weight
+    _UPSERT = (
+        'INSERT INTO tests (test_id, mean, variance, count, last_run) '
+        'VALUES (?1, ?2, 0.0, 1, ?3) '
+        'ON CONFLICT (test_id) DO UPDATE SET '
+        'mean = mean + MAX(?4, 1.0 / (count + 1)) * (?2 - mean), '
+        'variance = (1.0 - MAX(?4, 1.0 / (count + 1))) * '
+        '(variance + MAX(?4, 1.0 / (count + 1)) * (?2 - mean) * (?2 - mean)), '
+        'count = count + 1, last_run = ?3')
+
+    def __init__(self, path, weight=HISTORY_WEIGHT):
+        self.path = path
+        self.weight = weight
+        # the number of tests, counted on first use and again after the
+        # history was changed
+        self._size = None
+        self._db = sqlite3.connect(path)
+        try:
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS meta '
+                                 '(key TEXT PRIMARY KEY, value INTEGER)')
+                self._db.execute('CREATE TABLE IF NOT EXISTS tests '
+                                 '(test_id TEXT PRIMARY KEY, mean REAL, '
+                                 'variance REAL, count INTEGER, '
+                                 'last_run INTEGER) WITHOUT ROWID')
+                self._db.execute("INSERT OR IGNORE INTO meta VALUES "
+                                 "('version', ?), ('runs', 0)",
+                                 (HISTORY_VERSION,))
+        except sqlite3.DatabaseError:
+            self._db.close()
+            raise ValueError('%s is not a timing history' % path)
+        if self._meta('version') != HISTORY_VERSION:
+            self._db.close()
+            raise ValueError('%s has an unsupported timing history version'
+                             % path)
+
+    def _meta(self, key):
+        return self._db.execute('SELECT value FROM meta WHERE key = ?',
+                                (key,)).fetchone()[0]
+
+    @property
+    def runs(self):
+        """The number of runs added to the history."""
+        return self._meta('runs')
+
+    def get(self, test_id):
+        row = self._db.execute('SELECT mean FROM tests WHERE test_id = ?',
+                               (test_id,)).fetchone()
+        return row[0] if row else None
+
+    def items(self):
+        return self._db.execute('SELECT test_id, mean FROM tests')
+
+    def __len__(self):
+        if self._size is None:
+            self._size = self._db.execute(
+                'SELECT COUNT(*) FROM tests').fetchone()[0]
+        return self._size
+
+    def stats(self, test_ids):
+        """Get the (mean, variance, count) of a batch of tests by test id.
+
+        The tests without statistics are left out. The tests are looked up
+        in batches or, when they are a large part of the history, by
+        reading the whole history once.
+        """
+        test_ids = list(test_ids)
+        found = {}
+        if len(test_ids) > len(self) // 4:
+            wanted = set(test_ids)
+            for test_id, mean, variance, count in self._db.execute(
+                    'SELECT test_id, mean, variance, count FROM tests'):
+                if test_id in wanted:
+                    found[test_id] = (mean, variance, count)
+            return found
+        for start in range(0, len(test_ids), _LOOKUP_BATCH_SIZE):
+            batch = test_ids[start:start + _LOOKUP_BATCH_SIZE]
+            for test_id, mean, variance, count in self._db.execute(
+                    'SELECT test_id, mean, variance, count FROM tests '
+                    'WHERE test_id IN (%s)' % ', '.join('?' * len(batch)),
+                    batch):
+                found[test_id] = (mean, variance, count)
+        return found
+
+    def add_run(self, durations):
+        """Add the run times of a run to the history.
+
+        :param durations: The (test_id, run_time) pairs of the run, a test
+            run several times is counted once per run time.
+        """
+        with self._db:
+            run = self._meta('runs') + 1
+            self._db.execute("UPDATE meta SET value = ? WHERE key = 'runs'",
+                             (run,))
+            # in test id order the updates touch the table pages in order
+            weight = self.weight
+            self._db.executemany(self._UPSERT, (
+                (test_id, duration, run, weight)
+                for test_id, duration in sorted(durations)))
+        self._size = None
+        if run % COMPACT_INTERVAL == 0:
+            self.compact()
+
+    def compact(self):
+        """Drop the tests which went stale and reclaim the free space."""
+        with self._db:
+            self._db.execute('DELETE FROM tests WHERE last_run <= ?',
+                             (self.runs - STALE_RUNS,))
+        self._size = None
+        self._db.execute('VACUUM')
+
+    def close(self):
+        self._db.close()
+
+
+def is_timing_history(path):
+    """Check if a file is a ``TimingHistory``."""
+    try:
+        with open(path, 'rb') as history_file:
+            if history_file.read(len(SQLITE_MAGIC)) != SQLITE_MAGIC:
+                return False
+        db = sqlite3.connect(path)
+        try:
+            return db.execute("SELECT COUNT(*) FROM sqlite_master WHERE "
+                              "type = 'table' AND name = 'tests'"
+                              ).fetchone()[0] == 1
+        finally:
+            db.close()
+    except (IOError, sqlite3.Error):
+        return False
+
+
+def open_backend(path=None):
+    """Open the timing backend for a path.
+
+    The type of backend is detected from the contents of the path. When no
+    path is given the stestr and then the testrepository repositories of
+    the current directory are looked for. Returns None if no timing data
+    could be found.
+    """
+    if path is None:
+        for path, backend in ((default_stestr_times_db_path(), StestrBackend),
+                              (default_times_db_path(), DbmBackend)):
+            if dbm.whichdb(path):
+                return backend(path)
+        return None
+    if os.path.isdir(path):
+        path = os.path.join(path, 'times.dbm')
+    if is_timing_history(path):
+        return TimingHistory(path)
+    if dbm.whichdb(path):
+        return DbmBackend(path)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as timing_file:
+        start = timing_file.read(len(BINARY_INDEX_MAGIC))
+    if start == BINARY_INDEX_MAGIC:
+        return BinaryIndexBackend(path)
+    return JsonBackend(path)
+
+
+class TimingIndex(object):
+    """Cached lookup of the average run time of tests.
+
+    The timing backend is opened lazily on the first lookup and then kept
+    open for the lifetime of the index, instead of being opened and closed
+    for every test. Looked up averages (including misses) are kept in a
+    bounded LRU cache so repeated lookups are a dict access.
+
+    :param path: The timing data to read, see ``open_backend()``.
+    :param backend: An already opened ``TimingBackend`` to use instead of
+        opening one from ``path``.
+    """
+
+    def __init__(self, path=None, cache_size=DEFAULT_CACHE_SIZE,
+                 backend=None):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._backend = backend
+        self._opened = backend is not None
+        # Set when the whole backend fits in the cache, a cache miss then
+        # means the test has no recorded time.
+        self._complete = False
+
+    def _open(self):
+        if not self._opened:
+            self._opened = True
+            try:
+                self._backend = open_backend(self.path)
+            except Exception:
+                self._backend = None
+        return self._backend
+
+    @staticmethod
+    def _parse(value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        return value if value > 0 else None
+
+    def _store(self, test_id, value):
+        cache = self._cache
+        cache[test_id] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+            self._complete = False
+
+    def get(self, test_id):
+        """Return the average run time of a test or None if it is unknown."""
+        cache = self._cache
+        if test_id in cache:
+            cache.move_to_end(test_id)
+            return cache[test_id]
+        if self._complete:
+            return None
+        backend = self._open()
+        if backend is None:
+            return None
+        try:
+            value = self._parse(backend.get(str(test_id)))
+        except Exception:
+            value = None
+        self._store(test_id, value)
+        return value
+
+    def prefetch(self, test_ids=None):
+        """Load averages into the cache in bulk.
+
+        :param test_ids: The test ids to load. By default every entry of the
+            backend is loaded, provided they all fit in the cache.
+        """
+        backend = self._open()
+        if backend is None:
+            return
+        if test_ids is not None:
+            for test_id in test_ids:
+                self.get(test_id)
+            return
+        if len(backend) > self.cache_size:
+            return
+        for test_id, value in backend.items():
+            self._store(test_id, self._parse(value))
+        self._complete = True
+
+    def totals(self):
+        """Get the number of tests with a run time and their sum."""
+        backend = self._open()
+        if backend is None:
+            return 0, 0.0
+        count = 0
+        total = 0.0
+        for _, value in backend.items():
+            value = self._parse(value)
+            if value is not None:
+                count += 1
+                total += value
+        return count, total
+
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+        self._backend = None
+        self._opened = False
+        self._complete = False
+        self._cache.clear()